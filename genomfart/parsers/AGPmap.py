@@ -1,10 +1,13 @@
 import numpy as np
+import os
 import re
+import tempfile
 import numba as nb
 from numba import jit
 from bisect import bisect_left
+from genomfart.utils.caching import file_checksum
 
-@jit
+@jit(cache=True)
 def _getInterval(chromosome, position, start, end, markerPosition):
     """ Gets the markers, position of marker in bp flanking a position
     on the chromosome
@@ -39,7 +42,7 @@ def _getInterval(chromosome, position, start, end, markerPosition):
     left = start
     right = end
     while ((right - left) > 1):
-        mid = left + (right-left)/2
+        mid = left + (right-left)//2
         if (position == markerPosition[mid]):
             return np.array([mid,mid])
         if (position < markerPosition[mid]):
@@ -48,7 +51,7 @@ def _getInterval(chromosome, position, start, end, markerPosition):
             left = mid
     return np.array([left, right])
 
-@jit
+@jit(cache=True)
 def _getCmFromPosition(chromosome, position, start, end, markerPosition,
                        markercm):
     """ Gets cM position from chromosome bp
@@ -85,7 +88,7 @@ def _getCmFromPosition(chromosome, position, start, end, markerPosition,
     left = start
     right = end
     while ((right-left) > 1):
-        mid = left+(right-left)/2
+        mid = left+(right-left)//2
         if (position == markerPosition[mid]): return markercm[mid]
         if (position < markerPosition[mid]): right = mid
         else:
@@ -94,7 +97,7 @@ def _getCmFromPosition(chromosome, position, start, end, markerPosition,
         - markerPosition[left]);
     return markercm[left] + (position - markerPosition[left]) * g2pRatio
 
-@jit
+@jit(cache=True)
 def _getPositionFromCm(chromosome, cM, start, end, markerPosition,
                        markercm):
     """ Gets chromosome bp from cM position
@@ -131,7 +134,7 @@ def _getPositionFromCm(chromosome, cM, start, end, markerPosition,
     left = start
     right = end
     while ((right-left)>1):
-        mid = left + (right-left)/2
+        mid = left + (right-left)//2
         if (cM == markercm[mid]): return markerPosition[mid]
         if (cM < markercm[mid]): right = mid
         else:
@@ -140,6 +143,218 @@ def _getPositionFromCm(chromosome, cM, start, end, markerPosition,
             - markercm[left])
     return markerPosition[left] + int(np.round((cM - markercm[left]) * p2gRatio))
 
+def _findExact(values, queries, start, end):
+    """ Finds the marker each of many queries is exactly on, taking the same
+    steps as the binary search of the scalar functions so that a value shared
+    by several markers gives the same marker
+
+    Parameters
+    ----------
+    values : np.ndarray
+       Array of marker positions or cM positions
+    queries : np.ndarray
+       The positions or cM positions to find
+    start : int
+       Index of the first marker on the chromosome
+    end : int
+       Index of the last marker on the chromosome
+
+    Returns
+    -------
+    np.ndarray of marker indices, with -1 for queries not on a marker
+    """
+    found = np.full(len(queries), -1, dtype=np.int64)
+    inside = (queries >= values[start]) & (queries <= values[end])
+    found[inside & (queries == values[end])] = end
+    found[inside & (queries == values[start])] = start
+    active = np.flatnonzero(inside & (found < 0))
+    left = np.full(len(active), start, dtype=np.int64)
+    right = np.full(len(active), end, dtype=np.int64)
+    while len(active):
+        searching = (right - left) > 1
+        active, left, right = active[searching], left[searching], right[searching]
+        mid = left + (right-left)//2
+        hit = values[mid] == queries[active]
+        found[active[hit]] = mid[hit]
+        lower = queries[active] < values[mid]
+        left, right = np.where(lower, left, mid), np.where(lower, mid, right)
+        active, left, right = active[~hit], left[~hit], right[~hit]
+    return found
+
+def _getIntervals(positions, start, end, markerPosition):
+    """ Gets the indices of the markers flanking many positions on a chromosome
+    at once, as _getInterval does for one
+
+    Parameters
+    ----------
+    positions : np.ndarray of ints
+       The positions
+    start : int
+       Index of the first marker on the chromosome
+    end : int
+       Index of the last marker on the chromosome
+    markerPosition : np.ndarray
+       Array of marker positions
+
+    Returns
+    -------
+    (array of left marker indices, array of right marker indices). Both are the
+    marker's index if a position is on a marker, and -1 is given for a side
+    past the leftmost or rightmost marker
+    """
+    positions = np.asarray(positions)
+    # Index of the first marker at or after each position
+    right = start + np.searchsorted(markerPosition[start:end+1], positions, 'left')
+    left = right-1
+    exact = _findExact(markerPosition, positions, start, end)
+    onMarker = exact >= 0
+    left[onMarker] = right[onMarker] = exact[onMarker]
+    left[left < start] = -1
+    right[right > end] = -1
+    return left, right
+
+def _getCmFromPositions(positions, start, end, markerPosition, markercm):
+    """ Gets cM positions from many chromosome bp positions at once, with the
+    same interpolation and edge extrapolation as _getCmFromPosition
+
+    Parameters
+    ----------
+    positions : np.ndarray of ints
+       The positions
+    start : int
+       Index of the first marker on the chromosome
+    end : int
+       Index of the last marker on the chromosome
+    markerPosition : np.ndarray
+       Array of marker positions
+    markercm : np.ndarray
+       Array of marker cM positions
+
+    Returns
+    -------
+    np.ndarray of cM positions
+    """
+    positions = np.asarray(positions)
+    last = len(markerPosition)-1
+    # Index of the first marker at or after each position
+    first = start + np.searchsorted(markerPosition[start:end+1], positions, 'left')
+    left = np.clip(first-1, start, max(end-1, start))
+    right = np.minimum(left+1, last)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g2pRatio = (markercm[right] - markercm[left]) / \
+          (markerPosition[right] - markerPosition[left])
+        cms = markercm[left] + (positions - markerPosition[left]) * g2pRatio
+    below = positions < markerPosition[start]
+    if below.any():
+        g2pRatio = (markercm[start + 10] - markercm[start]) \
+          / (markerPosition[start + 10] - markerPosition[start])
+        cms[below] = markercm[start] - (markerPosition[start] - positions[below]) * g2pRatio
+    above = positions > markerPosition[end]
+    if above.any():
+        g2pRatio = (markercm[end] - markercm[end - 10]) / (markerPosition[end] - \
+            markerPosition[end - 10])
+        cms[above] = markercm[end] + (positions[above] - markerPosition[end]) * g2pRatio
+    exact = _findExact(markerPosition, positions, start, end)
+    cms[exact >= 0] = markercm[exact[exact >= 0]]
+    return cms
+
+def _getPositionsFromCm(cMs, start, end, markerPosition, markercm):
+    """ Gets chromosome bp positions from many cM positions at once, with the
+    same interpolation and edge extrapolation as _getPositionFromCm
+
+    Parameters
+    ----------
+    cMs : np.ndarray of floats
+       The positions in cM
+    start : int
+       Index of the first marker on the chromosome
+    end : int
+       Index of the last marker on the chromosome
+    markerPosition : np.ndarray
+       Array of marker positions
+    markercm : np.ndarray
+       Array of marker cM positions
+
+    Returns
+    -------
+    np.ndarray of bp positions
+    """
+    cMs = np.asarray(cMs, dtype=np.float64)
+    last = len(markercm)-1
+    # Index of the first marker at or after each cM position
+    first = start + np.searchsorted(markercm[start:end+1], cMs, 'left')
+    left = np.clip(first-1, start, max(end-1, start))
+    right = np.minimum(left+1, last)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p2gRatio = (markerPosition[right] - markerPosition[left]) / (markercm[right] \
+            - markercm[left])
+        offsets = np.round((cMs - markercm[left]) * p2gRatio)
+    bps = markerPosition[left] + np.where(np.isfinite(offsets), offsets, 0)
+    below = cMs < markercm[start]
+    if below.any():
+        p2gRatio = (markerPosition[start + 10] - \
+            markerPosition[start]) / (markercm[start + 10] - markercm[start])
+        bps[below] = markerPosition[start] - np.round((markercm[start] - cMs[below]) * p2gRatio)
+    above = cMs > markercm[end]
+    if above.any():
+        p2gRatio = (markerPosition[end] - markerPosition[end - 10]) / \
+          (markercm[end] - markercm[end - 10])
+        bps[above] = markerPosition[end] + np.round((cMs[above] - markercm[end]) * p2gRatio)
+    bps = bps.astype(np.int64)
+    exact = _findExact(markercm, cMs, start, end)
+    bps[exact >= 0] = markerPosition[exact[exact >= 0]]
+    return bps
+
+def _groupByChromosome(chromosomes, n):
+    """ Groups the entries of a batch query by chromosome
+
+    Parameters
+    ----------
+    chromosomes : int or array-like of ints
+       The chromosome of all n entries, or of each entry
+    n : int
+       The number of entries
+
+    Returns
+    -------
+    List of (chromosome, array of entry indices)
+    """
+    if np.ndim(chromosomes) == 0:
+        return [(chromosomes, np.arange(n))]
+    chromosomes = np.asarray(chromosomes)
+    return [(chrom, np.flatnonzero(chromosomes == chrom)) for chrom in np.unique(chromosomes)]
+
+def _sliceTable(chromosomes):
+    """ Gets the slice of markers on each chromosome
+
+    Parameters
+    ----------
+    chromosomes : np.ndarray
+       The chromosome of each marker. The markers of a chromosome must be
+       contiguous
+
+    Raises
+    ------
+    ValueError
+       If the markers of a chromosome are split up
+
+    Returns
+    -------
+    Dictionary of chromosome -> (first marker index, last marker index)
+    """
+    if len(chromosomes) == 0:
+        return {}
+    starts = np.flatnonzero(np.append(True, chromosomes[1:] != chromosomes[:-1]))
+    ends = np.append(starts[1:], len(chromosomes)) - 1
+    slices = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        chrom = chromosomes[start]
+        chrom = chrom.item() if hasattr(chrom, 'item') else chrom
+        if chrom in slices:
+            raise ValueError("The markers on chromosome %s are not contiguous" % chrom)
+        slices[chrom] = (start, end)
+    return slices
+
 class AGPMap:
     """ Class used to parse and manipulate data from an AGPmap with cM positions.
 
@@ -151,7 +366,7 @@ class AGPMap:
     The second has the marker first, the chromosome second, the cM position third,
     and the AGP position 6th
     """
-    def __init__(self, mapFile, useAgpV2=False):
+    def __init__(self, mapFile, useAgpV2=False, cacheFile=None):
         """ Instantiates the AGPMap parser
 
         Parameters
@@ -160,7 +375,15 @@ class AGPMap:
             The filename for the map
         useAgpV2 : boolean
             Whether this is version 2 of the AGPmap format
+        cacheFile : str, optional
+            An .npz file holding the parsed marker arrays. It is loaded instead
+            of parsing mapFile if it was made from a file with the same checksum
+            and format, and (re)written otherwise. If None, mapFile is always
+            parsed
         """
+        checksum = file_checksum(mapFile) if cacheFile else None
+        if cacheFile and self._loadCache(cacheFile, checksum, useAgpV2):
+            return
         colDict = {'chrom':1 if useAgpV2 else 0,
                    'marker':0 if useAgpV2 else 2,
                    'markercm':2 if useAgpV2 else 3,
@@ -177,6 +400,8 @@ class AGPMap:
         self.marker = []
         # Keep track of alternative marker names if necessary
         self.marker_alt_names = []
+        # Keep track of the numbers in the marker names
+        self.markerNumber = []
         # Load data
         mapFile = open(mapFile)
         header = mapFile.readline()
@@ -185,6 +410,8 @@ class AGPMap:
             chrom = int(line[colDict['chrom']])
             self.chrend[chrom-1] = i
             self.marker.append(line[colDict['marker']])
+            number = re.search(r'\d+', line[colDict['marker']])
+            self.markerNumber.append(int(number.group()) if number else -1)
             self.markercm.append(float(line[colDict['markercm']]))
             self.markerPosition.append(int(line[colDict['markerpos']]))
             if not useAgpV2:
@@ -195,6 +422,84 @@ class AGPMap:
         self.markerChromosome = np.array(self.markerChromosome)
         self.markercm = np.array(self.markercm)
         self.marker = np.array(self.marker)
+        self.markerNumber = np.array(self.markerNumber, dtype=np.int64)
+        ## Dictionary of chromosome -> (first marker index, last marker index)
+        self.chromSlices = _sliceTable(self.markerChromosome)
+        if cacheFile:
+            try:
+                self._writeCache(cacheFile, checksum, useAgpV2)
+            except (IOError, OSError):
+                pass
+    def _writeCache(self, cacheFile, checksum, useAgpV2):
+        """ Writes the parsed marker arrays to an .npz file
+
+        Parameters
+        ----------
+        cacheFile : str
+            The file to write
+        checksum : str
+            The checksum of the map file
+        useAgpV2 : boolean
+            Whether the map file is version 2 of the AGPmap format
+        """
+        chroms = sorted(self.chrend)
+        arrays = {'checksum': np.array(checksum),
+                  'useAgpV2': np.array(useAgpV2),
+                  'chrendKeys': np.array(chroms, dtype=np.int64),
+                  'chrendValues': np.array([self.chrend[c] for c in chroms], dtype=np.int64),
+                  'markerPosition': self.markerPosition,
+                  'markerChromosome': self.markerChromosome,
+                  'markercm': self.markercm,
+                  'marker': np.array(self.marker, dtype=str),
+                  'marker_alt_names': np.array(self.marker_alt_names, dtype=str),
+                  'markerNumber': self.markerNumber}
+        # Write to a temporary file first so that readers never see a partial cache
+        handle, tempFile = tempfile.mkstemp(suffix='.npz',
+                                            dir=os.path.dirname(os.path.abspath(cacheFile)))
+        try:
+            with os.fdopen(handle, 'wb') as cacheHandle:
+                np.savez(cacheHandle, **arrays)
+            os.rename(tempFile, cacheFile)
+        except:
+            os.remove(tempFile)
+            raise
+    def _loadCache(self, cacheFile, checksum, useAgpV2):
+        """ Loads the parsed marker arrays from an .npz file
+
+        Parameters
+        ----------
+        cacheFile : str
+            The file to load
+        checksum : str
+            The checksum of the map file
+        useAgpV2 : boolean
+            Whether the map file is version 2 of the AGPmap format
+
+        Returns
+        -------
+        True if the cache was loaded, or False if it is missing, unreadable or
+        was made from a different map file or format
+        """
+        try:
+            with np.load(cacheFile) as cache:
+                if str(cache['checksum']) != checksum or \
+                  bool(cache['useAgpV2']) != bool(useAgpV2):
+                    return False
+                chrend = dict(zip(cache['chrendKeys'].tolist(),
+                                  cache['chrendValues'].tolist()))
+                arrays = dict((name, cache[name]) for name in \
+                              ('markerPosition', 'markerChromosome', 'markercm', 'marker',
+                               'markerNumber'))
+                markerAltNames = cache['marker_alt_names'].tolist()
+        except Exception:
+            # Any problem with the cache means falling back to the map file
+            return False
+        self.chrend = chrend
+        for name, values in arrays.items():
+            setattr(self, name, values)
+        self.marker_alt_names = markerAltNames
+        self.chromSlices = _sliceTable(self.markerChromosome)
+        return True
     def getInterval(self, chromosome, position):
         """ Gets the markers, position of marker in bp flanking a position
         on the chromosome
@@ -210,16 +515,44 @@ class AGPMap:
         -------
         (left marker, left marker position, right marker, right marker position)
         """
-        end = self.chrend[chromosome-1]
-        start = 0
-        if chromosome > 1:
-            start = self.chrend[chromosome-2]+1
+        start, end = self._getChromosomeBounds(chromosome)
         left_ind,right_ind = _getInterval(chromosome, position, start, end,
                                           self.markerPosition)
         return (self.marker[left_ind] if left_ind != -1 else None,
                 self.markerPosition[left_ind] if left_ind != -1 else None,
                 self.marker[right_ind] if right_ind != -1 else None,
                 self.markerPosition[right_ind] if right_ind != -1 else None)
+    def getIntervals(self, chromosomes, positions):
+        """ Gets the markers flanking many positions at once
+
+        Parameters
+        ----------
+        chromosomes : int or array-like of ints
+           The chromosome of all the positions, or of each position
+        positions : array-like of ints
+           The positions
+
+        Returns
+        -------
+        (left marker indices, left marker positions, right marker indices,
+        right marker positions) as integer np.ndarrays. Indices and positions
+        are -1 for a side past the leftmost or rightmost marker. Marker names
+        and numbers are marker[indices] and markerNumber[indices]
+
+        Examples
+        --------
+        >>> agp_map = AGPMap(map_file)
+        >>> left, left_pos, right, right_pos = agp_map.getIntervals(10, snp_positions)
+        """
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        left = np.empty(len(positions), dtype=np.int64)
+        right = np.empty(len(positions), dtype=np.int64)
+        for chromosome, inds in _groupByChromosome(chromosomes, len(positions)):
+            start, end = self._getChromosomeBounds(int(chromosome))
+            left[inds], right[inds] = _getIntervals(positions[inds], start, end,
+                                                    self.markerPosition)
+        return (left, np.where(left >= 0, self.markerPosition[left], -1),
+                right, np.where(right >= 0, self.markerPosition[right], -1))
     def getFlankingMarkerIndices(self, chromosome, geneticPosition):
         """ Gets the indices of the markers flanking a given genetic position
 
@@ -234,10 +567,8 @@ class AGPMap:
         -------
         left flank index, right flank index
         """
-        frm = 0
-        if chromosome > 1:
-            frm = self.chrend[chromosome-2]+1
-        to = self.chrend[chromosome-1]+1
+        frm, to = self._getChromosomeBounds(chromosome)
+        to += 1
         ndx = bisect_left(self.markercm, geneticPosition, lo=frm, hi=to)
         if self.markercm[ndx] == geneticPosition:
             return ndx,ndx
@@ -257,10 +588,7 @@ class AGPMap:
         -------
         cM position
         """
-        end = self.chrend[chromosome-1]
-        start = 0
-        if chromosome > 1:
-            start = self.chrend[chromosome-2]+1
+        start, end = self._getChromosomeBounds(chromosome)
         return _getCmFromPosition(chromosome, position,
                                   start, end,
                                   self.markerPosition, self.markercm)
@@ -278,13 +606,77 @@ class AGPMap:
         -------
         The chromosome bp position
         """
-        end = self.chrend[chromosome-1]
-        start = 0
-        if chromosome > 1:
-            start = self.chrend[chromosome-2]+1
+        start, end = self._getChromosomeBounds(chromosome)
         return _getPositionFromCm(chromosome, cM,
                                   start, end,
                                   self.markerPosition, self.markercm)
+    def _getChromosomeBounds(self, chromosome):
+        """ Gets the indices of the first and last markers on a chromosome
+
+        Parameters
+        ----------
+        chromosome : int
+           The chromosome
+
+        Raises
+        ------
+        KeyError
+           If the chromosome has no markers
+
+        Returns
+        -------
+        (first marker index, last marker index)
+        """
+        return self.chromSlices[chromosome]
+    def getCmFromPositions(self, chromosomes, positions):
+        """ Gets cM positions from many chromosome bp positions at once
+
+        Parameters
+        ----------
+        chromosomes : int or array-like of ints
+           The chromosome of all the positions, or of each position
+        positions : array-like of ints
+           The positions
+
+        Returns
+        -------
+        np.ndarray of cM positions, as getCmFromPosition would give for each
+        position
+
+        Examples
+        --------
+        >>> agp_map = AGPMap(map_file)
+        >>> snp_cms = agp_map.getCmFromPositions(snp_chroms, snp_positions)
+        """
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        cms = np.empty(len(positions), dtype=np.float64)
+        for chromosome, inds in _groupByChromosome(chromosomes, len(positions)):
+            start, end = self._getChromosomeBounds(int(chromosome))
+            cms[inds] = _getCmFromPositions(positions[inds], start, end,
+                                            self.markerPosition, self.markercm)
+        return cms
+    def getPositionsFromCm(self, chromosomes, cMs):
+        """ Gets chromosome bp positions from many cM positions at once
+
+        Parameters
+        ----------
+        chromosomes : int or array-like of ints
+           The chromosome of all the cM positions, or of each one
+        cMs : array-like of floats
+           The positions in cM
+
+        Returns
+        -------
+        np.ndarray of bp positions, as getPositionFromCm would give for each
+        cM position
+        """
+        cMs = np.atleast_1d(np.asarray(cMs, dtype=np.float64))
+        bps = np.empty(len(cMs), dtype=np.int64)
+        for chromosome, inds in _groupByChromosome(chromosomes, len(cMs)):
+            start, end = self._getChromosomeBounds(int(chromosome))
+            bps[inds] = _getPositionsFromCm(cMs[inds], start, end,
+                                            self.markerPosition, self.markercm)
+        return bps
     def getFirstGeneticPosition(self, chromosome):
         """ Gets the first genetic position on a chromosome
 
@@ -297,9 +689,7 @@ class AGPMap:
         -------
         The first genetic position (in cM)
         """
-        if chromosome == 1: return self.markercm[0]
-        else:
-            return self.markercm[self.chrend[chromosome-2]+1]
+        return self.markercm[self._getChromosomeBounds(chromosome)[0]]
     def getFirstMarkerName(self, chromosome):
         """ Gets the name of the first marker
 
@@ -312,9 +702,7 @@ class AGPMap:
         -------
         The name of the first marker
         """
-        if chromosome == 1: return self.marker[0]
-        else:
-            return self.marker[self.chrend[chromosome-2]+1]
+        return self.marker[self._getChromosomeBounds(chromosome)[0]]
     def getLastMarkerName(self, chromosome):
         """ Gets the name of the last marker
 
@@ -327,7 +715,7 @@ class AGPMap:
         -------
         The name of the last marker
         """
-        return self.marker[self.chrend[chromosome-1]]
+        return self.marker[self._getChromosomeBounds(chromosome)[1]]
     def getLastGeneticPosition(self, chromosome):
         """ Gets the last genetic position on a chromosome
 
@@ -340,7 +728,7 @@ class AGPMap:
         -------
         The last genetic position (in cM)
         """
-        return self.markercm[self.chrend[chromosome-1]]
+        return self.markercm[self._getChromosomeBounds(chromosome)[1]]
     def getPhysPos(self, markerIndex):
         """ Gets the physical position of a marker
 
@@ -379,4 +767,245 @@ class AGPMap:
         -------
         Number of the marker
         """
-        return int(re.search('\d+',marker_name).group())
+        return int(re.search(r'\d+',marker_name).group())
+
+class GeneticMapStore(object):
+    """ Class used to hold several genetic maps (e.g. population-specific maps)
+    in one set of contiguous marker arrays.
+
+    The markers of each (map, chromosome) pair occupy a slice of the arrays,
+    sorted by physical position, and chromosomes may have any hashable name.
+    Batch queries are routed to the slices by chromosome, and the marker indices
+    they return index into the store's arrays
+
+    Examples
+    --------
+    >>> store = GeneticMapStore()
+    >>> store.addMapFile('pop1', 'pop1_map.txt')
+    >>> store.addMarkers('pop2', ['chr1','chr1','chr2'], ['m1','m2','m3'],
+    ...                  [100, 2000, 500], [0., 1.5, 0.])
+    >>> left, left_pos, right, right_pos = store.getIntervals('pop2', 'chr1', [150, 2500])
+    >>> store.marker[left].tolist()
+    ['m1', 'm2']
+    """
+    def __init__(self):
+        """ Instantiates an empty store
+        """
+        ## The names of the maps, in the order they were added
+        self.mapNames = []
+        ## Dictionary of (map name, chromosome) -> (first marker index, last marker index)
+        self.slices = {}
+        ## Dictionary of map name -> list of chromosomes, in map order
+        self.mapChromosomes = {}
+        # Marker arrays, shared by all of the maps
+        self.markerPosition = np.array([], dtype=np.int64)
+        self.markercm = np.array([], dtype=np.float64)
+        self.marker = np.array([], dtype=str)
+        self.markerNumber = np.array([], dtype=np.int64)
+    def __len__(self):
+        """ Gets the number of markers in the store
+        """
+        return len(self.markerPosition)
+    def addMarkers(self, mapName, chromosomes, markers, positions, cMs):
+        """ Adds a map from its markers
+
+        Parameters
+        ----------
+        mapName : str
+            The name of the map
+        chromosomes : array-like
+            The chromosome of each marker
+        markers : array-like of str
+            The name of each marker
+        positions : array-like of ints
+            The physical position of each marker
+        cMs : array-like of floats
+            The genetic position of each marker
+
+        Raises
+        ------
+        ValueError
+            If a map with the name is already in the store
+        """
+        if mapName in self.mapChromosomes:
+            raise ValueError("The store already has a map named %s" % mapName)
+        positions = np.asarray(positions, dtype=np.int64)
+        cMs = np.asarray(cMs, dtype=np.float64)
+        markers = np.asarray(markers, dtype=str)
+        chromCodes = {}
+        codes = np.array([chromCodes.setdefault(c, len(chromCodes)) for c in \
+                          np.asarray(chromosomes).tolist()], dtype=np.int64)
+        chromosomeList = sorted(chromCodes, key=chromCodes.get)
+        # Chromosomes keep the order they first appear in, and markers are
+        # sorted by position within them
+        order = np.lexsort((positions, codes))
+        offset = len(self)
+        bounds = np.searchsorted(codes[order], np.arange(len(chromosomeList)+1))
+        for i, chrom in enumerate(chromosomeList):
+            self.slices[(mapName, chrom)] = (offset+bounds[i], offset+bounds[i+1]-1)
+        numbers = [re.search(r'\d+', name) for name in markers[order].tolist()]
+        self.markerPosition = np.concatenate((self.markerPosition, positions[order]))
+        self.markercm = np.concatenate((self.markercm, cMs[order]))
+        self.marker = np.concatenate((self.marker, markers[order]))
+        self.markerNumber = np.concatenate((self.markerNumber,
+                                            np.array([int(x.group()) if x else -1 for x in numbers],
+                                                     dtype=np.int64)))
+        self.mapNames.append(mapName)
+        self.mapChromosomes[mapName] = chromosomeList
+    def addMap(self, mapName, agpMap):
+        """ Adds the markers of an AGPMap
+
+        Parameters
+        ----------
+        mapName : str
+            The name of the map
+        agpMap : AGPMap
+            The map to add
+
+        Raises
+        ------
+        ValueError
+            If a map with the name is already in the store
+        """
+        self.addMarkers(mapName, agpMap.markerChromosome, agpMap.marker,
+                        agpMap.markerPosition, agpMap.markercm)
+    def addMapFile(self, mapName, mapFile, useAgpV2=False, cacheFile=None):
+        """ Adds a map from an AGPmap file
+
+        Parameters
+        ----------
+        mapName : str
+            The name of the map
+        mapFile : str
+            The filename for the map
+        useAgpV2 : boolean
+            Whether this is version 2 of the AGPmap format
+        cacheFile : str, optional
+            An .npz file caching the parsed map (see AGPMap)
+
+        Raises
+        ------
+        ValueError
+            If a map with the name is already in the store
+        """
+        self.addMap(mapName, AGPMap(mapFile, useAgpV2, cacheFile=cacheFile))
+    def getSlice(self, mapName, chromosome):
+        """ Gets the indices of the first and last markers of a chromosome in a map
+
+        Parameters
+        ----------
+        mapName : str
+            The name of the map
+        chromosome : hashable
+            The chromosome
+
+        Raises
+        ------
+        KeyError
+            If the map has no markers on the chromosome
+
+        Returns
+        -------
+        (first marker index, last marker index)
+        """
+        try:
+            return self.slices[(mapName, chromosome)]
+        except KeyError:
+            raise KeyError("Map %s has no markers on chromosome %s" % (mapName, chromosome))
+    def _routeQueries(self, mapName, chromosomes, n):
+        """ Groups the entries of a batch query by the slice they fall in
+
+        Returns
+        -------
+        List of (first marker index, last marker index, array of entry indices)
+        """
+        routes = []
+        for chrom, inds in _groupByChromosome(chromosomes, n):
+            # Slices are keyed by plain Python values rather than numpy scalars
+            chrom = chrom.item() if hasattr(chrom, 'item') else chrom
+            routes.append(self.getSlice(mapName, chrom) + (inds,))
+        return routes
+    def getIntervals(self, mapName, chromosomes, positions):
+        """ Gets the markers of a map flanking many positions at once
+
+        Parameters
+        ----------
+        mapName : str
+            The name of the map
+        chromosomes : hashable or array-like
+            The chromosome of all the positions, or of each position
+        positions : array-like of ints
+            The positions
+
+        Raises
+        ------
+        KeyError
+            If the map has no markers on one of the chromosomes
+
+        Returns
+        -------
+        (left marker indices, left marker positions, right marker indices,
+        right marker positions), with -1 where there is no flanking marker
+        """
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        left = np.empty(len(positions), dtype=np.int64)
+        right = np.empty(len(positions), dtype=np.int64)
+        for start, end, inds in self._routeQueries(mapName, chromosomes, len(positions)):
+            left[inds], right[inds] = _getIntervals(positions[inds], start, end,
+                                                    self.markerPosition)
+        return (left, np.where(left >= 0, self.markerPosition[left], -1),
+                right, np.where(right >= 0, self.markerPosition[right], -1))
+    def getCmFromPositions(self, mapName, chromosomes, positions):
+        """ Gets cM positions in a map from many chromosome bp positions at once
+
+        Parameters
+        ----------
+        mapName : str
+            The name of the map
+        chromosomes : hashable or array-like
+            The chromosome of all the positions, or of each position
+        positions : array-like of ints
+            The positions
+
+        Raises
+        ------
+        KeyError
+            If the map has no markers on one of the chromosomes
+
+        Returns
+        -------
+        np.ndarray of cM positions
+        """
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        cms = np.empty(len(positions), dtype=np.float64)
+        for start, end, inds in self._routeQueries(mapName, chromosomes, len(positions)):
+            cms[inds] = _getCmFromPositions(positions[inds], start, end,
+                                            self.markerPosition, self.markercm)
+        return cms
+    def getPositionsFromCm(self, mapName, chromosomes, cMs):
+        """ Gets chromosome bp positions from many cM positions in a map at once
+
+        Parameters
+        ----------
+        mapName : str
+            The name of the map
+        chromosomes : hashable or array-like
+            The chromosome of all the cM positions, or of each one
+        cMs : array-like of floats
+            The positions in cM
+
+        Raises
+        ------
+        KeyError
+            If the map has no markers on one of the chromosomes
+
+        Returns
+        -------
+        np.ndarray of bp positions
+        """
+        cMs = np.atleast_1d(np.asarray(cMs, dtype=np.float64))
+        bps = np.empty(len(cMs), dtype=np.int64)
+        for start, end, inds in self._routeQueries(mapName, chromosomes, len(cMs)):
+            bps[inds] = _getPositionsFromCm(cMs[inds], start, end,
+                                            self.markerPosition, self.markercm)
+        return bps
@@ -1,12 +1,18 @@
+from itertools import islice
+from numpy.lib.format import open_memmap
 import numpy as np
+import os
 import sys
 
 if sys.version_info.major > 2:
     xrange = range
 
+## The number of rows between the byte offsets kept in a row index
+ROW_INDEX_STEP = 10000
+
 class SNPdata:
     def __init__(self, chromosome, snp_file, ref_samp, samp_start_col=11,
-                 totalSNPnumber=None):
+                 totalSNPnumber=None, index_file=None):
         """ Instantiates a reader of SNP data on founders
 
         Parameters
@@ -18,12 +24,22 @@ class SNPdata:
         ref_samp : str
             The name of the reference sample (one of the columns, the one containing
             the allele state for 0)
+        totalSNPnumber : int, optional
+            The number of SNPs in the file, if known
+        index_file : str, optional
+            The file holding the row index (see findTotalSnpNumber). Defaults
+            to snp_file + '.idx'
         """
         self.chromosome = chromosome
         self.snp_file = snp_file
+        self.index_file = index_file if index_file else snp_file + '.idx'
         self.parsedLine = None
         self.samp_start_col = samp_start_col
-        self.numberOfSnps = 0
+        self.numberOfSnps = totalSNPnumber if totalSNPnumber else 0
+        ## Byte offsets of every ROW_INDEX_STEP-th row, loaded when needed
+        self.rowOffsets = None
+        ## (positions, alleles, genotypes) arrays of a binary copy, if in use
+        self.binary = None
         # Open up a handle on the SNP file
         self.br = open(snp_file)
         header = self.br.readline().strip().split('\t')
@@ -84,11 +100,190 @@ class SNPdata:
         return self.numberOfSnps
     def findTotalSnpNumber(self):
         """ Finds the total number of SNPs in the file
+
+        The count is read from the row index file if it was made from a file of
+        the same size and modification time. Otherwise the file is scanned and
+        the index is written, along with the byte offset of every
+        ROW_INDEX_STEP-th row
         """
-        self.reset()
-        for i,line in enumerate(self.br):
-            pass
-        self.numberOfSnps = i+1
+        if not self._readRowIndex():
+            self._buildRowIndex()
+            try:
+                self._writeRowIndex()
+            except (IOError, OSError):
+                pass
+    def _buildRowIndex(self):
+        """ Scans the file for the number of SNPs and the row offsets
+        """
+        self.rowOffsets = []
+        count = 0
+        with open(self.snp_file, 'rb') as handle:
+            offset = len(handle.readline())
+            for line in handle:
+                # Reading stops at the first blank line, as in next()
+                if not line.strip(): break
+                if count % ROW_INDEX_STEP == 0:
+                    self.rowOffsets.append(offset)
+                offset += len(line)
+                count += 1
+        self.numberOfSnps = count
+    def _writeRowIndex(self):
+        """ Writes the row index file. Its first line holds the size and
+        modification time of the SNP file, the number of SNPs and the step
+        between offsets, and each further line holds an offset
+        """
+        stat = os.stat(self.snp_file)
+        with open(self.index_file, 'w') as index_handle:
+            index_handle.write('%d\t%r\t%d\t%d\n' % (stat.st_size, stat.st_mtime,
+                                                    self.numberOfSnps, ROW_INDEX_STEP))
+            for offset in self.rowOffsets:
+                index_handle.write('%d\n' % offset)
+    def _readRowIndex(self):
+        """ Reads the row index file
+
+        Returns
+        -------
+        True if the index was read, or False if it is missing, unreadable or
+        was made from a different version of the file
+        """
+        try:
+            stat = os.stat(self.snp_file)
+            with open(self.index_file) as index_handle:
+                size, mtime, count, step = index_handle.readline().split('\t')
+                if int(size) != stat.st_size or float(mtime) != stat.st_mtime or \
+                  int(step) != ROW_INDEX_STEP:
+                    return False
+                offsets = [int(line) for line in index_handle]
+        except (IOError, OSError, ValueError):
+            return False
+        self.numberOfSnps = int(count)
+        self.rowOffsets = offsets
+        return True
+    def _getGenotypeColumns(self, skip_ref):
+        """ Gets the columns holding founder genotypes
+
+        Parameters
+        ----------
+        skip_ref : boolean
+            Whether to skip the reference sample
+
+        Returns
+        -------
+        List of column indices
+        """
+        return [i for i in xrange(self.samp_start_col, self.col_length) \
+                if not (skip_ref and i == self.ref_ind)]
+    def _iterTextBlocks(self, block_size, start, end):
+        """ Parses blocks of rows of the text file
+
+        Returns
+        -------
+        Generator of (positions, alleles, (SNPs x samples) genotypes), with all
+        of the samples
+        """
+        if start > 0 and self.rowOffsets is None:
+            self.findTotalSnpNumber()
+        first = min(start // ROW_INDEX_STEP, len(self.rowOffsets)-1) if start > 0 else -1
+        with open(self.snp_file, 'rb') as handle:
+            if first >= 0:
+                handle.seek(self.rowOffsets[first])
+                row = first*ROW_INDEX_STEP
+            else:
+                handle.readline()
+                row = 0
+            for line in islice(handle, start-row):
+                pass
+            row = start
+            while end is None or row < end:
+                n = block_size if end is None else min(block_size, end-row)
+                chunk = []
+                for line in islice(handle, n):
+                    line = line.strip()
+                    if not line: break
+                    chunk.append(line.decode().split('\t'))
+                if not chunk: break
+                yield (np.array([int(fields[3]) for fields in chunk], dtype=np.int64),
+                       np.array([fields[1] for fields in chunk], dtype=str),
+                       np.array([fields[self.samp_start_col:] for fields in chunk],
+                                dtype=np.float64))
+                row += len(chunk)
+                if len(chunk) < n: break
+    def iterBlocks(self, block_size=10000, skip_ref=True, start=0, end=None):
+        """ Reads the SNPs a block at a time, parsing each block in bulk
+
+        Parameters
+        ----------
+        block_size : int
+            The number of SNPs in each block
+        skip_ref : boolean
+            Whether to skip the reference sample
+        start : int
+            The index of the first SNP to read. The row index is used to get
+            there without parsing the SNPs before it
+        end : int, optional
+            The index after the last SNP to read. If None, the SNPs are read
+            to the end of the file
+
+        Returns
+        -------
+        Generator of (positions, alleles, (SNPs x founders) array of genotypes),
+        where the genotypes of each SNP are what getGenotype gives for it
+
+        Examples
+        --------
+        >>> founder_data = SNPdata(10, founder_file, 'B73')
+        >>> for positions, alleles, genotypes in founder_data.iterBlocks():
+        ...     projected = projector.projectSnpBlockBoolean(genotypes, positions, popIndex)
+        """
+        columns = np.array(self._getGenotypeColumns(skip_ref)) - self.samp_start_col
+        if self.binary is not None:
+            positions, alleles, genotypes = self.binary
+            end = len(positions) if end is None else min(end, len(positions))
+            for block_start in xrange(start, end, block_size):
+                block_end = min(block_start+block_size, end)
+                yield (positions[block_start:block_end], alleles[block_start:block_end],
+                       genotypes[block_start:block_end][:,columns])
+            return
+        for positions, alleles, genotypes in self._iterTextBlocks(block_size, start, end):
+            yield positions, alleles, genotypes[:,columns]
+    def useBinaryCopy(self, prefix, block_size=100000):
+        """ Reads blocks from a memory-mapped binary copy of the file, writing
+        the copy first if it is missing or older than the file
+
+        The copy is made up of prefix + '.positions.npy', prefix +
+        '.alleles.npy' and prefix + '.genotypes.npy', which holds the
+        genotypes of all of the samples as float32
+
+        Parameters
+        ----------
+        prefix : str
+            The path and start of the names of the binary files
+        block_size : int
+            The number of SNPs parsed at once when writing the copy
+        """
+        files = [prefix + suffix for suffix in ('.positions.npy', '.alleles.npy',
+                                                '.genotypes.npy')]
+        if not all(os.path.exists(f) and os.path.getmtime(f) >= os.path.getmtime(self.snp_file)
+                   for f in files):
+            self.binary = None
+            self.findTotalSnpNumber()
+            positions = open_memmap(files[0], mode='w+', dtype=np.int64,
+                                    shape=(self.numberOfSnps,))
+            genotypes = open_memmap(files[2], mode='w+', dtype=np.float32,
+                                    shape=(self.numberOfSnps, len(self.samps)))
+            alleles = []
+            row = 0
+            for block in self._iterTextBlocks(block_size, 0, None):
+                positions[row:row+len(block[0])] = block[0]
+                genotypes[row:row+len(block[0])] = block[2]
+                alleles.append(block[1])
+                row += len(block[0])
+            np.save(files[1], np.concatenate(alleles) if alleles else np.array([], dtype=str))
+            positions.flush()
+            genotypes.flush()
+            del positions, genotypes
+        self.binary = tuple(np.load(f, mmap_mode='r') for f in files)
+        self.numberOfSnps = len(self.binary[0])
     def getAllele(self):
         """ Gets the allele configuration
 
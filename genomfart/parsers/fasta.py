@@ -0,0 +1,247 @@
+import mmap
+import os
+import numpy as np
+
+class fasta_parser(object):
+    """ Class used to read sequence from an indexed FASTA file.
+
+    The file is memory-mapped and located through a samtools faidx-compatible
+    (.fai) index, which is loaded if present and built otherwise. Every sequence
+    must have lines of a uniform length (except its last line), as faidx requires
+
+    All coordinates are 1-based and inclusive
+
+    Examples
+    --------
+
+    >>> from genomfart.parsers.fasta import fasta_parser
+    >>> from genomfart.data.data_constants import FASTA_TEST_FILE
+    >>> reader = fasta_parser(FASTA_TEST_FILE)
+    >>> reader.get_sequence('chr1', 4, 9)
+    b'ATGGCT'
+    >>> reader.get_array('chr1', 4, 9)
+    array([65, 84, 71, 71, 67, 84], dtype=uint8)
+    >>> reader.get_bases('chr2', [6, 14])
+    array([84, 84], dtype=uint8)
+    """
+    def __init__(self, fasta_file, index_file = None):
+        """ Instantiates the reader
+
+        Parameters
+        ----------
+        fasta_file : str
+            The filename of an uncompressed FASTA file
+        index_file : str, optional
+            The filename of the faidx index. Defaults to fasta_file + '.fai'. If
+            it doesn't exist, the index is built and written there if possible
+
+        Raises
+        ------
+        IOError
+            If the file is compressed or a sequence has irregular line lengths
+        """
+        if fasta_file.endswith('.gz'):
+            raise IOError("Compressed FASTA files are not supported")
+        if index_file is None:
+            index_file = fasta_file + '.fai'
+        self.fasta_file = fasta_file
+        ## The names of the sequences, in file order
+        self.names = []
+        ## Dictionary of name -> (length, byte offset, bases per line, bytes per line)
+        self.index = {}
+        if os.path.exists(index_file) and \
+          os.path.getmtime(index_file) >= os.path.getmtime(fasta_file):
+            self._read_index(index_file)
+        else:
+            self._build_index()
+            try:
+                self._write_index(index_file)
+            except IOError:
+                pass
+        self._handle = open(fasta_file, 'rb')
+        if os.path.getsize(fasta_file) > 0:
+            self._mmap = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+            self._buffer = np.frombuffer(self._mmap, dtype=np.uint8)
+        else:
+            self._mmap = None
+            self._buffer = np.array([], dtype=np.uint8)
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    def close(self):
+        """ Releases the memory map and file handle. Arrays returned by
+        get_array must not be used afterward
+        """
+        self._buffer = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views are still alive; the map is released when they are
+                pass
+            self._mmap = None
+        self._handle.close()
+    def _build_index(self):
+        """ Scans the FASTA file to build the faidx index
+
+        Raises
+        ------
+        IOError
+            If a sequence has irregular line lengths
+        """
+        name = None
+        offset = 0
+        with open(self.fasta_file, 'rb') as fasta_handle:
+            for line in fasta_handle:
+                if line.startswith(b'>'):
+                    if name is not None:
+                        self._add_entry(name, length, seq_offset, linebases, linewidth)
+                    name = line[1:].split()[0].decode()
+                    seq_offset = offset + len(line)
+                    length = 0
+                    linebases = linewidth = None
+                    last_line_short = False
+                elif name is not None:
+                    bases = len(line.rstrip(b'\r\n'))
+                    if linebases is None:
+                        linebases, linewidth = bases, len(line)
+                    elif bases > 0 and (last_line_short or bases > linebases):
+                        raise IOError("%s has lines of different lengths" % name)
+                    if bases < linebases:
+                        last_line_short = True
+                    length += bases
+                offset += len(line)
+        if name is not None:
+            self._add_entry(name, length, seq_offset, linebases, linewidth)
+    def _add_entry(self, name, length, offset, linebases, linewidth):
+        """ Adds a sequence to the index
+        """
+        if linebases is None:
+            linebases = linewidth = 0
+        self.names.append(name)
+        self.index[name] = (length, offset, linebases, linewidth)
+    def _read_index(self, index_file):
+        """ Reads a faidx index file
+        """
+        with open(index_file) as index_handle:
+            for line in index_handle:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 5: continue
+                self._add_entry(fields[0], *map(int, fields[1:5]))
+    def _write_index(self, index_file):
+        """ Writes the faidx index file
+        """
+        with open(index_file, 'w') as index_handle:
+            for name in self.names:
+                index_handle.write('%s\t%d\t%d\t%d\t%d\n' % ((name,)+self.index[name]))
+    def get_length(self, seqid):
+        """ Gets the length of a sequence
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the sequence
+
+        Raises
+        ------
+        KeyError
+            If the sequence is not present
+
+        Returns
+        -------
+        The number of bases in the sequence
+        """
+        return self.index[seqid][0]
+    def _byte_offsets(self, seqid, positions):
+        """ Gets the byte offsets of 1-based positions within a sequence
+
+        Raises
+        ------
+        KeyError
+            If the sequence is not present
+        IndexError
+            If any position is outside of the sequence
+        """
+        length, offset, linebases, linewidth = self.index[seqid]
+        positions = np.asarray(positions, dtype=np.int64)
+        if positions.size and (positions.min() < 1 or positions.max() > length):
+            raise IndexError("Position outside of %s (length %d)" % (seqid, length))
+        zero_based = positions - 1
+        return offset + (zero_based // linebases) * linewidth + zero_based % linebases
+    def get_array(self, seqid, start, end):
+        """ Gets the bases of a region as a uint8 array
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the sequence
+        start : int
+            The start of the region (inclusive, 1-based)
+        end : int
+            The end of the region (inclusive, 1-based)
+
+        Raises
+        ------
+        KeyError
+            If the sequence is not present
+        IndexError
+            If the region is outside of the sequence
+
+        Returns
+        -------
+        np.ndarray of uint8 ASCII codes. This is a read-only view into the file
+        when the region lies on one line, and a compact copy otherwise
+        """
+        if end < start:
+            return np.array([], dtype=np.uint8)
+        first, last = self._byte_offsets(seqid, [start, end])
+        if last - first == end - start:
+            return self._buffer[first:last+1]
+        return self._buffer[self._byte_offsets(seqid, np.arange(start, end+1))]
+    def get_sequence(self, seqid, start, end):
+        """ Gets the bases of a region
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the sequence
+        start : int
+            The start of the region (inclusive, 1-based)
+        end : int
+            The end of the region (inclusive, 1-based)
+
+        Raises
+        ------
+        KeyError
+            If the sequence is not present
+        IndexError
+            If the region is outside of the sequence
+
+        Returns
+        -------
+        bytes of the region
+        """
+        return self.get_array(seqid, start, end).tobytes()
+    def get_bases(self, seqid, positions):
+        """ Gets the bases at many positions at once
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the sequence
+        positions : array-like of ints
+            The positions (1-based)
+
+        Raises
+        ------
+        KeyError
+            If the sequence is not present
+        IndexError
+            If any position is outside of the sequence
+
+        Returns
+        -------
+        np.ndarray of uint8 ASCII codes, in the same order as positions
+        """
+        return self._buffer[self._byte_offsets(seqid, positions)]
@@ -1,5 +1,168 @@
 from genomfart.utils.genomeAnnotationGraph import genomeAnnotationGraph
+from multiprocessing import Pool
+import numpy as np
 import gzip
+import os
+
+def _tokenize_line(line):
+    """ Splits a line of a gff file into the fields needed to add an annotation
+
+    Parameters
+    ----------
+    line : str
+        A line from a gff (version 3) file
+
+    Raises
+    ------
+    IOError
+        If the line isn't correctly formatted
+
+    Returns
+    -------
+    (element_id, seqid, start, end, type, strand, set of parent ids, attribute dict),
+    or None if the line is a comment or empty
+    """
+    if line.startswith('#'): return None
+    elif len(line) < 2: return None
+    line = line.strip().split('\t')
+    if len(line) != 9:
+        raise IOError("Line(s) do not conform to gff v. 3 format")
+    # Parse the attributes into a dictionary of key->val
+    attr_dict = dict((k,v) for k,v in map(lambda x: x.split('='),
+                filter(lambda y: '=' in y, line[8].split(';'))))
+    # Check if the element has an ID. If not, give it one
+    if 'ID' in attr_dict:
+        element_id = attr_dict['ID']
+    else:
+        element_id = '%s:%s_%s_%s:%s' % (line[2],line[0],line[3],line[4],
+                                         line[6])
+    parents = set()
+    if 'Parent' in attr_dict:
+        parents = parents.union(attr_dict['Parent'].split(','))
+    return (element_id, line[0], int(line[3]), int(line[4]), line[2], line[6],
+            parents, attr_dict)
+
+def _scan_seqid_byte_ranges(gff_file):
+    """ Finds the byte ranges holding the features of each seqid in a gff file
+
+    Parameters
+    ----------
+    gff_file : str
+        The filename of an uncompressed gff file
+
+    Returns
+    -------
+    Dictionary of seqid -> [(start byte, end byte)], one entry per contiguous
+    run of lines on that seqid
+    """
+    byte_ranges = {}
+    current_seqid = None
+    run_start = 0
+    offset = 0
+    with open(gff_file, 'rb') as gff_handle:
+        for line in gff_handle:
+            if not line.startswith(b'#') and len(line) >= 2:
+                seqid = line.split(b'\t', 1)[0].decode()
+                if seqid != current_seqid:
+                    if current_seqid is not None:
+                        byte_ranges.setdefault(current_seqid, []).append((run_start, offset))
+                    current_seqid = seqid
+                    run_start = offset
+            offset += len(line)
+    if current_seqid is not None:
+        byte_ranges.setdefault(current_seqid, []).append((run_start, offset))
+    return byte_ranges
+
+def _split_byte_range(gff_file, start, end, chunk_bytes):
+    """ Splits a byte range of a gff file into pieces of roughly chunk_bytes,
+    each ending on a line boundary
+
+    Returns
+    -------
+    List of (start byte, end byte)
+    """
+    pieces = []
+    with open(gff_file, 'rb') as gff_handle:
+        while end - start > chunk_bytes:
+            gff_handle.seek(start + chunk_bytes)
+            gff_handle.readline()
+            split = min(gff_handle.tell(), end)
+            pieces.append((start, split))
+            start = split
+    if end > start:
+        pieces.append((start, end))
+    return pieces
+
+def _tokenize_chunk(args):
+    """ Tokenizes the lines in byte ranges of a gff file into columns. Used
+    by the worker processes of a parallel load
+
+    Parameters
+    ----------
+    args : tuple
+        (gff_file, [(start byte, end byte)], set of types to exclude)
+
+    Returns
+    -------
+    Tuple of columns (element_ids, seqids, starts, ends, types, strands,
+    parents, attributes), where starts and ends are np.ndarrays and
+    the rest are lists
+    """
+    gff_file, byte_ranges, exclude_types = args
+    element_ids, seqids, starts, ends = [], [], [], []
+    element_types, strands, parents, attributes = [], [], [], []
+    with open(gff_file, 'rb') as gff_handle:
+        for start, end in byte_ranges:
+            gff_handle.seek(start)
+            for line in gff_handle.read(end-start).decode().splitlines():
+                tokens = _tokenize_line(line)
+                if tokens is None or tokens[4] in exclude_types: continue
+                element_ids.append(tokens[0])
+                seqids.append(tokens[1])
+                starts.append(tokens[2])
+                ends.append(tokens[3])
+                element_types.append(tokens[4])
+                strands.append(tokens[5])
+                parents.append(tokens[6])
+                attributes.append(tokens[7])
+    return (element_ids, seqids, np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64), element_types, strands, parents,
+            attributes)
+
+def _file_stamp(filename):
+    """ Gets the size and modification time of a file, used to tell whether
+    an index built from it is stale
+    """
+    stat = os.stat(filename)
+    return '%d\t%d' % (stat.st_size, int(stat.st_mtime))
+
+def _read_index_file(index_file, gff_file):
+    """ Reads a seqid byte range index written by _write_index_file
+
+    Returns
+    -------
+    Dictionary of seqid -> [(start byte, end byte)], or None if the index
+    is missing or was built from a different version of the gff file
+    """
+    if not os.path.exists(index_file):
+        return None
+    byte_ranges = {}
+    with open(index_file) as index_handle:
+        if index_handle.readline().rstrip('\n') != _file_stamp(gff_file):
+            return None
+        for line in index_handle:
+            seqid, start, end = line.rstrip('\n').split('\t')
+            byte_ranges.setdefault(seqid, []).append((int(start), int(end)))
+    return byte_ranges
+
+def _write_index_file(index_file, gff_file, byte_ranges):
+    """ Writes the seqid byte range index for a gff file
+    """
+    with open(index_file, 'w') as index_handle:
+        index_handle.write(_file_stamp(gff_file)+'\n')
+        for seqid, ranges in byte_ranges.items():
+            for start, end in ranges:
+                index_handle.write('%s\t%d\t%d\n' % (seqid, start, end))
 
 class gff_parser(genomeAnnotationGraph):
     """ Class used to parse and analyze GFF (version 3) files.
@@ -29,8 +192,19 @@ class gff_parser(genomeAnnotationGraph):
     'biotype': 'protein_coding'}], 'seqid': 'Pt', 'type': 'gene', 'strand': '-'}
     >>> [x for x in parser.get_element_ids_of_type('Pt','gene',start=100,end=4000)]
     ['gene:GRMZM5G836994', 'gene:GRMZM5G811749']
+
+    Only the seqids that are queried need to be loaded
+
+    >>> parser = gff_parser(GFF_TEST_FILE, lazy=True)
+    >>> parser.get_loaded_seqids()
+    set([])
+    >>> parser.get_closest_element_id_of_type('Pt',60000,60010,'gene')
+    set(['gene:GRMZM5G892247'])
+    >>> parser.get_loaded_seqids()
+    set(['Pt'])
     """
-    def __init__(self, gff_file, exclude_types = None):
+    def __init__(self, gff_file, exclude_types = None, lazy = False, index_file = None,
+                 processes = None, chunk_bytes = 1 << 26):
         """ Instantiates the gff file
 
         Parameters
@@ -39,42 +213,157 @@ class gff_parser(genomeAnnotationGraph):
             The filename of a gff file
         exclude_types : set
             The names of types (e.g. 'repeat') that you don't want to store
+        lazy : boolean, optional
+            Whether to defer parsing the features of each seqid until a query
+            first touches that seqid. Requires an uncompressed file. Lookups by
+            element id only see seqids that have already been loaded (see load_all)
+        index_file : str, optional
+            Only used if lazy. A file in which to persist the byte ranges of
+            each seqid so that later instances can skip the pre-scan. It is
+            rebuilt if the gff file has changed since it was written
+        processes : int, optional
+            If greater than 1 (and not lazy), the file is split into per-seqid
+            chunks of at most chunk_bytes that are tokenized in a pool of this
+            many processes and then inserted in bulk. Requires an uncompressed file
+        chunk_bytes : int, optional
+            The approximate maximum size of a chunk for parallel parsing
 
         Raises
         ------
         IOError
             If the file isn't correctly formatted
+        ValueError
+            If lazy or parallel loading is requested for a gzipped file
         """
         super(gff_parser, self).__init__()
         if exclude_types is None: exclude_types = set()
+        self.gff_file = gff_file
+        self.exclude_types = exclude_types
+        ## Dictionary of seqid -> [(start byte, end byte)] for seqids not yet loaded
+        # (only used when lazy)
+        self.seqid_byte_ranges = {}
+        ## Set of the seqids whose features have been parsed
+        self.loaded_seqids = set()
+        if lazy:
+            if gff_file.endswith('.gz'):
+                raise ValueError("Lazy loading requires an uncompressed gff file")
+            byte_ranges = None
+            if index_file is not None:
+                byte_ranges = _read_index_file(index_file, gff_file)
+            if byte_ranges is None:
+                byte_ranges = _scan_seqid_byte_ranges(gff_file)
+                if index_file is not None:
+                    _write_index_file(index_file, gff_file, byte_ranges)
+            self.seqid_byte_ranges = byte_ranges
+            return
+        if processes is not None and processes > 1:
+            if gff_file.endswith('.gz'):
+                raise ValueError("Parallel loading requires an uncompressed gff file")
+            self._load_parallel(processes, chunk_bytes)
+            self.loaded_seqids.update(self.bucketmaps)
+            return
         if gff_file.endswith('.gz'):
             gff_handle = gzip.open(gff_file)
         else:
             gff_handle = open(gff_file)
         ## Parse the file
         with gff_handle:
-            for line in gff_handle:
-                if line.startswith('#'): continue
-                elif len(line) < 2: continue
-                line = line.strip().split('\t')
-                if len(line) != 9:
-                    raise IOError("Line(s) do not conform to gff v. 3 format")
-                if line[2] in exclude_types: continue
-                # Make a new RangeBucketMap for the seqid if necessary
-                seqid = line[0]
-                # Parse the attributes into a dictionary of key->val
-                attr_dict = dict((k,v) for k,v in map(lambda x: x.split('='),
-                            filter(lambda y: '=' in y, line[8].split(';'))))
-                # Check if the element has an ID. If not, give it one
-                if 'ID' in attr_dict:
-                    element_id = attr_dict['ID']
-                else:
-                    element_id = '%s:%s_%s_%s:%s' % (line[2],line[0],line[3],line[4],
-                                                     line[6])
-                parents = set()
-                if 'Parent' in attr_dict:
-                    parents = parents.union(attr_dict['Parent'].split(','))
-                self.add_annotation(element_id, line[0], int(line[3]), int(line[4]),
-                                    line[2], strand=line[6], parents=parents,
-                                    **attr_dict)
+            self._load_lines(gff_handle)
+        self.loaded_seqids.update(self.bucketmaps)
+    def _load_lines(self, lines):
+        """ Parses lines of the gff file into the graph
+
+        Parameters
+        ----------
+        lines : iterable of str
+            Lines of the gff file
+        """
+        for line in lines:
+            tokens = _tokenize_line(line)
+            if tokens is None: continue
+            element_id, seqid, start, end, element_type, strand, parents, attr_dict = tokens
+            if element_type in self.exclude_types: continue
+            self.add_annotation(element_id, seqid, start, end, element_type,
+                                strand=strand, parents=parents, **attr_dict)
+    def _load_parallel(self, processes, chunk_bytes):
+        """ Tokenizes chunks of the gff file in a process pool and inserts
+        the results in one bulk insert
+
+        Parameters
+        ----------
+        processes : int
+            The number of worker processes
+        chunk_bytes : int
+            The approximate maximum size of a chunk
+        """
+        tasks = []
+        for seqid, byte_ranges in _scan_seqid_byte_ranges(self.gff_file).items():
+            pieces = []
+            for start, end in byte_ranges:
+                pieces += _split_byte_range(self.gff_file, start, end, chunk_bytes)
+            # Group small runs of the same seqid into a chunk
+            chunk, chunk_size = [], 0
+            for start, end in pieces:
+                if chunk and chunk_size + (end-start) > chunk_bytes:
+                    tasks.append((self.gff_file, chunk, self.exclude_types))
+                    chunk, chunk_size = [], 0
+                chunk.append((start, end))
+                chunk_size += end-start
+            if chunk:
+                tasks.append((self.gff_file, chunk, self.exclude_types))
+        # Keep file order so that repeated ids keep their Ranges in order
+        tasks.sort(key=lambda x: x[1][0][0])
+        pool = Pool(processes)
+        try:
+            chunks = pool.map(_tokenize_chunk, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        columns = [[] for i in range(8)]
+        for chunk in chunks:
+            for i in (0, 1, 4, 5, 6, 7):
+                columns[i] += chunk[i]
+        starts = np.concatenate([chunk[2] for chunk in chunks]).tolist() if chunks else []
+        ends = np.concatenate([chunk[3] for chunk in chunks]).tolist() if chunks else []
+        # Parent edges are only added once every chunk is in, so parents in
+        # other chunks resolve
+        self.add_annotations(columns[0], columns[1], starts, ends,
+                             columns[4], strands=columns[5], parents=columns[6],
+                             attributes=columns[7])
+    def _ensure_seqid(self, seqid):
+        """ Parses the features of a seqid if they haven't been loaded yet
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system
+        """
+        if seqid not in self.seqid_byte_ranges:
+            return
+        byte_ranges = self.seqid_byte_ranges.pop(seqid)
+        with open(self.gff_file, 'rb') as gff_handle:
+            for start, end in byte_ranges:
+                gff_handle.seek(start)
+                self._load_lines(gff_handle.read(end-start).decode().splitlines())
+        self.loaded_seqids.add(seqid)
+    def load_all(self):
+        """ Parses the features of every seqid that hasn't been loaded yet
+        """
+        for seqid in list(self.seqid_byte_ranges):
+            self._ensure_seqid(seqid)
+    def get_seqids(self):
+        """ Gets the names of all coordinate systems in the file, loaded or not
 
+        Returns
+        -------
+        Set of seqids
+        """
+        return set(self.bucketmaps).union(self.seqid_byte_ranges)
+    def get_loaded_seqids(self):
+        """ Gets the names of the coordinate systems whose features have been parsed
+
+        Returns
+        -------
+        Set of seqids
+        """
+        return set(self.loaded_seqids)
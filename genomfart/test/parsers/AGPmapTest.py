@@ -0,0 +1,130 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from genomfart.parsers.AGPmap import AGPMap, GeneticMapStore
+from genomfart.utils.caching import file_checksum
+
+debug = False
+
+class AGPmapTest(unittest.TestCase):
+    """ Tests for AGPmap.py """
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.map_file = os.path.join(cls.temp_dir, 'map.txt')
+        cms = [0.5, 1., 1.5, 2., 3., 3., 3., 3., 4.5, 5., 6., 6.5, 7., 8., 9.5]
+        with open(cls.map_file, 'w') as map_handle:
+            map_handle.write('chr\talt\tmarker\tcm\tpos\n')
+            for chrom in (1, 2):
+                for i, cm in enumerate(cms):
+                    map_handle.write('%d\talt%d_%d\tPZE%d%02d\t%s\t%d\n' %
+                                     (chrom, chrom, i, chrom, i, cm*chrom, 1000*(i+1) + 7*i*i))
+        cls.agp_map = AGPMap(cls.map_file)
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+    def get_positions(self, chrom):
+        start, end = self.agp_map._getChromosomeBounds(chrom)
+        markers = self.agp_map.markerPosition[start:end+1]
+        # Before the first marker, on every marker, between markers and after
+        # the last marker, out of order
+        positions = np.concatenate(([1, markers[0]-1], markers, markers[:-1] + 3,
+                                    [markers[-1]+1, markers[-1]+5000]))
+        return positions[np.random.RandomState(chrom).permutation(len(positions))]
+    def test_getIntervals(self):
+        if debug: print("Testing getIntervals")
+        for chrom in (1, 2):
+            positions = self.get_positions(chrom)
+            left, left_pos, right, right_pos = self.agp_map.getIntervals(chrom, positions)
+            for i, position in enumerate(positions):
+                expected = self.agp_map.getInterval(chrom, position)
+                self.assertEqual(expected, (self.agp_map.marker[left[i]] if left[i] >= 0 else None,
+                                            left_pos[i] if left[i] >= 0 else None,
+                                            self.agp_map.marker[right[i]] if right[i] >= 0 else None,
+                                            right_pos[i] if right[i] >= 0 else None))
+        # Chromosomes given per position
+        left = self.agp_map.getIntervals([2, 1], [1000, 1000])[0]
+        self.assertEqual(list(self.agp_map.marker[left]), ['PZE200', 'PZE100'])
+    def test_getCmFromPositions(self):
+        if debug: print("Testing getCmFromPositions")
+        for chrom in (1, 2):
+            positions = self.get_positions(chrom)
+            cms = self.agp_map.getCmFromPositions(chrom, positions)
+            np.testing.assert_allclose(cms, [self.agp_map.getCmFromPosition(chrom, position)
+                                             for position in positions])
+        cms = self.agp_map.getCmFromPositions([1, 2], [1000, 1000])
+        self.assertEqual(list(cms), [0.5, 1.])
+    def test_getPositionsFromCm(self):
+        if debug: print("Testing getPositionsFromCm")
+        for chrom in (1, 2):
+            start, end = self.agp_map._getChromosomeBounds(chrom)
+            markers = self.agp_map.markercm[start:end+1]
+            # Including the cM position shared by several markers
+            cms = np.concatenate(([0., markers[0]-0.1], markers, markers[:-1] + 0.2,
+                                  [markers[-1]+0.1, markers[-1]+3.]))
+            bps = self.agp_map.getPositionsFromCm(chrom, cms)
+            self.assertEqual(list(bps), [self.agp_map.getPositionFromCm(chrom, cm) for cm in cms])
+    def test_markerNumber(self):
+        if debug: print("Testing marker numbers")
+        self.assertEqual(list(self.agp_map.markerNumber[:3]), [100, 101, 102])
+        self.assertEqual(self.agp_map.getMarkerNumber('PZE214'), 214)
+    def test_cache(self):
+        if debug: print("Testing the map cache")
+        map_file = os.path.join(self.temp_dir, 'cached_map.txt')
+        cache_file = os.path.join(self.temp_dir, 'map.npz')
+        shutil.copy(self.map_file, map_file)
+        parsed = AGPMap(map_file, cacheFile=cache_file)
+        self.assertTrue(os.path.exists(cache_file))
+        cached = AGPMap(map_file, cacheFile=cache_file)
+        for name in ('markerPosition', 'markerChromosome', 'markercm', 'marker',
+                     'markerNumber'):
+            np.testing.assert_array_equal(getattr(cached, name), getattr(parsed, name))
+        self.assertEqual(cached.marker_alt_names, parsed.marker_alt_names)
+        self.assertEqual(cached.chrend, parsed.chrend)
+        self.assertEqual(cached.chromSlices, parsed.chromSlices)
+        self.assertEqual(cached.getInterval(2, 5000), parsed.getInterval(2, 5000))
+        # A cache of the other format isn't used
+        checksum = file_checksum(map_file)
+        self.assertTrue(cached._loadCache(cache_file, checksum, False))
+        self.assertFalse(cached._loadCache(cache_file, checksum, True))
+        # Changing the map file makes the cache stale
+        with open(map_file, 'a') as map_handle:
+            map_handle.write('3\talt3_0\tPZE300\t0.0\t500\n')
+        changed = AGPMap(map_file, cacheFile=cache_file)
+        self.assertEqual(changed.getFirstMarkerName(3), 'PZE300')
+        self.assertEqual(AGPMap(map_file, cacheFile=cache_file).getFirstMarkerName(3), 'PZE300')
+    def test_GeneticMapStore(self):
+        if debug: print("Testing GeneticMapStore")
+        store = GeneticMapStore()
+        store.addMapFile('agp', self.map_file)
+        # Unsorted markers on named chromosomes
+        store.addMarkers('pop', ['chr2', 'chr1', 'chr1', 'chr1', 'chr2'],
+                         ['m5', 'm3', 'm1', 'm2', 'm4'], [900, 3000, 100, 2000, 500],
+                         [4., 2., 0., 1.5, 3.])
+        self.assertEqual(store.mapNames, ['agp', 'pop'])
+        self.assertEqual(store.mapChromosomes['pop'], ['chr2', 'chr1'])
+        self.assertEqual(len(store), 35)
+        self.assertEqual(store.getSlice('pop', 'chr2'), (30, 31))
+        self.assertEqual(list(store.marker[30:]), ['m4', 'm5', 'm1', 'm2', 'm3'])
+        self.assertEqual(list(store.markerNumber[30:]), [4, 5, 1, 2, 3])
+        left, left_pos, right, right_pos = store.getIntervals('pop', ['chr1', 'chr2', 'chr1'],
+                                                              [150, 600, 5000])
+        self.assertEqual(list(store.marker[left]), ['m1', 'm4', 'm3'])
+        self.assertEqual(list(right), [33, 31, -1])
+        self.assertEqual(list(right_pos), [2000, 900, -1])
+        np.testing.assert_allclose(store.getCmFromPositions('pop', 'chr2', [500, 700]), [3., 3.5])
+        self.assertEqual(list(store.getPositionsFromCm('pop', 'chr1', [0.75, 2.])), [1050, 3000])
+        # The AGPmap slices give the same answers as the map itself
+        positions = self.get_positions(2)
+        for got, expected in zip(store.getIntervals('agp', 2, positions),
+                                 self.agp_map.getIntervals(2, positions)):
+            self.assertEqual(list(got), list(expected))
+        np.testing.assert_allclose(store.getCmFromPositions('agp', 2, positions),
+                                   self.agp_map.getCmFromPositions(2, positions))
+        self.assertRaises(KeyError, store.getIntervals, 'pop', 'chr3', [1])
+        self.assertRaises(ValueError, store.addMapFile, 'agp', self.map_file)
+if __name__ == '__main__':
+    debug = True
+    unittest.main(exit = False)
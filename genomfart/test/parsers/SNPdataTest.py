@@ -0,0 +1,92 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from genomfart.parsers import SNPdata as SNPdata_module
+from genomfart.parsers.SNPdata import SNPdata
+
+debug = False
+
+class SNPdataTest(unittest.TestCase):
+    """ Tests for SNPdata.py """
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.snp_file = os.path.join(cls.temp_dir, 'founders.txt')
+        header = ['col%d' % i for i in range(11)] + ['B73', 'F1', 'F2']
+        with open(cls.snp_file, 'w') as snp_handle:
+            snp_handle.write('\t'.join(header) + '\n')
+            for i in range(25):
+                snp_handle.write('\t'.join(['s%d' % i, 'A/G', '1', str(100*(i+1))] +
+                                           ['.']*7 + ['0', str(i % 2), '0.5']) + '\n')
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+    def setUp(self):
+        # Small steps so that seeking uses the offsets
+        self.old_step = SNPdata_module.ROW_INDEX_STEP
+        SNPdata_module.ROW_INDEX_STEP = 4
+    def tearDown(self):
+        SNPdata_module.ROW_INDEX_STEP = self.old_step
+    def get_rows(self, reader):
+        rows = []
+        reader.reset()
+        while reader.next():
+            rows.append((reader.getPosition(), reader.getAllele(), list(reader.getGenotype())))
+        return rows
+    def test_row_index(self):
+        if debug: print("Testing row index")
+        index_file = os.path.join(self.temp_dir, 'index.idx')
+        reader = SNPdata(1, self.snp_file, 'B73', index_file=index_file)
+        self.assertEqual(reader.getNumberOfSnps(), 25)
+        self.assertTrue(os.path.exists(index_file))
+        self.assertEqual(len(reader.rowOffsets), 7)
+        # The count comes from the index the second time
+        reader = SNPdata(1, self.snp_file, 'B73', index_file=index_file)
+        self.assertEqual(reader.getNumberOfSnps(), 25)
+        self.assertEqual(reader._readRowIndex(), True)
+        with open(index_file, 'w') as index_handle:
+            index_handle.write('1\t0.0\t3\t4\n')
+        self.assertEqual(SNPdata(1, self.snp_file, 'B73',
+                                 index_file=index_file).getNumberOfSnps(), 25)
+    def test_iterBlocks(self):
+        if debug: print("Testing iterBlocks")
+        reader = SNPdata(1, self.snp_file, 'B73',
+                         index_file=os.path.join(self.temp_dir, 'blocks.idx'))
+        rows = self.get_rows(reader)
+        blocks = list(reader.iterBlocks(block_size=10))
+        self.assertEqual([len(block[0]) for block in blocks], [10, 10, 5])
+        positions = np.concatenate([block[0] for block in blocks])
+        np.testing.assert_array_equal(positions, [row[0] for row in rows])
+        np.testing.assert_array_equal(np.vstack([block[2] for block in blocks]),
+                                      [row[2] for row in rows])
+        self.assertEqual(list(blocks[0][1][:2]), ['A/G', 'A/G'])
+        # Seeking into the middle of the file
+        blocks = list(reader.iterBlocks(block_size=3, start=9, end=15))
+        np.testing.assert_array_equal(np.concatenate([block[0] for block in blocks]),
+                                      [row[0] for row in rows[9:15]])
+        self.assertEqual(blocks[0][2].shape, (3, 2))
+        self.assertEqual(list(reader.iterBlocks(skip_ref=False))[0][2].shape, (25, 3))
+    def test_useBinaryCopy(self):
+        if debug: print("Testing useBinaryCopy")
+        reader = SNPdata(1, self.snp_file, 'B73',
+                         index_file=os.path.join(self.temp_dir, 'binary.idx'))
+        text_blocks = list(reader.iterBlocks(block_size=7, start=2))
+        prefix = os.path.join(self.temp_dir, 'founders')
+        reader.useBinaryCopy(prefix, block_size=6)
+        self.assertTrue(os.path.exists(prefix + '.genotypes.npy'))
+        binary_blocks = list(reader.iterBlocks(block_size=7, start=2))
+        self.assertEqual(len(binary_blocks), len(text_blocks))
+        for text_block, binary_block in zip(text_blocks, binary_blocks):
+            for text_array, binary_array in zip(text_block, binary_block):
+                np.testing.assert_array_equal(text_array, binary_array)
+        self.assertEqual(reader.binary[2].dtype, np.float32)
+        # An existing copy is reused
+        reader = SNPdata(1, self.snp_file, 'B73', totalSNPnumber=25)
+        reader.useBinaryCopy(prefix)
+        self.assertEqual(reader.getNumberOfSnps(), 25)
+        self.assertEqual(list(reader.iterBlocks(end=2))[0][0].tolist(), [100, 200])
+if __name__ == '__main__':
+    debug = True
+    unittest.main(exit = False)
@@ -0,0 +1,74 @@
+import unittest
+import os
+import shutil
+import tempfile
+import gc
+import warnings
+import numpy as np
+from genomfart.parsers.fasta import fasta_parser
+from genomfart.data.data_constants import FASTA_TEST_FILE
+
+debug = False
+
+class fasta_parserTest(unittest.TestCase):
+    """ Tests for fasta.py """
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.index_file = os.path.join(cls.temp_dir, 'test_fasta.fa.fai')
+        cls.reader = fasta_parser(FASTA_TEST_FILE, index_file=cls.index_file)
+    @classmethod
+    def tearDownClass(cls):
+        cls.reader.close()
+        shutil.rmtree(cls.temp_dir)
+    def test_index(self):
+        if debug: print("Testing index")
+        self.assertEqual(self.reader.names, ['chr1', 'chr2'])
+        self.assertEqual(self.reader.index['chr1'], (40, 20, 12, 13))
+        self.assertEqual(self.reader.index['chr2'], (20, 70, 12, 13))
+        self.assertEqual(self.reader.get_length('chr2'), 20)
+        # Reload from the index file that was written
+        reader = fasta_parser(FASTA_TEST_FILE, index_file=self.index_file)
+        self.assertEqual(reader.index, self.reader.index)
+        reader.close()
+    def test_build_index(self):
+        if debug: print("Testing index building")
+        fasta_file = os.path.join(self.temp_dir, 'built.fa')
+        bad_file = os.path.join(self.temp_dir, 'irregular.fa')
+        with open(fasta_file, 'w') as fasta_handle:
+            fasta_handle.write('>s1\nACGT\nAC\n>s2\nGG\n')
+        with open(bad_file, 'w') as fasta_handle:
+            fasta_handle.write('>s1\nACGT\nAC\nACGT\n')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            with fasta_parser(fasta_file) as reader:
+                self.assertEqual(reader.index['s1'], (6, 4, 4, 5))
+                self.assertEqual(reader.get_sequence('s2', 1, 2), b'GG')
+            self.assertRaises(IOError, fasta_parser, bad_file)
+            gc.collect()
+        # The file is closed after scanning, even if it is rejected
+        self.assertEqual([w for w in caught if w.category.__name__ == 'ResourceWarning'], [])
+    def test_get_sequence(self):
+        if debug: print("Testing get_sequence")
+        self.assertEqual(self.reader.get_sequence('chr1', 4, 9), b'ATGGCT')
+        # Spanning line breaks
+        self.assertEqual(self.reader.get_sequence('chr1', 10, 27), b'GTAAGTGGAAATAGCCCC')
+        self.assertEqual(self.reader.get_sequence('chr2', 1, 20), b'GGGGGTCAAAACATGGGGGG')
+        with self.assertRaises(IndexError):
+            self.reader.get_sequence('chr2', 15, 21)
+        with self.assertRaises(KeyError):
+            self.reader.get_sequence('chr3', 1, 2)
+    def test_get_array(self):
+        if debug: print("Testing get_array")
+        arr = self.reader.get_array('chr1', 4, 9)
+        self.assertEqual(arr.tobytes(), b'ATGGCT')
+        self.assertFalse(arr.flags.owndata)
+        arr = self.reader.get_array('chr1', 10, 14)
+        self.assertEqual(arr.tobytes(), b'GTAAG')
+    def test_get_bases(self):
+        if debug: print("Testing get_bases")
+        bases = self.reader.get_bases('chr1', np.array([1, 4, 12, 13, 40]))
+        self.assertEqual(bases.tobytes(), b'CAAAC')
+if __name__ == "__main__":
+    debug = True
+    unittest.main(exit = False)
@@ -1,7 +1,14 @@
 import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
 from Ranger import Range
 from genomfart.parsers.gff import gff_parser
-from genomfart.data.data_constants import GFF_TEST_FILE
+from genomfart.parsers.fasta import fasta_parser
+from genomfart.utils import genomeAnnotationGraph as gag
+from genomfart.utils.interval_index import IntervalIndex
+from genomfart.data.data_constants import GFF_TEST_FILE, FASTA_TEST_FILE
 
 debug = False
 
@@ -44,6 +51,27 @@ class gff_parserTest(unittest.TestCase):
         self.assertEqual(len(gene_info['attributes']),1)
         self.assertEqual(gene_info['attributes'][0]['external_name'],'RPS16')
         self.assertEqual(gene_info['attributes'][0]['biotype'],'protein_coding')
+    def test_get_element_ids_with_attribute(self):
+        if debug: print("Testing get_element_ids_with_attribute")
+        elements = self.parser.get_element_ids_with_attribute('external_name', 'RPS16')
+        self.assertEqual(elements, set(['gene:GRMZM5G811749']))
+        elements = self.parser.get_element_ids_with_attribute('biotype', 'protein_coding')
+        self.assertEqual(len(elements), 12)
+        self.assertTrue('transcript:GRMZM5G811749_T01' in elements)
+        self.assertEqual(self.parser.get_element_ids_with_attribute('biotype', 'lincRNA'),
+                         set())
+        ids, values = self.parser.get_attribute_column('rank')
+        # Both CDS Ranges carry a rank
+        self.assertEqual(sorted(values[ids == 'CDS:GRMZM5G811749_P01']), ['1', '2'])
+    def test_add_node_annotations(self):
+        if debug: print("Testing add_node_annotations")
+        parser = gff_parser(GFF_TEST_FILE)
+        parser.add_node_annotations('CDS:GRMZM5G811749_P01', expression=0.2, rank='9')
+        info = parser.get_element_info('CDS:GRMZM5G811749_P01')
+        self.assertEqual([x['expression'] for x in info['attributes']], [0.2, 0.2])
+        self.assertEqual([x['rank'] for x in info['attributes']], ['9', '9'])
+        self.assertEqual(parser.get_element_ids_with_attribute('expression', 0.2),
+                         set(['CDS:GRMZM5G811749_P01']))
     def test_get_element_ids_of_type(self):
         if debug: print("Testing get_element_ids_of_type")
         iterator = self.parser.get_element_ids_of_type('Pt','gene',start=100,
@@ -52,6 +80,14 @@ class gff_parserTest(unittest.TestCase):
         self.assertEqual(next(iterator), 'gene:GRMZM5G811749')
         with self.assertRaises(StopIteration):
             next(iterator)
+        genes = list(self.parser.get_element_ids_of_type('Pt','gene'))
+        self.assertEqual(genes, ['gene:GRMZM5G836994', 'gene:GRMZM5G811749',
+                                 'gene:GRMZM5G856777', 'gene:GRMZM5G813608',
+                                 'gene:GRMZM5G877454', 'gene:GRMZM5G892247'])
+        # CDS with more than one Range only returned once
+        cds = list(self.parser.get_element_ids_of_type('Pt','CDS',start=4000,end=6000))
+        self.assertEqual(cds, ['CDS:GRMZM5G811749_P01'])
+        self.assertEqual(list(self.parser.get_element_ids_of_type('Pt','mRNA')), [])
     def test_get_element_children_ids(self):
         if debug: print("Testing get_element_children_ids")
         children = self.parser.get_element_children_ids('gene:GRMZM5G811749')
@@ -88,6 +124,23 @@ class gff_parserTest(unittest.TestCase):
         self.assertEqual(closest_ids, set(['repeat_region:Pt_15787_15836:?']))
         closest_ids = self.parser.get_closest_element_id_of_type('Pt',15880,15882,'gene')
         self.assertEqual(closest_ids, set(['gene:GRMZM5G813608']))
+        # Beyond the old fixed search radius
+        closest_ids = self.parser.get_closest_element_id_of_type('Pt',60000,60010,'gene')
+        self.assertEqual(closest_ids, set(['gene:GRMZM5G892247']))
+        closest_ids = self.parser.get_closest_element_id_of_type('Pt',60000,60010,'gene',
+                                                                 radius=10000)
+        self.assertEqual(closest_ids, set())
+    def test_get_closest_element_id_sets(self):
+        if debug: print("Testing get_closest_element_id_sets")
+        closest_ids = self.parser.get_closest_element_id_sets('Pt',[2000,15880],[2200,15882],
+                                                              'gene')
+        self.assertEqual(closest_ids, [set(['gene:GRMZM5G836994']),
+                                       set(['gene:GRMZM5G813608'])])
+    def test_get_closest_element_distances(self):
+        if debug: print("Testing get_closest_element_distances")
+        dists = self.parser.get_closest_element_distances('Pt',[2000,16000,60000],
+                                                          [2200,16000,60000],'gene')
+        self.assertEqual(list(dists), [0, 903, 28434])
     def test_get_cds_indices(self):
         if debug: print("Testing get_cds_indices")
         cds_inds = self.parser.get_cds_indices('Pt',3308)
@@ -125,6 +178,183 @@ class gff_parserTest(unittest.TestCase):
         self.assertFalse(self.parser.overlaps_type('Pt',100,1000,'three_prime_UTR'))
         self.assertFalse(self.parser.overlaps_type('Pt',100,1000,'exon'))
         self.assertTrue(self.parser.overlaps_type('Pt',11400,11600,'three_prime_UTR'))
+        self.assertFalse(self.parser.overlaps_type('Pt',100,40000,'mRNA'))
+    def test_get_window_summaries(self):
+        if debug: print("Testing get_window_summaries")
+        starts, ends, counts, covered = self.parser.get_window_summaries('Pt', 10000,
+                                                    step=5000, element_type='gene')
+        self.assertEqual(starts[0], 1)
+        self.assertEqual(starts[1], 5001)
+        for start, end, count, cov in zip(starts, ends, counts, covered):
+            genes = self.parser.get_overlapping_element_ids_of_type('Pt', start, end, 'gene')
+            self.assertEqual(count, len(genes))
+            bases = set()
+            for gene in genes:
+                for gene_range in self.parser.graph.node[gene]['Ranges']:
+                    bases.update(range(max(start, gene_range.lowerEndpoint()),
+                                       min(end, gene_range.upperEndpoint())+1))
+            self.assertEqual(cov, len(bases))
+        with self.assertRaises(ValueError):
+            self.parser.get_window_summaries('Pt', 0)
+    def test_spatial_joins(self):
+        if debug: print("Testing spatial joins")
+        peaks = IntervalIndex([100, 15880], [4000, 15882])
+        inds, peak_inds = self.parser.intersect_elements('Pt', peaks, 'repeat_region')
+        repeats = self.parser.get_interval_index('Pt', 'repeat_region')
+        self.assertEqual(set(repeats.ids[inds]),
+                         self.parser.get_overlapping_element_ids_of_type('Pt',100,4000,
+                                                                         'repeat_region'))
+        self.assertEqual(set(peak_inds), set([0]))
+        # Joining two graphs
+        inds, other_inds = self.parser.intersect_elements('Pt', self.parser, 'gene', 'CDS')
+        genes = self.parser.get_interval_index('Pt', 'gene')
+        cds = self.parser.get_interval_index('Pt', 'CDS')
+        self.assertTrue(('gene:GRMZM5G836994', 'CDS:GRMZM5G836994_P01') in \
+                        set(zip(genes.ids[inds], cds.ids[other_inds])))
+        inds, gene_inds, dists = self.parser.closest_elements('Pt', self.parser,
+                                                              'repeat_region', 'gene')
+        for i in set(inds):
+            self.assertEqual(set(genes.ids[gene_inds[inds == i]]),
+                             self.parser.get_closest_element_id_of_type('Pt', repeats.starts[i],
+                                                                        repeats.ends[i], 'gene'))
+        starts, ends, inds = self.parser.subtract_elements('Pt', peaks, 'gene')
+        self.assertFalse(peaks.count_overlapping(starts, ends).any())
+        self.assertTrue((starts >= genes.starts[inds]).all())
+        self.assertTrue((ends <= genes.ends[inds]).all())
+        starts, ends = self.parser.merge_elements('Pt', peaks, 'gene')
+        self.assertTrue(starts[0] <= 100)
+        self.assertTrue((starts[1:] > ends[:-1]).all())
+        with self.assertRaises(KeyError):
+            self.parser.intersect_elements('1', peaks)
+    def test_iter_site_overlaps(self):
+        if debug: print("Testing iter_site_overlaps")
+        sites = [('Pt',pos,('A','T')) for pos in range(100,30000,97)]
+        sites.insert(10, ('Pt',sites[9][1],('ACGTACGTACGT','A')))
+        sites.append(('Mt',100,('A','T')))
+        count = 0
+        for site, elements in self.parser.iter_site_overlaps(sites):
+            if site[0] == 'Mt':
+                self.assertEqual(elements, set())
+                continue
+            end = site[1]+len(site[2][0])-1
+            self.assertEqual(elements, self.parser.get_overlapping_element_ids('Pt',site[1],end))
+            count += 1
+        self.assertEqual(count, len(sites)-1)
+        for site, elements in self.parser.iter_site_overlaps(sites[:-1], 'CDS'):
+            self.assertEqual(elements, self.parser.get_overlapping_element_ids_of_type(
+                'Pt',site[1],site[1]+len(site[2][0])-1,'CDS'))
+        with self.assertRaises(ValueError):
+            list(self.parser.iter_site_overlaps([('Pt',200,('A',)),('Pt',100,('A',))]))
+    def test_lazy_loading(self):
+        if debug: print("Testing lazy loading")
+        temp_dir = tempfile.mkdtemp()
+        try:
+            index_file = os.path.join(temp_dir, 'test_gff.gff.idx')
+            parser = gff_parser(GFF_TEST_FILE, lazy=True, index_file=index_file)
+            self.assertEqual(parser.get_loaded_seqids(), set())
+            self.assertEqual(parser.get_seqids(), set(['Pt']))
+            self.assertTrue(os.path.exists(index_file))
+            elements = parser.get_overlapping_element_ids('Pt',100,4000)
+            self.assertEqual(elements, self.parser.get_overlapping_element_ids('Pt',100,4000))
+            self.assertEqual(parser.get_loaded_seqids(), set(['Pt']))
+            # Reuse the persisted index
+            parser = gff_parser(GFF_TEST_FILE, lazy=True, index_file=index_file)
+            self.assertEqual(parser.get_closest_element_id_of_type('Pt',15880,15882,'gene'),
+                             set(['gene:GRMZM5G813608']))
+            with self.assertRaises(KeyError):
+                parser.get_overlapping_element_ids('1',100,4000)
+        finally:
+            shutil.rmtree(temp_dir)
+    def test_parallel_loading(self):
+        if debug: print("Testing parallel loading")
+        # Small chunks so that parents and children fall in different chunks
+        parser = gff_parser(GFF_TEST_FILE, processes=2, chunk_bytes=2000)
+        self.assertEqual(parser.get_overlapping_element_ids('Pt',100,4000),
+                         self.parser.get_overlapping_element_ids('Pt',100,4000))
+        self.assertEqual(set(parser.get_element_parent_ids('CDS:GRMZM5G811749_P01')),
+                         set(['transcript:GRMZM5G811749_T01']))
+        self.assertEqual(set(parser.get_element_children_ids('transcript:GRMZM5G811749_T01')),
+                         set(self.parser.get_element_children_ids('transcript:GRMZM5G811749_T01')))
+        self.assertEqual(parser.get_element_info('CDS:GRMZM5G811749_P01'),
+                         self.parser.get_element_info('CDS:GRMZM5G811749_P01'))
+    def test_add_annotations(self):
+        if debug: print("Testing add_annotations")
+        rows = [('gene:1', 'chr1', 10, 100, 'gene', '+', [], {'Name': 'g1'}),
+                ('mRNA:1', 'chr1', 10, 100, 'mRNA', '+', ['gene:1'], {'Parent': 'gene:1'}),
+                ('exon:2', 'chr2', 5, 20, 'exon', '-', ['mRNA:2'], {}),
+                ('exon:1', 'chr1', 10, 40, 'exon', '+', ['mRNA:1'], {'rank': 1}),
+                ('exon:1', 'chr1', 60, 100, 'exon', '+', ['mRNA:1'], {'rank': 2}),
+                ('mRNA:2', 'chr2', 1, 30, 'mRNA', '-', [], {})]
+        looped = gag.genomeAnnotationGraph()
+        for element_id, seqid, start, end, element_type, strand, parents, attrs in rows:
+            looped.add_annotation(element_id, seqid, start, end, element_type, strand=strand,
+                                  parents=parents, **attrs)
+        bulk = gag.genomeAnnotationGraph()
+        # Added in two calls, so that the second appends to existing seqids and nodes
+        for chunk in (rows[:3], rows[3:]):
+            columns = list(zip(*chunk))
+            bulk.add_annotations(*columns[:5], strands=columns[5], parents=columns[6],
+                                 attributes=columns[7])
+        for element_id in set(row[0] for row in rows):
+            self.assertEqual(bulk.get_element_info(element_id),
+                             looped.get_element_info(element_id))
+            self.assertEqual(set(bulk.graph.predecessors(element_id)),
+                             set(looped.graph.predecessors(element_id)))
+        for seqid, start, end in (('chr1', 50, 70), ('chr2', 1, 4)):
+            self.assertEqual(bulk.get_overlapping_element_ids(seqid, start, end),
+                             looped.get_overlapping_element_ids(seqid, start, end))
+            self.assertEqual(bulk.get_overlapping_element_ids_of_type(seqid, start, end, 'exon'),
+                             looped.get_overlapping_element_ids_of_type(seqid, start, end,
+                                                                        'exon'))
+        self.assertEqual(bulk.get_element_ids_with_attribute('rank', 2), set(['exon:1']))
+    def test_unhashable_attributes(self):
+        if debug: print("Testing unhashable attributes")
+        genome = gag.genomeAnnotationGraph()
+        genome.add_annotation('gene:1', 'chr1', 10, 100, 'gene', expr=[1, 2])
+        genome.add_annotation('gene:2', 'chr1', 50, 150, 'gene', expr=[1, 2], biotype='pc')
+        genome.add_annotations(['gene:3'], ['chr1'], [200], [300], ['gene'],
+                               attributes=[{'expr': np.array([0.5, 1.5])}])
+        genome.add_node_annotations('gene:1', counts=np.array([3, 4]))
+        self.assertEqual(genome.get_element_info('gene:2')['attributes'],
+                         [{'expr': [1, 2], 'biotype': 'pc'}])
+        attributes = genome.get_element_info('gene:1')['attributes'][0]
+        self.assertEqual(attributes['expr'], [1, 2])
+        np.testing.assert_array_equal(attributes['counts'], [3, 4])
+        element_ids, values = genome.get_attribute_column('expr')
+        self.assertEqual(list(element_ids), ['gene:1', 'gene:2', 'gene:3'])
+        np.testing.assert_array_equal(values[2], [0.5, 1.5])
+        self.assertEqual(genome.get_element_ids_with_attribute('expr'),
+                         set(['gene:1', 'gene:2', 'gene:3']))
+        self.assertEqual(genome.get_element_ids_with_attribute('expr', [1, 2]), set())
+    def test_predict_coding_consequences(self):
+        if debug: print("Testing predict_coding_consequences")
+        genome = gag.genomeAnnotationGraph()
+        # chr1: ATGGC + GTGGAAATAG on the + strand, with a codon split across segments
+        genome.add_annotation('CDS:1', 'chr1', 4, 8, 'CDS', strand='+')
+        genome.add_annotation('CDS:1', 'chr1', 14, 23, 'CDS', strand='+')
+        # chr2: ATGTTTTGA on the - strand
+        genome.add_annotation('CDS:2', 'chr2', 6, 14, 'CDS', strand='-')
+        temp_dir = tempfile.mkdtemp()
+        try:
+            fasta = fasta_parser(FASTA_TEST_FILE,
+                                 index_file=os.path.join(temp_dir, 'test_fasta.fa.fai'))
+            positions = [6, 14, 16, 22, 30, 5, 18]
+            refs = ['G', 'G', 'G', 'A', 'C', 'A', 'A']
+            alts = ['A', 'T', 'A', 'C', 'T', 'C', 'AT']
+            variant_inds, cds_ids, codes = genome.predict_coding_consequences('chr1',
+                                                positions, refs, alts, fasta)
+            self.assertEqual(list(variant_inds), [0, 1, 2, 3, 5, 6])
+            self.assertEqual(set(cds_ids), set(['CDS:1']))
+            self.assertEqual(list(codes), [gag.CONSEQUENCE_MISSENSE, gag.CONSEQUENCE_SYNONYMOUS,
+                                           gag.CONSEQUENCE_NONSENSE, gag.CONSEQUENCE_STOP_LOST,
+                                           gag.CONSEQUENCE_REF_MISMATCH, gag.CONSEQUENCE_UNKNOWN])
+            variant_inds, cds_ids, codes = genome.predict_coding_consequences('chr2',
+                                                [14, 8, 2], ['T', 'A', 'G'], ['C', 'G', 'A'], fasta)
+            self.assertEqual(list(variant_inds), [0, 1])
+            self.assertEqual(list(codes), [gag.CONSEQUENCE_MISSENSE, gag.CONSEQUENCE_STOP_LOST])
+            fasta.close()
+        finally:
+            shutil.rmtree(temp_dir)
 if __name__ == "__main__":
     debug = True
     unittest.main(exit = False)
@@ -0,0 +1,152 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from genomfart.utils.genome_projection import project_genome
+from genomfart.utils.snp_projector import snp_projector
+
+debug = False
+
+CHROM_LENGTH = 20000
+
+class genome_projection_test(unittest.TestCase):
+    """ Tests for genome_projection.py """
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(11)
+        cls.map_file = os.path.join(cls.temp_dir, 'map.txt')
+        with open(cls.map_file, 'w') as map_handle:
+            map_handle.write('chr\talt\tmarker\tcm\tpos\n')
+            for chrom in (1, 2):
+                for i in range(12):
+                    map_handle.write('%d\talt\tPZE%d%02d\t%s\t%d\n' % (chrom, chrom, i, 0.5*i,
+                                                                     1000*(i+1)))
+        cls.pop_index = np.array([0, 0, 1, 1, 2])
+        cls.samples = ['S%d' % i for i in range(5)]
+        cls.chromosomes = []
+        cls.founders = {}
+        cls.dosages = {}
+        for chrom, n_snps in ((1, 13), (2, 8)):
+            ril_file = cls.write_ril('ril%d.txt' % chrom, cls.samples, rng)
+            positions = np.sort(rng.choice(np.arange(1, CHROM_LENGTH), n_snps, replace=False))
+            cls.founders[chrom] = (positions, rng.randint(0, 2, (n_snps, 3)))
+            cls.dosages[chrom] = (positions, rng.choice([0, 0.25, 0.5, 1], (n_snps, 3)))
+            cls.write_founders('founders%d.txt' % chrom, chrom, *cls.founders[chrom])
+            cls.write_founders('dosages%d.txt' % chrom, chrom, *cls.dosages[chrom])
+            cls.chromosomes.append((chrom, CHROM_LENGTH, ril_file,
+                                    os.path.join(cls.temp_dir, 'founders%d.txt' % chrom)))
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+    @classmethod
+    def write_ril(cls, name, samples, rng):
+        filename = os.path.join(cls.temp_dir, name)
+        with open(filename, 'w') as handle:
+            handle.write('a\tb\tc\td\te\t' + '\t'.join(samples) + '\n')
+            for i in range(13):
+                handle.write('\t'.join(['m%d' % i, '.', '.', '.', '.'] +
+                                       ['%g' % v for v in rng.choice([0, 1, 2], len(samples))])
+                             + '\n')
+        return filename
+    @classmethod
+    def write_founders(cls, name, chrom, positions, founders):
+        with open(os.path.join(cls.temp_dir, name), 'w') as handle:
+            handle.write('\t'.join(['c%d' % i for i in range(11)] + ['B73', 'F1', 'F2', 'F3'])
+                         + '\n')
+            for pos, values in zip(positions, founders):
+                handle.write('\t'.join(['s%d' % pos, 'A/G', str(chrom), str(pos)] + ['.']*7 +
+                                       ['0'] + ['%g' % v for v in values]) + '\n')
+    def expected(self, founders, boolean=True, chromosomes=None):
+        rows = []
+        for chrom, chrom_length, ril_file, founder_file in chromosomes or self.chromosomes:
+            projector = snp_projector(chrom, chrom_length, self.map_file, ril_file)
+            positions, parents = founders[chrom]
+            if boolean:
+                rows.append(projector.projectSnpBlockBoolean(parents, positions, self.pop_index))
+            else:
+                rows.append(projector.projectSnpBlockDosage(parents, positions, self.pop_index))
+        return np.vstack(rows)
+    def test_project_genome(self):
+        if debug: print("Testing project_genome")
+        out_file = os.path.join(self.temp_dir, 'serial.npy')
+        # Small chunks and blocks so that chromosomes span several of each
+        dosages, positions = project_genome(self.chromosomes, self.map_file, 'B73',
+                                            self.pop_index, out_file, processes=1,
+                                            chunk_size=5, block_size=2)
+        expected = self.expected(self.founders)
+        self.assertEqual(dosages.shape, (21, 5))
+        self.assertEqual(dosages.dtype, np.float32)
+        np.testing.assert_allclose(dosages, expected, rtol=1e-6)
+        np.testing.assert_array_equal(positions, np.concatenate([self.founders[1][0],
+                                                                 self.founders[2][0]]))
+        index = np.load(os.path.join(self.temp_dir, 'serial.index.npz'))
+        self.assertEqual(list(index['chromosomes']), [1]*13 + [2]*8)
+        np.testing.assert_array_equal(index['positions'], positions)
+        self.assertEqual(list(index['samples']), self.samples)
+        # A pool of processes writes the same matrix
+        pool_file = os.path.join(self.temp_dir, 'pool.npy')
+        pooled, pool_positions = project_genome(self.chromosomes, self.map_file, 'B73',
+                                                self.pop_index, pool_file, processes=2,
+                                                chunk_size=5, block_size=2)
+        np.testing.assert_array_equal(pooled, dosages)
+        np.testing.assert_array_equal(pool_positions, positions)
+    def test_project_genome_uint8(self):
+        if debug: print("Testing project_genome with uint8 output")
+        out_file = os.path.join(self.temp_dir, 'quantized.npy')
+        index_file = os.path.join(self.temp_dir, 'quantized_index.npz')
+        dosages, positions = project_genome(self.chromosomes, self.map_file, 'B73',
+                                            self.pop_index, out_file, index_file=index_file,
+                                            dtype='uint8', processes=2, chunk_size=4)
+        self.assertEqual(dosages.dtype, np.uint8)
+        np.testing.assert_array_equal(dosages,
+                                      np.round(self.expected(self.founders)*127.5).astype(np.uint8))
+        self.assertEqual(float(np.load(index_file)['scale']), 127.5)
+        self.assertRaises(ValueError, project_genome, self.chromosomes, self.map_file, 'B73',
+                          self.pop_index, out_file, dtype='int16')
+        self.assertRaises(ValueError, project_genome, [], self.map_file, 'B73',
+                          self.pop_index, out_file)
+    def test_project_genome_dosage(self):
+        if debug: print("Testing project_genome with real-valued founders")
+        chromosomes = [(chrom, chrom_length, ril_file,
+                        os.path.join(self.temp_dir, 'dosages%d.txt' % chrom))
+                       for chrom, chrom_length, ril_file, founder_file in self.chromosomes]
+        prefixes = dict((chrom, os.path.join(self.temp_dir, 'dosages%d' % chrom))
+                        for chrom in (1, 2))
+        dosages, positions = project_genome(chromosomes, self.map_file, 'B73', self.pop_index,
+                                            os.path.join(self.temp_dir, 'dosages.npy'),
+                                            processes=1, chunk_size=6, boolean=False,
+                                            binary_prefixes=prefixes)
+        self.assertTrue(os.path.exists(prefixes[2] + '.genotypes.npy'))
+        np.testing.assert_allclose(dosages, self.expected(self.dosages, boolean=False),
+                                   rtol=1e-6)
+    def test_project_genome_new_ril(self):
+        if debug: print("Testing project_genome with changed RIL files")
+        rng = np.random.RandomState(5)
+        out_file = os.path.join(self.temp_dir, 'changed.npy')
+        project_genome(self.chromosomes, self.map_file, 'B73', self.pop_index, out_file,
+                       processes=1)
+        # Another RIL file for a chromosome in a later call
+        ril_file = self.write_ril('new_ril1.txt', self.samples, rng)
+        chromosomes = [(1, CHROM_LENGTH, ril_file, self.chromosomes[0][3]), self.chromosomes[1]]
+        dosages, positions = project_genome(chromosomes, self.map_file, 'B73', self.pop_index,
+                                            out_file, processes=1)
+        np.testing.assert_allclose(dosages, self.expected(self.founders, chromosomes=chromosomes),
+                                   rtol=1e-6)
+        # The same RIL file rewritten
+        self.write_ril('new_ril1.txt', self.samples, rng)
+        dosages, positions = project_genome(chromosomes, self.map_file, 'B73', self.pop_index,
+                                            out_file, processes=2)
+        np.testing.assert_allclose(dosages, self.expected(self.founders, chromosomes=chromosomes),
+                                   rtol=1e-6)
+        # RIL files with different samples
+        ril_file = self.write_ril('reordered_ril2.txt', self.samples[::-1], rng)
+        chromosomes = [self.chromosomes[0], (2, CHROM_LENGTH, ril_file, self.chromosomes[1][3])]
+        mismatch_file = os.path.join(self.temp_dir, 'mismatch.npy')
+        self.assertRaises(ValueError, project_genome, chromosomes, self.map_file, 'B73',
+                          self.pop_index, mismatch_file)
+        self.assertFalse(os.path.exists(mismatch_file))
+if __name__ == '__main__':
+    debug = True
+    unittest.main(exit = False)
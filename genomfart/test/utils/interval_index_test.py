@@ -0,0 +1,131 @@
+import unittest
+import numpy as np
+from genomfart.utils.interval_index import IntervalIndex
+
+debug = False
+
+class interval_index_test(unittest.TestCase):
+    """ Tests for interval_index.py """
+    @classmethod
+    def setUpClass(cls):
+        cls.index = IntervalIndex([200, 10, 50, 90, 400], [300, 20, 80, 100, 450],
+                                  ['e', 'a', 'b', 'c', 'd'])
+        cls.other = IntervalIndex([15, 70, 95, 310, 500], [55, 92, 250, 320, 600],
+                                  ['p', 'q', 'r', 's', 't'])
+    def test_overlapping(self):
+        if debug: print("Testing overlapping")
+        self.assertEqual(list(self.index.ids[self.index.overlapping(15, 60)]), ['a', 'b'])
+        self.assertEqual(list(self.index.ids[self.index.overlapping(100, 200)]), ['c', 'e'])
+        self.assertEqual(len(self.index.overlapping(21, 49)), 0)
+    def test_overlapping_pairs(self):
+        if debug: print("Testing overlapping_pairs")
+        queries, inds = self.index.overlapping_pairs([15, 21, 95], [60, 49, 200])
+        self.assertEqual(list(queries), [0, 0, 2, 2])
+        self.assertEqual(list(self.index.ids[inds]), ['a', 'b', 'c', 'e'])
+    def test_long_interval(self):
+        if debug: print("Testing overlapping_pairs with a very long interval")
+        n = 20000
+        starts = [1] + [1000*i for i in range(1, n)]
+        ends = [300000000] + [1000*i + 500 for i in range(1, n)]
+        index = IntervalIndex(starts, ends)
+        queries, inds = index.overlapping_pairs([1000*i + 400 for i in range(n)],
+                                                [1000*i + 600 for i in range(n)])
+        # Every query hits the long interval, and all but the first a short one
+        self.assertEqual(len(queries), 2*n - 1)
+        self.assertEqual(list(queries[:3]), [0, 1, 1])
+        self.assertEqual(list(inds[:3]), [0, 0, 1])
+        self.assertEqual(list(inds[-2:]), [0, n-1])
+        self.assertEqual(list(index.overlapping(2000700, 2000700)), [0])
+        queries, inds = index.intersect(IntervalIndex([5000, 19999000], [5600, 20000000]))
+        self.assertEqual(list(queries), [0, 0, 5, n-1])
+        self.assertEqual(list(inds), [0, 1, 0, 1])
+    def test_count_overlapping(self):
+        if debug: print("Testing count_overlapping")
+        counts = self.index.count_overlapping([15, 21, 1], [60, 49, 1000])
+        self.assertEqual(list(counts), [2, 0, 5])
+    def test_nearest(self):
+        if debug: print("Testing nearest")
+        # Equidistant on both sides
+        self.assertEqual(list(self.index.ids[self.index.nearest(30, 40)]), ['a', 'b'])
+        self.assertEqual(list(self.index.ids[self.index.nearest(320, 330)]), ['e'])
+        self.assertEqual(list(self.index.ids[self.index.nearest(1000, 1000)]), ['d'])
+        self.assertEqual(len(self.index.nearest(1000, 1000, radius=100)), 0)
+    def test_nearest_pairs(self):
+        if debug: print("Testing nearest_pairs")
+        queries, inds, dists = self.index.nearest_pairs([30, 320, 1000, 15, 1000],
+                                                        [40, 330, 1000, 60, 1000])
+        self.assertEqual(list(queries), [0, 0, 1, 2, 3, 3, 4])
+        self.assertEqual(list(self.index.ids[inds]), ['a', 'b', 'e', 'd', 'a', 'b', 'd'])
+        self.assertEqual(list(dists), [10, 10, 20, 550, 0, 0, 550])
+        queries, inds, dists = self.index.nearest_pairs([30, 1000, 15], [40, 1000, 60], radius=100)
+        self.assertEqual(list(queries), [0, 0, 2, 2])
+        self.assertEqual(len(IntervalIndex([], []).nearest_pairs([1], [1])[0]), 0)
+        # Agrees with a search over every interval, including ties
+        rng = np.random.RandomState(3)
+        starts = rng.randint(0, 500, 60)
+        index = IntervalIndex(starts, starts + rng.randint(0, 20, 60))
+        query_starts = rng.randint(-50, 550, 200)
+        query_ends = query_starts + rng.randint(0, 10, 200)
+        queries, inds, dists = index.nearest_pairs(query_starts, query_ends, radius=15)
+        pairs = []
+        for q, (start, end) in enumerate(zip(query_starts, query_ends)):
+            gaps = np.maximum(np.maximum(index.starts - end, start - index.ends), 0)
+            if gaps.min() <= 15:
+                pairs += [(q, i, gaps[i]) for i in np.flatnonzero(gaps == gaps.min())]
+        self.assertEqual(list(zip(queries, inds, dists)), pairs)
+    def test_nearest_distances(self):
+        if debug: print("Testing nearest_distances")
+        dists = self.index.nearest_distances([30, 95, 1000], [40, 95, 1000])
+        self.assertEqual(list(dists), [10, 0, 550])
+        dists = IntervalIndex([], []).nearest_distances([1], [1])
+        self.assertEqual(list(dists), [-1])
+    def test_intersect(self):
+        if debug: print("Testing intersect")
+        inds, other_inds = self.index.intersect(self.other)
+        self.assertEqual(list(self.index.ids[inds]), ['a', 'b', 'b', 'c', 'c', 'e'])
+        self.assertEqual(list(self.other.ids[other_inds]), ['p', 'p', 'q', 'q', 'r', 'r'])
+    def test_subtract(self):
+        if debug: print("Testing subtract")
+        starts, ends, inds = self.index.subtract(self.other)
+        self.assertEqual(list(starts), [10, 56, 93, 251, 400])
+        self.assertEqual(list(ends), [14, 69, 94, 300, 450])
+        self.assertEqual(list(self.index.ids[inds]), ['a', 'b', 'c', 'e', 'd'])
+        # Splitting an interval, and removing one entirely
+        starts, ends, inds = IntervalIndex([1, 30], [20, 35]).subtract(
+            IntervalIndex([5, 12, 28], [8, 14, 40]))
+        self.assertEqual(list(starts), [1, 9, 15])
+        self.assertEqual(list(ends), [4, 11, 20])
+        self.assertEqual(list(inds), [0, 0, 0])
+    def test_closest(self):
+        if debug: print("Testing closest")
+        inds, other_inds, dists = self.index.closest(self.other)
+        self.assertEqual(list(self.index.ids[inds]), ['a', 'b', 'b', 'c', 'c', 'e', 'd'])
+        self.assertEqual(list(self.other.ids[other_inds]), ['p', 'p', 'q', 'q', 'r', 'r', 't'])
+        self.assertEqual(list(dists), [0, 0, 0, 0, 0, 0, 50])
+        # Equidistant on both sides
+        inds, other_inds, dists = IntervalIndex([30], [40]).closest(self.index)
+        self.assertEqual(list(self.index.ids[other_inds]), ['a', 'b'])
+        self.assertEqual(list(dists), [10, 10])
+        self.assertEqual(len(self.index.closest(IntervalIndex([], []))[0]), 0)
+    def test_union(self):
+        if debug: print("Testing union")
+        starts, ends = self.index.union(self.other)
+        self.assertEqual(list(starts), [10, 310, 400, 500])
+        self.assertEqual(list(ends), [300, 320, 450, 600])
+    def test_merged(self):
+        if debug: print("Testing merged")
+        index = IntervalIndex([10, 15, 30, 31, 60], [20, 25, 40, 35, 70])
+        starts, ends = index.merged()
+        self.assertEqual(list(starts), [10, 30, 60])
+        self.assertEqual(list(ends), [25, 40, 70])
+        starts, ends = IntervalIndex([], []).merged()
+        self.assertEqual(len(starts), 0)
+    def test_covered_bases(self):
+        if debug: print("Testing covered_bases")
+        index = IntervalIndex([10, 15, 30, 31, 60], [20, 25, 40, 35, 70])
+        covered = index.covered_bases([1, 20, 1, 26, 71], [100, 35, 9, 29, 80])
+        self.assertEqual(list(covered), [16+11+11, 6+6, 0, 0, 0])
+        self.assertEqual(list(IntervalIndex([], []).covered_bases([1], [10])), [0])
+if __name__ == '__main__':
+    debug = True
+    unittest.main(exit = False)
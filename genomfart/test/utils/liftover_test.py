@@ -0,0 +1,89 @@
+import unittest
+import os
+import shutil
+import tempfile
+from genomfart.utils.version_mapper import version_mapper
+from genomfart.utils.liftover import liftover_vcf, liftover_gff
+
+debug = False
+
+class liftover_test(unittest.TestCase):
+    """ Tests for liftover.py """
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        map_file = os.path.join(cls.temp_dir, 'map.txt')
+        with open(map_file, 'w') as map_handle:
+            map_handle.write('v1_chrom\tv1_start\tv1_end\tv2_chrom\tv2_start\tv2_end\torientation\n')
+            map_handle.write('1\t1\t100\t1\t101\t200\t1\n')
+            map_handle.write('1\t101\t200\t2\t1\t100\t-\n')
+            map_handle.write('2\t1\t100\t1\t1\t100\t1\n')
+        cls.mapper = version_mapper(map_file)
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+    def write_lines(self, name, lines):
+        filename = os.path.join(self.temp_dir, name)
+        with open(filename, 'w') as handle:
+            handle.write(''.join(line + '\n' for line in lines))
+        return filename
+    def read_records(self, filename):
+        return [line.rstrip('\n').split('\t') for line in open(filename) \
+                if not line.startswith('#')]
+    def test_liftover_vcf(self):
+        if debug: print("Testing liftover_vcf")
+        vcf_file = self.write_lines('in.vcf', [
+            '##fileformat=VCFv4.1',
+            '##contig=<ID=1,length=200>',
+            '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO',
+            '1\t10\ta\tA\tG\t.\t.\tDP=1',
+            '1\t150\tb\tAC\tGT,.\t.\t.\tDP=2',
+            '1\t150\tc\tAT\tA\t.\t.\tDP=3',
+            '1\t95\td\tACGTACGT\tA\t.\t.\tDP=4',
+            '1\t300\te\tA\tG\t.\t.\tDP=5',
+            '2\t5\tf\tC\tT\t.\t.\tDP=6'])
+        out_file = os.path.join(self.temp_dir, 'out.vcf')
+        reject_file = os.path.join(self.temp_dir, 'rejects.vcf')
+        # Small chunks so that the runs have to be merged
+        counts = liftover_vcf(vcf_file, out_file, self.mapper, reject_file=reject_file,
+                              chunk_size=2)
+        self.assertEqual(counts, (3, 3))
+        header = [line for line in open(out_file) if line.startswith('#')]
+        self.assertEqual(len(header), 2)
+        self.assertEqual(self.read_records(out_file),
+                         [['1', '5', 'f', 'C', 'T', '.', '.', 'DP=6'],
+                          ['1', '110', 'a', 'A', 'G', '.', '.', 'DP=1'],
+                          ['2', '50', 'b', 'GT', 'AC,.', '.', '.', 'DP=2']])
+        self.assertEqual([record[2] for record in self.read_records(reject_file)],
+                         ['c', 'd', 'e'])
+    def test_liftover_gff(self):
+        if debug: print("Testing liftover_gff")
+        gff_file = self.write_lines('in.gff', [
+            '##gff-version 3',
+            '##sequence-region 1 1 200',
+            '1\tsrc\tgene\t120\t130\t.\t+\t.\tID=g2',
+            '1\tsrc\tgene\t10\t20\t.\t+\t.\tID=g1',
+            '1\tsrc\tgene\t90\t110\t.\t-\t.\tID=g3',
+            '##FASTA',
+            '>1',
+            'ACGT'])
+        out_file = os.path.join(self.temp_dir, 'out.gff')
+        reject_file = os.path.join(self.temp_dir, 'rejects.gff')
+        counts = liftover_gff(gff_file, out_file, self.mapper, reject_file=reject_file)
+        self.assertEqual(counts, (2, 1))
+        self.assertEqual(open(out_file).readline(), '##gff-version 3\n')
+        self.assertEqual(self.read_records(out_file),
+                         [['1', 'src', 'gene', '110', '120', '.', '+', '.', 'ID=g1'],
+                          ['2', 'src', 'gene', '71', '81', '.', '-', '.', 'ID=g2']])
+        self.assertEqual(self.read_records(reject_file)[0][-1], 'ID=g3')
+        # Back to v1
+        back_file = os.path.join(self.temp_dir, 'back.gff')
+        liftover_gff(out_file, back_file, self.mapper, direction='v2_to_v1')
+        self.assertEqual(self.read_records(back_file),
+                         [['1', 'src', 'gene', '10', '20', '.', '+', '.', 'ID=g1'],
+                          ['1', 'src', 'gene', '120', '130', '.', '+', '.', 'ID=g2']])
+        with self.assertRaises(ValueError):
+            liftover_gff(gff_file, out_file, self.mapper, direction='v3')
+if __name__ == '__main__':
+    debug = True
+    unittest.main(exit = False)
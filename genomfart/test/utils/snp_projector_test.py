@@ -0,0 +1,208 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from genomfart.utils.snp_projector import snp_projector
+from genomfart.utils.caching import file_checksum
+from genomfart.parsers.SNPdata import SNPdata
+
+debug = False
+
+CHROM = 2
+CHROM_LENGTH = 20000
+SNP_POSITIONS = [300, 1000, 1500, 1600, 2000, 2500, 5000, 5999, 6001, 11000, 11500, 12000,
+                 13000, 19999]
+
+class snp_projector_test(unittest.TestCase):
+    """ Tests for snp_projector.py """
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(7)
+        # 12 markers on each of two chromosomes, 1 kb apart
+        cls.map_file = os.path.join(cls.temp_dir, 'map.txt')
+        with open(cls.map_file, 'w') as map_handle:
+            map_handle.write('chr\talt\tmarker\tcm\tpos\n')
+            for chrom in (1, 2):
+                for i in range(12):
+                    map_handle.write('%d\talt\tPZE%d%02d\t%s\t%d\n' % (chrom, chrom, i, 0.5*i,
+                                                                     1000*(i+1)))
+        # A line per marker after one for the start of the chromosome
+        cls.ril_lines = ['a\tb\tc\td\te\t' + '\t'.join('S%d' % i for i in range(6))]
+        for i in range(13):
+            cls.ril_lines.append('\t'.join(['m%d' % i, '.', '.', '.', '.'] +
+                                           ['%g' % v for v in rng.choice([0, 0.5, 1, 2], 6)]))
+        cls.ril_file = cls.write_lines('ril.txt', cls.ril_lines)
+        cls.pop_index = np.array([0, 0, 0, 1, 1, 1])
+        cls.founders = rng.randint(0, 2, (len(SNP_POSITIONS), 2))
+        cls.founder_file = cls.write_founders('founders.txt', cls.founders)
+        cls.dosages = rng.choice([0, 0.25, 0.5, 1], (len(SNP_POSITIONS), 2))
+        cls.dosage_file = cls.write_founders('dosages.txt', cls.dosages)
+        cls.projector = snp_projector(CHROM, CHROM_LENGTH, cls.map_file, cls.ril_file)
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+    @classmethod
+    def write_lines(cls, name, lines, newline=True):
+        filename = os.path.join(cls.temp_dir, name)
+        with open(filename, 'w') as handle:
+            handle.write('\n'.join(lines) + ('\n' if newline else ''))
+        return filename
+    @classmethod
+    def write_founders(cls, name, founders):
+        lines = ['\t'.join(['c%d' % i for i in range(11)] + ['B73', 'F1', 'F2'])]
+        for pos, values in zip(SNP_POSITIONS, founders):
+            lines.append('\t'.join(['s%d' % pos, 'A/G', str(CHROM), str(pos)] + ['.']*7 +
+                                   ['0'] + ['%g' % v for v in values]))
+        return cls.write_lines(name, lines)
+    def reference(self, parents, pos, boolean=True):
+        # Projection of one SNP following the original per-sample loop
+        projector = self.projector
+        agp_map = projector.theAGPMap
+        left_mark, left, right_mark, right = agp_map.getInterval(CHROM, pos)
+        left = 0 if left is None else left
+        right = CHROM_LENGTH if right is None else right
+        pd = float(pos-left)/float(right-left) if right != left else 0.
+        leftmarker = agp_map.getMarkerNumber(left_mark)-projector.firstMarker+1 if left_mark \
+          else 0
+        rightmarker = agp_map.getMarkerNumber(right_mark)-projector.firstMarker+1 if right_mark \
+          else projector.maxMarker
+        values = []
+        for i, pop in enumerate(self.pop_index):
+            leftval = projector.genotypes[i,leftmarker]
+            rightval = projector.genotypes[i,rightmarker]
+            value = leftval if leftval == rightval else leftval*(1-pd) + rightval*pd
+            if boolean:
+                values.append(0 if parents[pop] == 0 else value)
+            else:
+                values.append(value*parents[pop])
+        return np.array(values)
+    def test_importMarkersForMap(self):
+        if debug: print("Testing importMarkersForMap")
+        projector = self.projector
+        self.assertEqual(projector.samp_names, ['S%d' % i for i in range(6)])
+        self.assertEqual(projector.sampleNameMap['S4'], 4)
+        self.assertEqual(projector.genotypes.dtype, np.float32)
+        expected = np.array([line.split('\t')[5:] for line in self.ril_lines[1:]], dtype=float).T
+        np.testing.assert_array_equal(projector.genotypes, expected)
+        self.assertEqual(list(projector.markerIds), ['m%d' % i for i in range(13)])
+        self.assertEqual(projector.firstMarker, 200)
+        self.assertEqual(projector.maxMarker, 12)
+        # Small chunks, and no line break at the end of the file
+        ril_file = self.write_lines('ril_no_newline.txt', self.ril_lines, newline=False)
+        projector.importMarkersForMap(ril_file, chunkSize=4)
+        np.testing.assert_array_equal(projector.genotypes, expected)
+        self.assertEqual(len(projector.markerIds), 13)
+    def test_rilCacheFile(self):
+        if debug: print("Testing the RIL cache")
+        ril_file = os.path.join(self.temp_dir, 'cached_ril.txt')
+        cache_file = os.path.join(self.temp_dir, 'ril.npz')
+        shutil.copy(self.ril_file, ril_file)
+        parsed = snp_projector(CHROM, CHROM_LENGTH, self.map_file, ril_file,
+                               rilCacheFile=cache_file)
+        self.assertTrue(os.path.exists(cache_file))
+        cached = snp_projector(CHROM, CHROM_LENGTH, self.map_file, ril_file,
+                               rilCacheFile=cache_file)
+        self.assertTrue(cached._loadRilCache(cache_file, file_checksum(ril_file)))
+        np.testing.assert_array_equal(cached.genotypes, parsed.genotypes)
+        self.assertEqual(cached.samp_names, parsed.samp_names)
+        self.assertEqual(cached.sampleNameMap, parsed.sampleNameMap)
+        self.assertEqual(list(cached.markerIds), list(parsed.markerIds))
+        # Changing the RIL file makes the cache stale
+        lines = list(self.ril_lines)
+        lines[1] = '\t'.join(lines[1].split('\t')[:5] + ['3']*6)
+        ril_file = self.write_lines('cached_ril.txt', lines)
+        changed = snp_projector(CHROM, CHROM_LENGTH, self.map_file, ril_file,
+                                rilCacheFile=cache_file)
+        self.assertEqual(list(changed.genotypes[:,0]), [3]*6)
+        cached = snp_projector(CHROM, CHROM_LENGTH, self.map_file, ril_file,
+                               rilCacheFile=cache_file)
+        self.assertEqual(list(cached.genotypes[:,0]), [3]*6)
+    def test_projectSnpBlockBoolean(self):
+        if debug: print("Testing projectSnpBlockBoolean")
+        # Out of order, and including positions on markers
+        order = np.random.RandomState(1).permutation(len(SNP_POSITIONS))
+        positions = np.array(SNP_POSITIONS)[order]
+        parents = self.founders[order]
+        block = self.projector.projectSnpBlockBoolean(parents, positions, self.pop_index)
+        self.assertEqual(block.shape, (len(positions), 6))
+        for i, pos in enumerate(positions):
+            np.testing.assert_allclose(block[i], self.reference(parents[i], pos))
+            np.testing.assert_allclose(block[i], self.projector.projectSnpBoolean(
+                parents[i], pos, CHROM_LENGTH, self.pop_index))
+        # Into a given array
+        out = np.zeros((len(positions), 6), dtype=np.float32)
+        result = self.projector.projectSnpBlockBoolean(parents, positions, self.pop_index, out=out)
+        self.assertTrue(result is out)
+        np.testing.assert_allclose(out, block, rtol=1e-6)
+        self.assertEqual(self.projector.projectSnpBlockBoolean(parents[:0], [],
+                                                               self.pop_index).shape, (0, 6))
+    def test_interval_reuse(self):
+        if debug: print("Testing reuse of interval genotypes")
+        projector = snp_projector(CHROM, CHROM_LENGTH, self.map_file, self.ril_file)
+        parents = np.ones(2, dtype=np.int64)
+        projector.projectSnpBoolean(parents, 1500, CHROM_LENGTH, self.pop_index)
+        key, leftval, rightval, diff = projector._intervalCache
+        self.assertEqual(key, (1, 2))
+        np.testing.assert_array_equal(leftval, projector.genotypes[:,1])
+        np.testing.assert_array_equal(diff, np.flatnonzero(projector.genotypes[:,1] !=
+                                                           projector.genotypes[:,2]))
+        # The next SNP between the same markers reuses the genotypes
+        projector.projectSnpBoolean(parents, 1600, CHROM_LENGTH, self.pop_index)
+        self.assertTrue(projector._intervalCache[1] is leftval)
+        projector.projectSnpBoolean(parents, 2500, CHROM_LENGTH, self.pop_index)
+        self.assertEqual(projector._intervalCache[0], (2, 3))
+        # Importing genotypes clears the cache
+        projector.importMarkersForMap(self.ril_file)
+        self.assertTrue(projector._intervalCache is None)
+    def test_projectSnpBlockDosage(self):
+        if debug: print("Testing projectSnpBlockDosage")
+        positions = np.array(SNP_POSITIONS)[::-1]
+        parents = self.dosages[::-1]
+        block = self.projector.projectSnpBlockDosage(parents, positions, self.pop_index)
+        for i, pos in enumerate(positions):
+            np.testing.assert_allclose(block[i], self.reference(parents[i], pos, boolean=False))
+            np.testing.assert_allclose(block[i], self.projector.projectSnpDosage(
+                parents[i], pos, CHROM_LENGTH, self.pop_index))
+        # Boolean parents give the boolean projection
+        np.testing.assert_allclose(
+            self.projector.projectSnpBlockDosage(self.founders.astype(float), SNP_POSITIONS,
+                                                 self.pop_index),
+            self.projector.projectSnpBlockBoolean(self.founders, SNP_POSITIONS, self.pop_index))
+    def test_projectAllSnps(self):
+        if debug: print("Testing projectAllSnps")
+        founder_data = SNPdata(CHROM, self.founder_file, 'B73')
+        projection = np.array(list(self.projector.projectAllSnps(CHROM_LENGTH, self.pop_index,
+                                                                 founder_data)))
+        for i, pos in enumerate(SNP_POSITIONS):
+            np.testing.assert_allclose(projection[i], self.reference(self.founders[i], pos))
+        blocks = list(self.projector.projectAllSnpBlocks(self.pop_index, founder_data,
+                                                         block_size=4))
+        self.assertEqual([len(block[0]) for block in blocks], [4, 4, 4, 2])
+        np.testing.assert_allclose(np.vstack([block[2] for block in blocks]), projection)
+        np.testing.assert_array_equal(np.concatenate([block[1] for block in blocks]),
+                                      SNP_POSITIONS)
+        # Chosen positions, with their SNP indices
+        chosen = list(self.projector.projectAllSnps(CHROM_LENGTH, self.pop_index, founder_data,
+                                                    positions=set([1000, 13000]),
+                                                    enumerate_snps=True))
+        self.assertEqual([ind for ind, values in chosen], [1, 12])
+        np.testing.assert_allclose(chosen[1][1], projection[12])
+        inds = [block[0] for block in self.projector.projectAllSnpBlocks(
+            self.pop_index, founder_data, block_size=4, positions=set([1000, 13000]))]
+        self.assertEqual([list(x) for x in inds], [[1], [12]])
+    def test_projectAllSnps_dosage(self):
+        if debug: print("Testing projectAllSnps with real-valued founders")
+        founder_data = SNPdata(CHROM, self.dosage_file, 'B73')
+        projection = np.array(list(self.projector.projectAllSnps(CHROM_LENGTH, self.pop_index,
+                                                                 founder_data, boolean=False)))
+        for i, pos in enumerate(SNP_POSITIONS):
+            np.testing.assert_allclose(projection[i], self.reference(self.dosages[i], pos,
+                                                                     boolean=False))
+        blocks = list(self.projector.projectAllSnpBlocks(self.pop_index, founder_data,
+                                                         block_size=5, boolean=False))
+        np.testing.assert_allclose(np.vstack([block[2] for block in blocks]), projection)
+if __name__ == '__main__':
+    debug = True
+    unittest.main(exit = False)
@@ -1,6 +1,8 @@
 import unittest
+import os
+import shutil
+import tempfile
 from genomfart.utils.version_mapper import version_mapper
-from genomfart.data.data_constants import VERSION_TEST_FILE
 
 debug = False
 
@@ -8,7 +10,22 @@ class version_mapper_test(unittest.TestCase):
     """ Tests for version_mapper.py """
     @classmethod
     def setUpClass(cls):
-        cls.mapper = version_mapper(VERSION_TEST_FILE)
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.map_file = os.path.join(cls.temp_dir, 'map.txt')
+        with open(cls.map_file, 'w') as map_handle:
+            map_handle.write('v1_chrom\tv1_start\tv1_end\tv2_chrom\tv2_start\tv2_end\torientation\n')
+            map_handle.write('1\t1\t13850000\t1\t1\t13848500\t1\n')
+            map_handle.write('1\t13850001\t13860000\t1\t13848501\t13858500\t1\n')
+            map_handle.write('1\t13860101\t13870000\t3\t5001\t14900\t-\n')
+            map_handle.write('10\t139836001\t139840000\t2\t16757162\t16761161\t-\n')
+            map_handle.write('10\t139840001\t139850000\t10\t1\t10000\t1\n')
+            # A chromosome-length segment followed by a short one
+            map_handle.write('5\t1\t300000000\t5\t1\t300000000\t1\n')
+            map_handle.write('5\t300000001\t300000100\t6\t1\t100\t-\n')
+        cls.mapper = version_mapper(cls.map_file)
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
     def test_v1_to_v2_map(self):
         if debug: print("Testing v1_to_v2_map")
         # Cis direction
@@ -25,6 +42,27 @@ class version_mapper_test(unittest.TestCase):
         # Trans direction
         chrom,pos,orient = self.mapper.v2_to_v1_map(2,16760272)
         self.assertEquals((chrom,pos,orient),(10,139836890,'-'))
+    def test_v1_to_v2_map_batch(self):
+        if debug: print("Testing v1_to_v2_map_batch")
+        codes, positions, strands, valid = self.mapper.v1_to_v2_map_batch([1, 10, 1],
+                                                        [13857655, 139836890, 0])
+        self.assertEqual(list(valid), [True, True, False])
+        self.assertEqual([self.mapper.chroms[c] for c in codes[valid]], [1, 2])
+        self.assertEqual(list(positions[valid]), [13856155, 16760272])
+        self.assertEqual(list(strands[valid]), [1, -1])
+        # Chromosomes given as strings, and chromosomes absent from the map
+        codes, positions, strands, valid = self.mapper.v1_to_v2_map_batch('1', [13857655])
+        self.assertEqual(list(positions), [13856155])
+        codes, positions, strands, valid = self.mapper.v1_to_v2_map_batch('none', [1])
+        self.assertEqual(list(valid), [False])
+    def test_v2_to_v1_map_batch(self):
+        if debug: print("Testing v2_to_v1_map_batch")
+        codes, positions, strands, valid = self.mapper.v2_to_v1_map_batch([1, 2],
+                                                        [13856155, 16760272])
+        self.assertTrue(valid.all())
+        self.assertEqual([self.mapper.chroms[c] for c in codes], [1, 10])
+        self.assertEqual(list(positions), [13857655, 139836890])
+        self.assertEqual(list(strands), [1, -1])
     def test_v1_to_v2_seg_map(self):
         if debug: print("Testing v1_to_v2_seg_map")
         # Cis direction    
@@ -36,6 +74,38 @@ class version_mapper_test(unittest.TestCase):
         self.assertEqual(list(seg_map.values())[0],
             (2,16760272,16760267,'-')
         )
+    def test_v1_to_v2_seg_map_batch(self):
+        if debug: print("Testing v1_to_v2_seg_map_batch")
+        queries, starts, ends, codes, v2_starts, v2_ends, strands = \
+          self.mapper.v1_to_v2_seg_map_batch([10, 1], [139836890, 13857655],
+                                             [139836895, 13857659])
+        self.assertEqual(list(queries), [0, 1])
+        self.assertEqual(list(starts), [139836890, 13857655])
+        self.assertEqual(list(ends), [139836895, 13857659])
+        self.assertEqual([self.mapper.chroms[c] for c in codes], [2, 1])
+        self.assertEqual(list(v2_starts), [16760272, 13856155])
+        self.assertEqual(list(v2_ends), [16760267, 13856159])
+        self.assertEqual(list(strands), [-1, 1])
+        # Agrees with the single range map
+        queries, starts, ends, codes, v2_starts, v2_ends, strands = \
+          self.mapper.v1_to_v2_seg_map_batch(1, [13000000], [14000000])
+        seg_map = self.mapper.v1_to_v2_seg_map(1, 13000000, 14000000)
+        self.assertEqual(sorted(seg_map.items()),
+                         [((1, starts[i], ends[i]),
+                           (self.mapper.chroms[codes[i]], v2_starts[i], v2_ends[i],
+                            1 if strands[i] == 1 else '-')) for i in range(len(queries))])
+        self.assertEqual(list(starts), [13000000, 13850001, 13860101])
+        self.assertEqual(list(ends), [13850000, 13860000, 13870000])
+        # Ranges next to and across the end of a very long segment
+        queries, starts, ends, codes, v2_starts, v2_ends, strands = \
+          self.mapper.v1_to_v2_seg_map_batch(5, [10, 299999990, 300000050, 300000101],
+                                             [20, 300000010, 300000060, 300000200])
+        self.assertEqual(list(queries), [0, 1, 1, 2])
+        self.assertEqual(list(starts), [10, 299999990, 300000001, 300000050])
+        self.assertEqual(list(ends), [20, 300000000, 300000010, 300000060])
+        self.assertEqual([self.mapper.chroms[c] for c in codes], [5, 5, 6, 6])
+        self.assertEqual(list(v2_starts), [10, 299999990, 100, 51])
+        self.assertEqual(list(v2_ends), [20, 300000000, 91, 41])
     def test_v2_to_v1_seg_map(self):
         if debug: print("Testing v2_to_v1_seg_map")
         # Cis direction    
@@ -53,6 +123,29 @@ class version_mapper_test(unittest.TestCase):
         seg_map = self.mapper.v2_to_v1_seg_map(2,16760267,16760272)
         self.assertEqual(list(seg_map.values())[0],
                          (10,139836895,139836890,'-'))
+    def test_cache(self):
+        if debug: print("Testing the map cache")
+        temp_dir = tempfile.mkdtemp()
+        try:
+            map_file = os.path.join(temp_dir, 'map.txt')
+            cache_file = os.path.join(temp_dir, 'map.npz')
+            shutil.copy(self.map_file, map_file)
+            mapper = version_mapper(map_file, cache_file=cache_file)
+            self.assertTrue(os.path.exists(cache_file))
+            cached = version_mapper(map_file, cache_file=cache_file)
+            self.assertEqual(cached.chroms, mapper.chroms)
+            self.assertEqual(cached.v1_to_v2_map(10,139836890), (2,16760272,'-'))
+            self.assertEqual(cached.v2_to_v1_seg_map(1, 13856155, 13856159),
+                             mapper.v2_to_v1_seg_map(1, 13856155, 13856159))
+            # Changing the map file makes the cache stale
+            with open(map_file, 'a') as map_handle:
+                map_handle.write('99\t1\t10\t99\t1\t10\t1\n')
+            mapper = version_mapper(map_file, cache_file=cache_file)
+            self.assertEqual(mapper.v1_to_v2_map(99, 5), (99, 5, 1))
+            self.assertEqual(version_mapper(map_file, cache_file=cache_file).v1_to_v2_map(99, 5),
+                             (99, 5, 1))
+        finally:
+            shutil.rmtree(temp_dir)
 if __name__ == '__main__':
     debug = True
     unittest.main(exit = False)
@@ -0,0 +1,243 @@
+from array import array
+from bisect import bisect_left
+import numpy as np
+
+class AttributeStore(object):
+    """ Columnar store for the key->value attributes of many records.
+
+    Each distinct value is stored once and referred to by an integer code, and
+    each key has its own column holding the rows where it is present along with
+    their value codes. Records missing a key take no space in that key's column.
+    Unhashable values (e.g. lists or arrays) can't be interned, so each one is
+    stored under its own code
+
+    Examples
+    --------
+    >>> from genomfart.utils.attribute_store import AttributeStore
+    >>> store = AttributeStore()
+    >>> store.add_row({'ID':'gene:1', 'biotype':'protein_coding'})
+    0
+    >>> store.add_row({'Parent':'gene:1'})
+    1
+    >>> store.add_row({'ID':'gene:2', 'biotype':'protein_coding'})
+    2
+    >>> store.find_rows('biotype', 'protein_coding')
+    array([0, 2], dtype=int32)
+    >>> store.get_row(1)
+    {'Parent': 'gene:1'}
+    """
+    def __init__(self):
+        """ Instantiates an empty AttributeStore
+        """
+        ## The number of rows in the store
+        self.n_rows = 0
+        ## List of code -> value
+        self.values = []
+        ## Dictionary of (type, value) -> code. The type is part of the key so
+        # that e.g. 1 and 1.0 are kept apart
+        self._value_codes = {}
+        ## Dictionary of key -> (array of rows, array of value codes). Rows are
+        # kept sorted
+        self._columns = {}
+        ## Cached object array of the values, rebuilt as values are added
+        self._values_array = np.array([], dtype=object)
+    def _intern(self, value):
+        """ Gets the code for a value, adding it if it's new
+        """
+        value_key = (type(value), value)
+        try:
+            code = self._value_codes.get(value_key)
+        except TypeError:
+            # Unhashable values are stored without interning
+            self.values.append(value)
+            return len(self.values)-1
+        if code is None:
+            code = len(self.values)
+            self._value_codes[value_key] = code
+            self.values.append(value)
+        return code
+    def _get_values_array(self):
+        """ Gets the values as an object array indexable by code
+        """
+        if len(self._values_array) != len(self.values):
+            self._values_array = np.empty(len(self.values), dtype=object)
+            # Filled one at a time so that array values aren't broadcast
+            for code, value in enumerate(self.values):
+                self._values_array[code] = value
+        return self._values_array
+    def __len__(self):
+        """ Gets the number of rows in the store
+        """
+        return self.n_rows
+    def keys(self):
+        """ Gets the attribute keys present in the store
+
+        Returns
+        -------
+        List of keys
+        """
+        return list(self._columns)
+    def add_row(self, attrs):
+        """ Adds a record
+
+        Parameters
+        ----------
+        attrs : dict
+            Dictionary of key -> hashable value
+
+        Returns
+        -------
+        The row index of the new record
+        """
+        row = self.n_rows
+        for key, value in attrs.items():
+            if key not in self._columns:
+                self._columns[key] = (array('i'), array('i'))
+            rows, codes = self._columns[key]
+            rows.append(row)
+            codes.append(self._intern(value))
+        self.n_rows += 1
+        return row
+    def add_rows(self, attrs_list):
+        """ Adds many records at once, appending to each key's column once
+
+        Parameters
+        ----------
+        attrs_list : list of dicts
+            Dictionary of key -> hashable value for each record
+
+        Returns
+        -------
+        np.ndarray of the row indices of the new records
+        """
+        first = self.n_rows
+        new_columns = {}
+        for row, attrs in enumerate(attrs_list, first):
+            for key, value in attrs.items():
+                if key not in new_columns:
+                    new_columns[key] = ([], [])
+                rows, codes = new_columns[key]
+                rows.append(row)
+                codes.append(self._intern(value))
+        for key, (rows, codes) in new_columns.items():
+            if key not in self._columns:
+                self._columns[key] = (array('i'), array('i'))
+            self._columns[key][0].extend(rows)
+            self._columns[key][1].extend(codes)
+        self.n_rows += len(attrs_list)
+        return np.arange(first, self.n_rows)
+    def set(self, row, key, value):
+        """ Sets the value of a key for a record, overwriting any existing value
+
+        Parameters
+        ----------
+        row : int
+            The row index of the record
+        key : hashable
+            The attribute key
+        value : hashable
+            The attribute value
+
+        Raises
+        ------
+        IndexError
+            If the row is not in the store
+        """
+        if not 0 <= row < self.n_rows:
+            raise IndexError("Row %d is not in the store" % row)
+        if key not in self._columns:
+            self._columns[key] = (array('i'), array('i'))
+        rows, codes = self._columns[key]
+        code = self._intern(value)
+        ind = bisect_left(rows, row)
+        if ind < len(rows) and rows[ind] == row:
+            codes[ind] = code
+        else:
+            rows.insert(ind, row)
+            codes.insert(ind, code)
+    def get(self, row, key, default=None):
+        """ Gets the value of a key for a record
+
+        Parameters
+        ----------
+        row : int
+            The row index of the record
+        key : hashable
+            The attribute key
+        default : object, optional
+            What to return if the record doesn't have the key
+
+        Returns
+        -------
+        The attribute value
+        """
+        if key not in self._columns:
+            return default
+        rows, codes = self._columns[key]
+        ind = bisect_left(rows, row)
+        if ind < len(rows) and rows[ind] == row:
+            return self.values[codes[ind]]
+        return default
+    def get_row(self, row):
+        """ Gets all attributes of a record
+
+        Parameters
+        ----------
+        row : int
+            The row index of the record
+
+        Returns
+        -------
+        Dictionary of key -> value
+        """
+        row_dict = {}
+        for key, (rows, codes) in self._columns.items():
+            ind = bisect_left(rows, row)
+            if ind < len(rows) and rows[ind] == row:
+                row_dict[key] = self.values[codes[ind]]
+        return row_dict
+    def get_column(self, key):
+        """ Gets every value of a key
+
+        Parameters
+        ----------
+        key : hashable
+            The attribute key
+
+        Returns
+        -------
+        (np.ndarray of the rows having the key, object np.ndarray of their values)
+        """
+        if key not in self._columns:
+            return np.array([], dtype=np.intc), np.array([], dtype=object)
+        rows, codes = self._columns[key]
+        return (np.array(rows, dtype=np.intc),
+                self._get_values_array()[np.array(codes, dtype=np.intc)])
+    def find_rows(self, key, value=None):
+        """ Finds the records having a key, optionally with a given value
+
+        Parameters
+        ----------
+        key : hashable
+            The attribute key
+        value : hashable, optional
+            The value the key must have. If None, any value matches. Unhashable
+            values match nothing, as they aren't interned
+
+        Returns
+        -------
+        np.ndarray of row indices, in increasing order
+        """
+        if key not in self._columns:
+            return np.array([], dtype=np.intc)
+        rows, codes = self._columns[key]
+        rows = np.array(rows, dtype=np.intc)
+        if value is None:
+            return rows
+        try:
+            code = self._value_codes.get((type(value), value))
+        except TypeError:
+            code = None
+        if code is None:
+            return np.array([], dtype=np.intc)
+        return rows[np.array(codes, dtype=np.intc) == code]
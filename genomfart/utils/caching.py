@@ -1,5 +1,38 @@
+import hashlib
 from llist import dllist, dllistnode
 
+def file_checksum(filename, algorithm='md5', block_size=1<<20):
+    """ Computes the checksum of a file's contents, e.g. to tell whether a
+    cache derived from the file is still current
+
+    Parameters
+    ----------
+    filename : str
+        The file to checksum
+    algorithm : str, optional
+        The name of a hashlib algorithm
+    block_size : int, optional
+        The number of bytes read at a time
+
+    Returns
+    -------
+    The hexadecimal digest of the file
+
+    Examples
+    --------
+    >>> from genomfart.utils.caching import file_checksum
+    >>> from genomfart.data.data_constants import FASTA_TEST_FILE
+    >>> len(file_checksum(FASTA_TEST_FILE))
+    32
+    """
+    digest = hashlib.new(algorithm)
+    with open(filename, 'rb') as handle:
+        while 1:
+            block = handle.read(block_size)
+            if not block: break
+            digest.update(block)
+    return digest.hexdigest()
+
 class LRUcache(dict):
     """ A least recently used cache
 
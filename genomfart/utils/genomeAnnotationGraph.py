@@ -1,5 +1,51 @@
 import networkx as nx
+import numpy as np
+import heapq
+import sys
 from Ranger import RangeBucketMap, Range
+from genomfart.utils.interval_index import IntervalIndex
+from genomfart.utils.attribute_store import AttributeStore
+
+if sys.version_info[0] > 2:
+    xrange = range
+
+## Consequence codes returned by genomeAnnotationGraph.predict_coding_consequences
+CONSEQUENCE_SYNONYMOUS = 0
+CONSEQUENCE_MISSENSE = 1
+CONSEQUENCE_NONSENSE = 2
+CONSEQUENCE_STOP_LOST = 3
+## The variant isn't a single-base substitution, or its codon is incomplete
+# or contains ambiguous bases
+CONSEQUENCE_UNKNOWN = 4
+## The reference allele doesn't match the sequence
+CONSEQUENCE_REF_MISMATCH = 5
+## The names of the consequence codes, indexed by code
+CONSEQUENCE_NAMES = ('synonymous', 'missense', 'nonsense', 'stop_lost', 'unknown',
+                     'ref_mismatch')
+
+def _make_base_codes():
+    """ Builds an array mapping ASCII codes to base codes (A=0, C=1, G=2, T=3),
+    with 4 for anything else
+    """
+    codes = np.full(256, 4, dtype=np.uint8)
+    for i, base in enumerate('ACGT'):
+        codes[ord(base)] = i
+        codes[ord(base.lower())] = i
+    return codes
+
+def _make_codon_table():
+    """ Builds the standard genetic code as an array of ASCII amino acid codes
+    indexed by 16*first base + 4*second base + third base, using base codes
+    """
+    tcag_aas = 'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'
+    table = np.empty(64, dtype=np.uint8)
+    for i, aa in enumerate(tcag_aas):
+        codon = ('TCAG'[i // 16], 'TCAG'[(i // 4) % 4], 'TCAG'[i % 4])
+        table[sum(4**(2-j)*'ACGT'.index(b) for j, b in enumerate(codon))] = ord(aa)
+    return table
+
+_BASE_CODES = _make_base_codes()
+_CODON_TABLE = _make_codon_table()
 
 class genomeAnnotationGraph(object):
     """ Representation of a genome, in which annotations in the genome are Ranges
@@ -14,12 +60,34 @@ class genomeAnnotationGraph(object):
         # that lists the Ranges corresponding to the ID, a "seqid" attribute
         # that gives the coordinate system where the node is located, a
         # "type" attribute that gives the element type, a "strand" attribute
-        # that gives the element strand (not always applicable), and an "attributes"
-        # attribute that is a list of dictionaries of key-> val for any other attributes        
+        # that gives the element strand (not always applicable), and an "attribute_rows"
+        # attribute that lists the rows in attribute_store holding any other attributes,
+        # one row per Range
         self.graph = nx.DiGraph()
+        ## Columnar store of the attributes of every annotation added, with keys
+        # and repeated values interned
+        self.attribute_store = AttributeStore()
+        ## List of row in attribute_store -> element id
+        self.attribute_row_ids = []
+        ## Cached object array of attribute_row_ids, rebuilt as rows are added
+        self._attribute_row_ids_array = np.array([], dtype=object)
         ## Dictionary of seq_id -> RangeBucketMap for each coordinate system. Each Range
         # in a RangeBucketMap maps to an ID that corresponds to a node in the graph
         self.bucketmaps = {}
+        ## Dictionary of seq_id -> ([starts], [ends], [element_ids]) for every Range
+        # added, from which the sorted interval indexes are built
+        self._interval_rows = {}
+        ## Dictionary of seq_id -> {element_type -> IntervalIndex}, where the None
+        # type indexes all elements. Each type gets its own index so that typed
+        # queries never touch elements of other types. Built lazily and dropped
+        # when a seqid changes
+        self._interval_indexes = {}
+        ## Dictionary of seq_id -> array of element types, in the order of the
+        # all-type IntervalIndex
+        self._interval_types = {}
+        ## Dictionary of seq_id -> {cds_type -> CDS exon table}, as built by
+        # _get_cds_table. Built lazily and dropped when a seqid changes
+        self._cds_tables = {}
     def add_annotation(self, element_id, seqid, start, end, element_type,
                        strand='?', parents = None, children = None,  **attr):
         """ Adds an annotation to the genome
@@ -54,6 +122,15 @@ class genomeAnnotationGraph(object):
         # Put the seqid in the bucketmaps dictionary if necessary
         if seqid not in self.bucketmaps:
             self.bucketmaps[seqid] = RangeBucketMap()
+            self._interval_rows[seqid] = ([], [], [])
+        # Record the Range for the interval indexes, which need rebuilding
+        starts, ends, element_ids = self._interval_rows[seqid]
+        starts.append(start)
+        ends.append(end)
+        element_ids.append(element_id)
+        self._interval_indexes.pop(seqid, None)
+        self._interval_types.pop(seqid, None)
+        self._cds_tables.pop(seqid, None)
         # Make the Range for this element
         element_range = Range.closed(start, end)
         # Put element in RangeBucketMap
@@ -61,12 +138,16 @@ class genomeAnnotationGraph(object):
         # Put node in graph if necessary
         if element_id not in self.graph:
             self.graph.add_node(element_id)
+        if 'Ranges' not in self.graph.node[element_id]:
+            # The node may already exist without annotations if it was
+            # named as the parent or child of an earlier element
             self.graph.node[element_id]['Ranges'] = []
-            self.graph.node[element_id]['attributes'] = []
+            self.graph.node[element_id]['attribute_rows'] = []
         # Add/update parameters in graph
         self.graph.node[element_id]['seqid'] = seqid
         self.graph.node[element_id]['Ranges'].append(element_range)
-        self.graph.node[element_id]['attributes'].append(attr)
+        self.graph.node[element_id]['attribute_rows'].append(self.attribute_store.add_row(attr))
+        self.attribute_row_ids.append(element_id)
         self.graph.node[element_id]['type'] = element_type
         self.graph.node[element_id]['strand'] = strand
         # Make edges if necessary
@@ -74,6 +155,106 @@ class genomeAnnotationGraph(object):
             self.graph.add_edge(parent, element_id)
         for child in children:
             self.graph.add_edge(element_id, child)
+    def add_annotations(self, element_ids, seqids, starts, ends, element_types,
+                        strands = None, parents = None, attributes = None):
+        """ Adds many annotations at once, given as columns
+
+        All elements are added before any parent edges, so parents can appear
+        anywhere in the columns. The columns are appended a coordinate system
+        at a time, and the nodes, attribute rows and edges are each added in
+        one pass
+
+        Parameters
+        ----------
+        element_ids : list of hashables
+            The ids of the elements
+        seqids : list of hashables
+            The names of the coordinate systems of the elements
+        starts : list of ints
+            The starts of the elements (inclusive)
+        ends : list of ints
+            The ends of the elements (inclusive)
+        element_types : list of str
+            The types of the elements
+        strands : list of str, optional
+            The strands of the elements ('+','-','?'). Defaults to '?'
+        parents : list of iterables of strings, optional
+            The parent element_ids of each element
+        attributes : list of dicts, optional
+            Further attributes of each element
+        """
+        n = len(element_ids)
+        if strands is None:
+            strands = ['?']*n
+        ranges = [Range.closed(starts[i], ends[i]) for i in xrange(n)]
+        # Group the rows by coordinate system, keeping their order within each
+        groups = {}
+        for i, seqid in enumerate(seqids):
+            if seqid not in groups:
+                groups[seqid] = []
+            groups[seqid].append(i)
+        for seqid, rows in groups.items():
+            if seqid not in self.bucketmaps:
+                self.bucketmaps[seqid] = RangeBucketMap()
+                self._interval_rows[seqid] = ([], [], [])
+            seq_starts, seq_ends, seq_ids = self._interval_rows[seqid]
+            seq_starts.extend(starts[i] for i in rows)
+            seq_ends.extend(ends[i] for i in rows)
+            seq_ids.extend(element_ids[i] for i in rows)
+            self._interval_indexes.pop(seqid, None)
+            self._interval_types.pop(seqid, None)
+            self._cds_tables.pop(seqid, None)
+            bucketmap = self.bucketmaps[seqid]
+            for i in rows:
+                bucketmap.put(ranges[i], element_ids[i])
+        attribute_rows = self.attribute_store.add_rows(attributes if attributes is not None \
+                                                       else [{}]*n).tolist()
+        self.attribute_row_ids.extend(element_ids)
+        # Gather each element's Ranges, so that repeated ids touch their node once
+        node_data = {}
+        for i in xrange(n):
+            element_id = element_ids[i]
+            if element_id not in node_data:
+                node_data[element_id] = {'Ranges': [], 'attribute_rows': []}
+            data = node_data[element_id]
+            data['Ranges'].append(ranges[i])
+            data['attribute_rows'].append(attribute_rows[i])
+            data['seqid'] = seqids[i]
+            data['type'] = element_types[i]
+            data['strand'] = strands[i]
+        new_nodes = []
+        for element_id, data in node_data.items():
+            if element_id in self.graph and 'Ranges' in self.graph.node[element_id]:
+                node = self.graph.node[element_id]
+                node['Ranges'].extend(data.pop('Ranges'))
+                node['attribute_rows'].extend(data.pop('attribute_rows'))
+                node.update(data)
+            else:
+                # The node may already exist without annotations if it was
+                # named as the parent or child of an earlier element
+                new_nodes.append((element_id, data))
+        self.graph.add_nodes_from(new_nodes)
+        if parents is not None:
+            self.graph.add_edges_from((parent, element_id) for element_id, element_parents \
+                                      in zip(element_ids, parents) for parent in element_parents)
+    def _ensure_seqid(self, seqid):
+        """ Hook called before a coordinate system is queried, so that subclasses
+        can load its annotations on demand. Does nothing by default
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system
+        """
+        pass
+    def get_seqids(self):
+        """ Gets the names of the coordinate systems in the genome
+
+        Returns
+        -------
+        Set of seqids
+        """
+        return set(self.bucketmaps)
     def get_aa_indices(self, seqid, pos, cds_type = 'CDS'):
         """ Gets the indices (base-1) of the amino acid position in any
         CDS overlapping it
@@ -161,6 +342,163 @@ class genomeAnnotationGraph(object):
         for k,v in cds_inds.items():
             return_dict[k] = ((v-1) % 3)+1
         return return_dict        
+    def _get_cds_table(self, seqid, cds_type='CDS'):
+        """ Gets the exon table of the stranded CDS on a coordinate system,
+        building it on first use
+
+        The segments (Ranges) of each CDS are laid out in transcript order, one
+        CDS after another, so that a position within any CDS maps to a single
+        coordinate in the concatenation of all the CDS sequences
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system
+        cds_type : str, optional
+            The element type containing the CDS ranges
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present
+
+        Returns
+        -------
+        Dictionary with 'cds_ids', 'cds_strands' (1 or -1), 'cds_lengths' and
+        'cds_offsets' (coordinate of the first CDS base) arrays per CDS,
+        'seg_starts', 'seg_ends', 'seg_cds' (index of the CDS) and 'seg_offsets'
+        (coordinate of the first base in transcript order) arrays per segment,
+        and 'index', an IntervalIndex of the segments whose ids are segment indices
+        """
+        index = self.get_interval_index(seqid, cds_type)
+        tables = self._cds_tables.setdefault(seqid, {})
+        if cds_type not in tables:
+            cds_ids, cds_strands = [], []
+            seg_starts, seg_ends, seg_cds = [], [], []
+            seen = set()
+            for cds_id in index.ids:
+                if cds_id in seen: continue
+                seen.add(cds_id)
+                strand = self.graph.node[cds_id]['strand']
+                # Only stranded CDS can be read
+                if strand not in ('+', '-'): continue
+                for cds_range in sorted(self.graph.node[cds_id]['Ranges'],
+                                        key = lambda x: x.lowerEndpoint(),
+                                        reverse = (strand == '-')):
+                    seg_starts.append(cds_range.lowerEndpoint())
+                    seg_ends.append(cds_range.upperEndpoint())
+                    seg_cds.append(len(cds_ids))
+                cds_ids.append(cds_id)
+                cds_strands.append(1 if strand == '+' else -1)
+            seg_starts = np.array(seg_starts, dtype=np.int64)
+            seg_ends = np.array(seg_ends, dtype=np.int64)
+            seg_cds = np.array(seg_cds, dtype=np.int64)
+            seg_lengths = seg_ends - seg_starts + 1
+            cds_lengths = np.bincount(seg_cds, weights=seg_lengths,
+                                      minlength=len(cds_ids)).astype(np.int64)
+            cds_id_arr = np.empty(len(cds_ids), dtype=object)
+            cds_id_arr[:] = cds_ids
+            tables[cds_type] = {'cds_ids': cds_id_arr,
+                                'cds_strands': np.array(cds_strands, dtype=np.int64),
+                                'cds_lengths': cds_lengths,
+                                'cds_offsets': np.cumsum(cds_lengths) - cds_lengths,
+                                'seg_starts': seg_starts,
+                                'seg_ends': seg_ends,
+                                'seg_cds': seg_cds,
+                                'seg_offsets': np.cumsum(seg_lengths) - seg_lengths,
+                                'index': IntervalIndex(seg_starts, seg_ends)}
+        return tables[cds_type]
+    def predict_coding_consequences(self, seqid, positions, ref_alleles, alt_alleles,
+                                    fasta, cds_type='CDS'):
+        """ Predicts the effect of many single-base substitutions on the
+        proteins of every CDS they fall in
+
+        Codons are resolved through the CDS exon table and fetched from the
+        sequence in one gather, so the work is a handful of array operations
+        regardless of the number of variants
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system of the variants
+        positions : array-like of ints
+            The positions of the variants (1-based)
+        ref_alleles : array-like of str
+            The reference allele of each variant, on the + strand
+        alt_alleles : array-like of str
+            The alternate allele of each variant, on the + strand
+        fasta : genomfart.parsers.fasta.fasta_parser
+            The genome sequence
+        cds_type : str, optional
+            The element type containing the CDS ranges
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present in the annotations or the sequence
+
+        Returns
+        -------
+        (np.ndarray of variant indices, np.ndarray of CDS ids, np.ndarray of
+        consequence codes), with one entry per variant and overlapping CDS.
+        Variants outside of every CDS are left out. The codes are the module's
+        CONSEQUENCE_* constants, named in CONSEQUENCE_NAMES
+
+        Examples
+        --------
+
+        >>> variant_inds, cds_ids, codes = my_genome.predict_coding_consequences('10',
+        ...                                 snp_positions, refs, alts, fasta_parser(fasta_file))
+        >>> nonsense_ids = set(cds_ids[codes == CONSEQUENCE_NONSENSE])
+        """
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        ref_alleles = np.char.upper(np.atleast_1d(np.asarray(ref_alleles)).astype(str))
+        alt_alleles = np.char.upper(np.atleast_1d(np.asarray(alt_alleles)).astype(str))
+        table = self._get_cds_table(seqid, cds_type)
+        variant_inds, segs = table['index'].overlapping_pairs(positions, positions)
+        segs = table['index'].ids[segs]
+        cds = table['seg_cds'][segs]
+        minus = table['cds_strands'][cds] < 0
+        cds_lengths = table['cds_lengths'][cds]
+        pos = positions[variant_inds]
+        # 0-based position within the CDS, in transcript order
+        cds_pos = table['seg_offsets'][segs] - table['cds_offsets'][cds] + \
+          np.where(minus, table['seg_ends'][segs] - pos, pos - table['seg_starts'][segs])
+        codon_pos = cds_pos % 3
+        codon_cds_pos = (cds_pos - codon_pos)[:,None] + np.arange(3)
+        complete = codon_cds_pos[:,2] < cds_lengths
+        # Map the codon bases back to the genome, which may cross segments
+        coords = table['cds_offsets'][cds][:,None] + \
+          np.minimum(codon_cds_pos, (cds_lengths - 1)[:,None])
+        codon_segs = np.searchsorted(table['seg_offsets'], coords, 'right') - 1
+        within = coords - table['seg_offsets'][codon_segs]
+        codon_genome_pos = np.where(minus[:,None], table['seg_ends'][codon_segs] - within,
+                                    table['seg_starts'][codon_segs] + within)
+        ref_codons = _BASE_CODES[fasta.get_bases(seqid, codon_genome_pos.ravel())]
+        ref_codons = ref_codons.reshape(-1, 3)
+        ref_codons = np.where(minus[:,None] & (ref_codons < 4), 3 - ref_codons, ref_codons)
+        # Alleles, as base codes on the transcript strand
+        is_snv = (np.char.str_len(ref_alleles) == 1) & (np.char.str_len(alt_alleles) == 1)
+        var_ref = _BASE_CODES[ref_alleles.astype('S1').view(np.uint8)][variant_inds]
+        var_alt = _BASE_CODES[alt_alleles.astype('S1').view(np.uint8)][variant_inds]
+        var_ref = np.where(minus & (var_ref < 4), 3 - var_ref, var_ref)
+        var_alt = np.where(minus & (var_alt < 4), 3 - var_alt, var_alt)
+        rows = np.arange(len(variant_inds))
+        alt_codons = ref_codons.copy()
+        alt_codons[rows, codon_pos] = var_alt
+        readable = is_snv[variant_inds] & complete & (var_ref < 4) & (var_alt < 4) & \
+          (ref_codons < 4).all(axis=1)
+        weights = np.array([16, 4, 1])
+        ref_aas = _CODON_TABLE[np.where(readable, (ref_codons*weights).sum(axis=1), 0)]
+        alt_aas = _CODON_TABLE[np.where(readable, (alt_codons*weights).sum(axis=1), 0)]
+        stop = ord('*')
+        codes = np.full(len(variant_inds), CONSEQUENCE_MISSENSE, dtype=np.int8)
+        codes[ref_aas == alt_aas] = CONSEQUENCE_SYNONYMOUS
+        codes[(alt_aas == stop) & (ref_aas != stop)] = CONSEQUENCE_NONSENSE
+        codes[(ref_aas == stop) & (alt_aas != stop)] = CONSEQUENCE_STOP_LOST
+        codes[readable & (ref_codons[rows, codon_pos] != var_ref)] = CONSEQUENCE_REF_MISMATCH
+        codes[~readable] = CONSEQUENCE_UNKNOWN
+        return variant_inds, table['cds_ids'][cds], codes
     def add_node_annotations(self, element_id, **annots):
         """ Adds annotations to all annotation dictionaries under a node.
         Note that if the key for an annotation is the same as a previously
@@ -178,8 +516,53 @@ class genomeAnnotationGraph(object):
 
         >>> my_genome.add_node_annotations('myNode1', expression1 = 0.2, expression2 = 10.)
         """
-        for attr_dict in self.graph.node[element_id]['attributes']:
-            attr_dict.update(annots)
+        for row in self.graph.node[element_id]['attribute_rows']:
+            for k,v in annots.items():
+                self.attribute_store.set(row, k, v)
+    def get_element_ids_with_attribute(self, key, value = None):
+        """ Gets the ids of elements having an attribute, optionally with a
+        given value
+
+        Parameters
+        ----------
+        key : str
+            The attribute key (e.g. 'biotype')
+        value : hashable, optional
+            The value the attribute must have. If None, any value matches
+
+        Returns
+        -------
+        Set of element ids
+
+        Examples
+        --------
+
+        >>> my_genome.get_element_ids_with_attribute('biotype', 'protein_coding')
+        """
+        rows = self.attribute_store.find_rows(key, value)
+        return set(self._get_attribute_row_ids()[rows])
+    def get_attribute_column(self, key):
+        """ Gets every value of an attribute along with the elements holding it
+
+        Parameters
+        ----------
+        key : str
+            The attribute key (e.g. 'Name')
+
+        Returns
+        -------
+        (object np.ndarray of element ids, object np.ndarray of values). Elements
+        with more than one Range can appear more than once
+        """
+        rows, values = self.attribute_store.get_column(key)
+        return self._get_attribute_row_ids()[rows], values
+    def _get_attribute_row_ids(self):
+        """ Gets the element id of each attribute row as an object array
+        """
+        if len(self._attribute_row_ids_array) != len(self.attribute_row_ids):
+            self._attribute_row_ids_array = np.empty(len(self.attribute_row_ids), dtype=object)
+            self._attribute_row_ids_array[:] = self.attribute_row_ids
+        return self._attribute_row_ids_array
     def get_overlapping_element_ids(self, seqid, start, end):
         """ Gets the ids for any elements that overlap a given range
 
@@ -201,6 +584,7 @@ class genomeAnnotationGraph(object):
         -------
         Set of ids for elements overlapping the range
         """
+        self._ensure_seqid(seqid)
         if seqid not in self.bucketmaps:
             raise KeyError("%s not present" % seqid)
         checkRange = Range.closed(start, end)
@@ -233,8 +617,8 @@ class genomeAnnotationGraph(object):
         Set of ids for elements overlapping the range that are of the
         element type
         """
-        all_overlaps = self.get_overlapping_element_ids(seqid, start, end)
-        return set([x for x in all_overlaps if self.graph.node[x]['type'] == element_type])
+        index = self.get_interval_index(seqid, element_type)
+        return set(index.ids[index.overlapping(start, end)])
     def get_element_info(self, element_id):
         """ Gets information on a particular element
 
@@ -252,7 +636,8 @@ class genomeAnnotationGraph(object):
                 'strand':self.graph.node[element_id]['strand'],
                 'seqid':self.graph.node[element_id]['seqid'],
                 'Ranges':self.graph.node[element_id]['Ranges'],
-                'attributes':self.graph.node[element_id]['attributes']}
+                'attributes':[self.attribute_store.get_row(row) for row in \
+                              self.graph.node[element_id]['attribute_rows']]}
     def get_element_ids_of_type(self, seqid, element_type, start = None, end = None):
         """ Gets element ids of some type along a coordinate system
 
@@ -276,15 +661,58 @@ class genomeAnnotationGraph(object):
         -------
         Generator of element_ids
         """
+        index = self.get_interval_index(seqid, element_type)
+        if len(index) == 0:
+            return
+        if start is None:
+            start = index.starts[0]
+        if end is None:
+            end = index.sorted_ends[-1]
         added = set()
-        iterator = self.bucketmaps[seqid].iteritems(start=start,end=end)
-        for theRange, element_id in iterator:
+        for element_id in index.ids[index.overlapping(start, end)]:
             if element_id in added:
                 continue
-            elif self.graph.node[element_id]['type'] == element_type:
-                yield element_id
-                added.add(element_id)
-    def get_closest_element_id(self, seqid, rangeStart, rangeEnd, radius = 10000):
+            yield element_id
+            added.add(element_id)
+    def get_interval_index(self, seqid, element_type=None):
+        """ Gets the sorted-array interval index for a coordinate system,
+        building it on first use
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system
+        element_type : str, optional
+            If given, only elements of this type (e.g. 'gene') are indexed
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present
+
+        Returns
+        -------
+        genomfart.utils.interval_index.IntervalIndex whose ids are element ids.
+        Elements with more than one Range appear once per Range
+        """
+        self._ensure_seqid(seqid)
+        if seqid not in self.bucketmaps:
+            raise KeyError("%s not present" % seqid)
+        if seqid not in self._interval_indexes:
+            starts, ends, element_ids = self._interval_rows[seqid]
+            index = IntervalIndex(starts, ends, element_ids)
+            self._interval_indexes[seqid] = {None: index}
+            self._interval_types[seqid] = np.array([self.graph.node[x]['type'] for \
+                                                    x in index.ids], dtype=object)
+        type_indexes = self._interval_indexes[seqid]
+        if element_type not in type_indexes:
+            all_index = type_indexes[None]
+            keep = self._interval_types[seqid] == element_type
+            type_indexes[element_type] = IntervalIndex(all_index.starts[keep],
+                                                       all_index.ends[keep],
+                                                       all_index.ids[keep])
+        return type_indexes[element_type]
+    def get_closest_element_id(self, seqid, rangeStart, rangeEnd, radius = None):
         """ Gets the element id(s) of the whatever element is closest to a range
 
         Parameters
@@ -297,9 +725,14 @@ class genomeAnnotationGraph(object):
         rangeEnd : int
             The position (inclusive) ending the range for which you want
             the closest element
-        radius : int
+        radius : int, optional
             How far on either side of the search range you want to search
-            for the closest element
+            for the closest element. If None, the search is unbounded
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present
 
         Returns
         -------
@@ -308,89 +741,12 @@ class genomeAnnotationGraph(object):
         shortest distance to the search range (only more than 1 if some elements
         are equidistant)
         """
-        checkRange = Range.closed(rangeStart, rangeEnd)
-        # Go through items overlapping the Range
-        iterator = self.bucketmaps[seqid].iteritems(start=(rangeStart-radius),
-                                                    end=(rangeEnd+radius))
-        # Store the distance and element id of closest element that is not
-        # overlapping the search range and is to the left of the search range
-        less_than_closest_dist = radius
-        less_than_closest_element = set()
-        # Store the distance and element id of the closest element that is
-        # not overlapping the search range and is to the right of the search range
-        greater_than_closest_dist = radius
-        greater_than_closest_element = set()
-        # Store any overlapping elements
-        overlapping = set()
-        for theRange, element_id in iterator:
-            # Close the Range if necessary
-            if not all((theRange.isLowerBoundClosed(), theRange.isUpperBoundClosed())):
-                newLowerBd = theRange.lowerEndpoint() if theRange.isLowerBoundClosed() else \
-                  (theRange.lowerEndpoint()+1)
-                newUpperBd = theRange.upperEndpoint() if theRange.isUpperBoundClosed() else \
-                  (theRange.upperEndpoint()-1)
-                theRange = Range.closed(newLowerBd, newUpperBd)
-            if checkRange.isConnected(theRange):
-                # Add element to overlapping set if overlapping
-                overlapping.add(element_id)
-            elif theRange.lowerEndpoint() < checkRange.lowerEndpoint():
-                # If the element is to the left of the search range
-                range_dist = checkRange.getDistanceFromRange(theRange)
-                if range_dist < less_than_closest_dist:
-                    # Add the element to the less than set after clearing current
-                    # contents 
-                    less_than_closest_element.clear()
-                    less_than_closest_element.add(element_id)
-                    less_than_closest_dist = range_dist
-                elif range_dist == less_than_closest_dist:
-                    # Add the element to the current set
-                    less_than_closest_element.add(element_id)
-            elif theRange.lowerEndpoint() > checkRange.upperEndpoint():
-                # If the element is to the right of the search range
-                if len(overlapping) > 0:
-                    # Return the overlapping set if there are any overlapping elements
-                    return overlapping
-                range_dist = checkRange.getDistanceFromRange(theRange)
-                if range_dist > less_than_closest_dist:
-                    # Return the closest elements if the current range distance is
-                    # greater than the left distances
-                    if less_than_closest_dist < greater_than_closest_dist:
-                        return less_than_closest_element
-                    elif greater_than_closest_dist < less_than_closest_dist:
-                        return greater_than_closest_element
-                    else:
-                        return less_than_closest_element.union(greater_than_closest_element)
-                elif range_dist < greater_than_closest_dist:
-                    # Add the element to the greater than set after clearing
-                    # current contents
-                    greater_than_closest_element.clear()
-                    greater_than_closest_element.add(element_id)
-                    greater_than_closest_dist = range_dist
-                elif range_dist == greater_than_closest_dist:
-                    # Add the element to the current set
-                    greater_than_closest_element.add(element_id)
-                elif range_dist > greater_than_closest_dist:
-                    # Return the closest elements if the current range distance
-                    # is greater than the minimum right distance
-                    if less_than_closest_dist < greater_than_closest_dist:
-                        return less_than_closest_element
-                    elif greater_than_closest_dist < less_than_closest_dist:
-                        return greater_than_closest_element
-                    else:
-                        return less_than_closest_element.union(greater_than_closest_element)
-        # Return the closest if finished going through all elements
-        if len(overlapping) > 0:
-            return overlapping
-        elif less_than_closest_dist < greater_than_closest_dist:
-            return less_than_closest_element
-        elif greater_than_closest_dist < less_than_closest_dist:
-            return greater_than_closest_element
-        elif less_than_closest_dist == greater_than_closest_dist:
-            return less_than_closest_element.union(greater_than_closest_element)
-
+        index = self.get_interval_index(seqid)
+        return set(index.ids[index.nearest(rangeStart, rangeEnd, radius)])
     def get_closest_element_id_of_type(self, seqid, rangeStart, rangeEnd, element_type,
-                                       radius = 10000):
-        """ Gets the element id(s) of the whatever element is closest to a range
+                                       radius = None):
+        """ Gets the element id(s) of the whatever element of a given type
+        is closest to a range
 
         Parameters
         ----------
@@ -402,11 +758,16 @@ class genomeAnnotationGraph(object):
         rangeEnd : int
             The position (inclusive) ending the range for which you want
             the closest element
-        radius : int
-            How far on either side of the search range you want to search
-            for the closest element
         element_type : str
             The type of the elements you want (e.g. 'gene' or 'mRNA')
+        radius : int, optional
+            How far on either side of the search range you want to search
+            for the closest element. If None, the search is unbounded
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present
 
         Returns
         -------
@@ -415,87 +776,330 @@ class genomeAnnotationGraph(object):
         shortest distance to the search range (only more than 1 if some elements
         are equidistant)
         """
-        checkRange = Range.closed(rangeStart, rangeEnd)
-        # Go through items overlapping the Range
-        iterator = self.bucketmaps[seqid].iteritems(start=(rangeStart-radius),
-                                                    end=(rangeEnd+radius))
-        # Store the distance and element id of closest element that is not
-        # overlapping the search range and is to the left of the search range
-        less_than_closest_dist = radius
-        less_than_closest_element = set()
-        # Store the distance and element id of the closest element that is
-        # not overlapping the search range and is to the right of the search range
-        greater_than_closest_dist = radius
-        greater_than_closest_element = set()
-        # Store any overlapping elements
-        overlapping = set()
-        for theRange, element_id in iterator:
-            # Skip if element_id not of the right type
-            if self.graph.node[element_id]['type'] != element_type: continue
-            # Close the Range if necessary
-            if not all((theRange.isLowerBoundClosed(), theRange.isUpperBoundClosed())):
-                newLowerBd = theRange.lowerEndpoint() if theRange.isLowerBoundClosed() else \
-                  (theRange.lowerEndpoint()+1)
-                newUpperBd = theRange.upperEndpoint() if theRange.isUpperBoundClosed() else \
-                  (theRange.upperEndpoint()-1)
-                theRange = Range.closed(newLowerBd, newUpperBd)
-            if checkRange.isConnected(theRange):
-                # Add element to overlapping set if overlapping
-                overlapping.add(element_id)
-            elif theRange.lowerEndpoint() < checkRange.lowerEndpoint():
-                # If the element is to the left of the search range
-                range_dist = checkRange.getDistanceFromRange(theRange)
-                if range_dist < less_than_closest_dist:
-                    # Add the element to the less than set after clearing current
-                    # contents 
-                    less_than_closest_element.clear()
-                    less_than_closest_element.add(element_id)
-                    less_than_closest_dist = range_dist
-                elif range_dist == less_than_closest_dist:
-                    # Add the element to the current set
-                    less_than_closest_element.add(element_id)
-            elif theRange.lowerEndpoint() > checkRange.upperEndpoint():
-                # If the element is to the right of the search range
-                if len(overlapping) > 0:
-                    # Return the overlapping set if there are any overlapping elements
-                    return overlapping
-                range_dist = checkRange.getDistanceFromRange(theRange)
-                if range_dist > less_than_closest_dist:
-                    # Return the closest elements if the current range distance is
-                    # greater than the left distances
-                    if less_than_closest_dist < greater_than_closest_dist:
-                        return less_than_closest_element
-                    elif greater_than_closest_dist < less_than_closest_dist:
-                        return greater_than_closest_element
-                    else:
-                        return less_than_closest_element.union(greater_than_closest_element)
-                elif range_dist < greater_than_closest_dist:
-                    # Add the element to the greater than set after clearing
-                    # current contents
-                    greater_than_closest_element.clear()
-                    greater_than_closest_element.add(element_id)
-                    greater_than_closest_dist = range_dist
-                elif range_dist == greater_than_closest_dist:
-                    # Add the element to the current set
-                    greater_than_closest_element.add(element_id)
-                elif range_dist > greater_than_closest_dist:
-                    # Return the closest elements if the current range distance
-                    # is greater than the minimum right distance
-                    if less_than_closest_dist < greater_than_closest_dist:
-                        return less_than_closest_element
-                    elif greater_than_closest_dist < less_than_closest_dist:
-                        return greater_than_closest_element
-                    else:
-                        return less_than_closest_element.union(greater_than_closest_element)
-        # Return the closest if finished going through all elements
-        if len(overlapping) > 0:
-            return overlapping
-        elif less_than_closest_dist < greater_than_closest_dist:
-            return less_than_closest_element
-        elif greater_than_closest_dist < less_than_closest_dist:
-            return greater_than_closest_element
-        elif less_than_closest_dist == greater_than_closest_dist:
-            return less_than_closest_element.union(greater_than_closest_element)                    
+        index = self.get_interval_index(seqid, element_type)
+        return set(index.ids[index.nearest(rangeStart, rangeEnd, radius)])
+    def get_closest_element_id_sets(self, seqid, rangeStarts, rangeEnds,
+                                    element_type = None, radius = None):
+        """ Gets the closest element id(s) for each of a set of ranges
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system to check
+        rangeStarts : array-like of ints
+            The positions (inclusive) beginning the query ranges
+        rangeEnds : array-like of ints
+            The positions (inclusive) ending the query ranges
+        element_type : str, optional
+            The type of the elements you want (e.g. 'gene' or 'mRNA'). If None,
+            elements of all types are considered
+        radius : int, optional
+            How far on either side of each range you want to search for the
+            closest element. If None, the search is unbounded
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present
+
+        Returns
+        -------
+        List of sets, one per query range, as returned by get_closest_element_id
+        """
+        index = self.get_interval_index(seqid, element_type)
+        n = len(rangeStarts)
+        queries, inds, dists = index.nearest_pairs(rangeStarts, rangeEnds, radius)
+        ids = index.ids[inds]
+        bounds = np.searchsorted(queries, np.arange(n+1))
+        return [set(ids[bounds[i]:bounds[i+1]]) for i in xrange(n)]
+    def get_closest_element_distances(self, seqid, rangeStarts, rangeEnds,
+                                      element_type = None):
+        """ Gets the distance from each of a set of ranges to the closest element
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system to check
+        rangeStarts : array-like of ints
+            The positions (inclusive) beginning the query ranges
+        rangeEnds : array-like of ints
+            The positions (inclusive) ending the query ranges
+        element_type : str, optional
+            The type of the elements you want (e.g. 'gene' or 'mRNA'). If None,
+            elements of all types are considered
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present
+
+        Returns
+        -------
+        np.ndarray of distances, 0 where a range overlaps an element and -1 if
+        there are no elements to compare against
+
+        Examples
+        --------
+
+        >>> dists = my_genome.get_closest_element_distances('10', snp_positions,
+        ...                                                 snp_positions, 'gene')
+        """
+        return self.get_interval_index(seqid, element_type).nearest_distances(rangeStarts,
+                                                                              rangeEnds)
+    def get_window_summaries(self, seqid, window_size, step = None, element_type = None,
+                             seq_length = None):
+        """ Summarizes the elements in sliding windows along a coordinate system
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system
+        window_size : int
+            The length of each window
+        step : int, optional
+            The distance between the starts of consecutive windows. Defaults to
+            window_size (non-overlapping windows)
+        element_type : str, optional
+            The type of the elements you want (e.g. 'gene'). If None, elements
+            of all types are summarized
+        seq_length : int, optional
+            The length of the coordinate system. Defaults to the end of the last
+            element of any type
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present
+        ValueError
+            If window_size or step is not positive
+
+        Returns
+        -------
+        (window starts, window ends, element counts, covered bases), each an
+        np.ndarray with one entry per window. Windows start at 1 and the last
+        is truncated at seq_length. Elements with more than one Range are
+        counted once per overlapping Range
+
+        Examples
+        --------
+
+        >>> starts, ends, counts, covered = my_genome.get_window_summaries('10', 1000000,
+        ...                                                               element_type='gene')
+        """
+        if step is None:
+            step = window_size
+        if window_size < 1 or step < 1:
+            raise ValueError("window_size and step must be positive")
+        index = self.get_interval_index(seqid, element_type)
+        if seq_length is None:
+            all_ends = self.get_interval_index(seqid).ends
+            seq_length = int(all_ends.max()) if len(all_ends) else 0
+        window_starts = np.arange(1, seq_length+1, step, dtype=np.int64)
+        window_ends = np.minimum(window_starts + window_size - 1, seq_length)
+        return (window_starts, window_ends,
+                index.count_overlapping(window_starts, window_ends),
+                index.covered_bases(window_starts, window_ends))
+    def _get_join_indexes(self, seqid, other, element_type, other_type):
+        """ Gets the interval indexes of this graph and of the other side of a
+        spatial join, which may be a genomeAnnotationGraph or an IntervalIndex.
+        A graph without the seqid gives an empty index
+        """
+        index = self.get_interval_index(seqid, element_type)
+        if isinstance(other, IntervalIndex):
+            return index, other
+        try:
+            return index, other.get_interval_index(seqid, other_type)
+        except KeyError:
+            return index, IntervalIndex([], [])
+    def intersect_elements(self, seqid, other, element_type = None, other_type = None):
+        """ Gets every pair of overlapping elements between this graph and
+        another set of intervals
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system
+        other : genomeAnnotationGraph or genomfart.utils.interval_index.IntervalIndex
+            The intervals to join against, e.g. another annotation release or a
+            set of peaks
+        element_type : str, optional
+            The type of the elements of this graph to join. If None, all types
+        other_type : str, optional
+            The type of the elements of other to join, if it is a graph. If
+            None, all types
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present in this graph
+
+        Returns
+        -------
+        (array of positions in this graph's index, array of positions in other's
+        index), as returned by IntervalIndex.intersect. The element ids are
+        get_interval_index(seqid, element_type).ids at those positions
+
+        Examples
+        --------
+
+        >>> inds, other_inds = my_genome.intersect_elements('10', new_genome, 'gene', 'gene')
+        >>> pairs = zip(my_genome.get_interval_index('10', 'gene').ids[inds],
+        ...             new_genome.get_interval_index('10', 'gene').ids[other_inds])
+        """
+        index, other_index = self._get_join_indexes(seqid, other, element_type, other_type)
+        return index.intersect(other_index)
+    def subtract_elements(self, seqid, other, element_type = None, other_type = None):
+        """ Gets the parts of the elements of this graph not covered by another
+        set of intervals
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system
+        other : genomeAnnotationGraph or genomfart.utils.interval_index.IntervalIndex
+            The intervals to remove
+        element_type : str, optional
+            The type of the elements of this graph. If None, all types
+        other_type : str, optional
+            The type of the elements of other to remove, if it is a graph. If
+            None, all types
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present in this graph
+
+        Returns
+        -------
+        (array of starts, array of ends, array of positions in this graph's
+        index) of the remaining pieces, as returned by IntervalIndex.subtract
+        """
+        index, other_index = self._get_join_indexes(seqid, other, element_type, other_type)
+        return index.subtract(other_index)
+    def closest_elements(self, seqid, other, element_type = None, other_type = None):
+        """ Finds the closest interval(s) of another set for every element of
+        this graph
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system
+        other : genomeAnnotationGraph or genomfart.utils.interval_index.IntervalIndex
+            The intervals to search
+        element_type : str, optional
+            The type of the elements of this graph. If None, all types
+        other_type : str, optional
+            The type of the elements of other to search, if it is a graph. If
+            None, all types
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present in this graph
+
+        Returns
+        -------
+        (array of positions in this graph's index, array of positions in other's
+        index, array of distances), as returned by IntervalIndex.closest
+        """
+        index, other_index = self._get_join_indexes(seqid, other, element_type, other_type)
+        return index.closest(other_index)
+    def merge_elements(self, seqid, other, element_type = None, other_type = None):
+        """ Merges the elements of this graph with another set of intervals
+
+        Parameters
+        ----------
+        seqid : str
+            The name of the coordinate system
+        other : genomeAnnotationGraph or genomfart.utils.interval_index.IntervalIndex
+            The intervals to merge with
+        element_type : str, optional
+            The type of the elements of this graph. If None, all types
+        other_type : str, optional
+            The type of the elements of other, if it is a graph. If None, all types
+
+        Raises
+        ------
+        KeyError
+            If the seqid is not present in this graph
+
+        Returns
+        -------
+        (array of starts, array of ends) of the disjoint merged intervals
+        """
+        index, other_index = self._get_join_indexes(seqid, other, element_type, other_type)
+        return index.union(other_index)
+    def iter_site_overlaps(self, sites, element_type = None, site_key = None):
+        """ Joins a coordinate-sorted stream of sites against the annotations
+        in one linear pass
+
+        The sorted annotations and the sites are walked together, keeping only
+        the annotations that can still overlap upcoming sites, so each site
+        costs no index lookup and memory is bounded by the number of
+        overlapping annotations rather than the number of sites
+
+        Parameters
+        ----------
+        sites : iterable
+            Sites sorted by start within each seqid (seqids may come in any
+            order, but each only once), e.g. a VCF_parser generator
+        element_type : str, optional
+            The type of the elements you want (e.g. 'CDS'). If None, elements
+            of all types are joined
+        site_key : callable, optional
+            Function taking a site and returning (seqid, start, end), inclusive.
+            Defaults to reading VCF_parser tuples of (chrom, pos, (ref, alt...), ...),
+            with the site spanning the reference allele
+
+        Raises
+        ------
+        ValueError
+            If the sites are not sorted within a seqid
+
+        Returns
+        -------
+        Generator of (site, set of overlapping element ids). Sites on seqids
+        without annotations get empty sets
+
+        Examples
+        --------
+
+        >>> vcf = VCF_parser(vcf_file)
+        >>> for site, cds_ids in my_genome.iter_site_overlaps(vcf.parse_site_infos(), 'CDS'):
+        ...     pass
+        """
+        if site_key is None:
+            site_key = lambda site: (str(site[0]), site[1], site[1]+len(site[2][0])-1)
+        current_seqid = None
+        seen_seqids = set()
+        for site in sites:
+            seqid, start, end = site_key(site)
+            if seqid != current_seqid:
+                if seqid in seen_seqids:
+                    raise ValueError("Sites on %s are not contiguous" % seqid)
+                seen_seqids.add(seqid)
+                current_seqid = seqid
+                try:
+                    index = self.get_interval_index(seqid, element_type)
+                    starts, ends = index.starts.tolist(), index.ends.tolist()
+                except KeyError:
+                    starts, ends = [], []
+                    index = None
+                next_ind = 0
+                # Heap of (end, index) for annotations starting before the sites
+                active = []
+                last_start = None
+            if last_start is not None and start < last_start:
+                raise ValueError("Sites on %s are not sorted" % seqid)
+            last_start = start
+            # Bring in annotations starting by the end of this site
+            while next_ind < len(starts) and starts[next_ind] <= end:
+                heapq.heappush(active, (ends[next_ind], next_ind))
+                next_ind += 1
+            # Drop annotations ending before this site, which can't overlap later sites
+            while active and active[0][0] < start:
+                heapq.heappop(active)
+            yield site, set(index.ids[i] for annot_end, i in active if starts[i] <= end)
     def get_element_children_ids(self, element_id):
         """ Gets the ids of the children of an element
 
@@ -555,7 +1159,5 @@ class genomeAnnotationGraph(object):
         -------
         True if the range overlaps at least 1 element of the give type, else False
         """
-        for element in self.get_overlapping_element_ids(seqid, start, end):
-            if self.graph.node[element]['type'] == element_type:
-                return True
-        return False
+        index = self.get_interval_index(seqid, element_type)
+        return bool(index.count_overlapping([start], [end])[0] > 0)
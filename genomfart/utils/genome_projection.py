@@ -0,0 +1,213 @@
+from genomfart.utils.snp_projector import snp_projector
+from genomfart.parsers.SNPdata import SNPdata
+from multiprocessing import Pool
+from numpy.lib.format import open_memmap
+import numpy as np
+import sys
+
+if sys.version_info[0] > 2:
+    xrange = range
+
+## Projectors already built by this process, keyed by everything they are
+# built from. Cleared by each call to project_genome
+_projectors = {}
+
+def _get_projector(chrom, chrom_length, map_file, ril_file, use_agp_v2, map_cache_file):
+    """ Gets the projector for a chromosome, building it the first time a
+    process needs it
+    """
+    key = (chrom, chrom_length, map_file, ril_file, use_agp_v2, map_cache_file)
+    if key not in _projectors:
+        _projectors[key] = snp_projector(chrom, chrom_length, map_file, ril_file,
+                                         useAgpV2=use_agp_v2, mapCacheFile=map_cache_file)
+    return _projectors[key]
+
+def _read_samples(ril_file):
+    """ Gets the sample names from the header of a RIL file, which are the
+    columns after the first 5
+    """
+    with open(ril_file) as ril_handle:
+        return ril_handle.readline().rstrip('\n').split('\t')[5:]
+
+def _get_pop_index(projector, pop_index):
+    """ Gets the population index of each sample of a projector
+    """
+    if callable(pop_index):
+        return np.asarray(pop_index(projector.samp_names), dtype=np.int64)
+    return np.asarray(pop_index, dtype=np.int64)
+
+def _quantize(dosages, dtype, scale):
+    """ Converts projected dosages to the output type
+    """
+    if dtype == np.uint8:
+        return np.clip(np.round(dosages*scale), 0, 255).astype(np.uint8)
+    return dosages.astype(dtype)
+
+def _project_chunk(task):
+    """ Projects the founder SNPs of part of a chromosome into rows of the
+    output matrix
+
+    Parameters
+    ----------
+    task : tuple
+        (chromosome, chromosome length, RIL file, founder file, number of SNPs
+        in the founder file, first SNP, last SNP (exclusive), first output row,
+        settings dictionary)
+
+    Returns
+    -------
+    np.ndarray of the positions of the SNPs
+    """
+    chrom, chrom_length, ril_file, founder_file, n_snps, start, end, row, settings = task
+    projector = _get_projector(chrom, chrom_length, settings['map_file'], ril_file,
+                               settings['use_agp_v2'], settings['map_cache_file'])
+    pop_index = _get_pop_index(projector, settings['pop_index'])
+    out = np.load(settings['out_file'], mmap_mode='r+')
+    founder_data = SNPdata(chrom, founder_file, settings['ref_samp'],
+                           totalSNPnumber=n_snps)
+    founder_data.br.close()
+    if settings['binary_prefixes']:
+        founder_data.useBinaryCopy(settings['binary_prefixes'][chrom])
+    positions = np.empty(end-start, dtype=np.int64)
+    if settings['boolean']:
+        project_block, dtype = projector.projectSnpBlockBoolean, np.int64
+    else:
+        project_block, dtype = projector.projectSnpBlockDosage, np.float64
+    block_start = 0
+    for block_positions, alleles, parents in founder_data.iterBlocks(settings['block_size'],
+                                                                     start=start, end=end):
+        block_end = block_start + len(block_positions)
+        positions[block_start:block_end] = block_positions
+        dosages = project_block(parents.astype(dtype), block_positions, pop_index)
+        out[row+block_start:row+block_end] = _quantize(dosages, out.dtype, settings['scale'])
+        block_start = block_end
+    out.flush()
+    return positions
+
+def project_genome(chromosomes, map_file, ref_samp, pop_index, out_file, index_file = None,
+                   dtype = 'float32', scale = 127.5, processes = None, chunk_size = 200000,
+                   block_size = 10000, use_agp_v2 = False, map_cache_file = None,
+                   boolean = True, binary_prefixes = None):
+    """ Projects the founder SNPs of many chromosomes onto descendants in
+    parallel, writing the dosages to a memory-mapped matrix
+
+    Each chromosome is split into chunks of SNPs that are projected by a pool
+    of worker processes, each of which writes its rows of the output directly.
+    Rows follow the order of the chromosomes, then the order of the SNPs in the
+    founder files
+
+    Parameters
+    ----------
+    chromosomes : list of tuples
+        (chromosome, chromosome length, RIL file, founder file) for each
+        chromosome. The RIL files must have the same samples in the same order
+    map_file : str
+        The filename for the map
+    ref_samp : str
+        The name of the reference sample in the founder files
+    pop_index : array-like of ints, or function
+        Index of the population of each sample, or a function giving it from
+        the list of sample names. A function must be picklable, i.e. defined at
+        the top level of a module, if more than one process is used
+    out_file : str
+        The .npy file to write the (SNPs x samples) matrix to. It can be read
+        back with np.load(out_file, mmap_mode='r')
+    index_file : str, optional
+        The .npz file to write the index to. Defaults to out_file with the
+        extension .index.npz. It holds the arrays 'chromosomes' and 'positions'
+        for the rows, 'samples' for the columns, and 'scale'
+    dtype : str, optional
+        'float32', or 'uint8' to store round(dosage*scale)
+    scale : float, optional
+        The multiplier used for uint8 output. The default fits dosages of 0 to 2
+    processes : int, optional
+        The number of worker processes. Defaults to the number of CPUs. If 1,
+        everything is done in this process
+    chunk_size : int, optional
+        The number of SNPs in each task
+    block_size : int, optional
+        The number of SNPs projected together within a task, which bounds the
+        memory used by each worker
+    use_agp_v2 : boolean, optional
+        Whether this is version 2 of the AGPmap format
+    map_cache_file : str, optional
+        An .npz file caching the parsed map (see AGPMap), so that workers don't
+        each parse the map file
+    boolean : boolean, optional
+        Whether the founders have boolean values for SNPs. If not, they are
+        projected as real values (see snp_projector.projectSnpBlockDosage)
+    binary_prefixes : dict, optional
+        Dictionary of chromosome -> prefix of a binary copy of its founder file
+        (see SNPdata.useBinaryCopy). The copies are written before projecting
+        if they are missing or out of date
+
+    Raises
+    ------
+    ValueError
+        If no chromosomes are given, dtype isn't 'float32' or 'uint8', or the
+        RIL files don't all have the same samples in the same order
+
+    Returns
+    -------
+    (the output matrix opened read-only, the positions of its rows)
+
+    Examples
+    --------
+    >>> from genomfart.utils.genome_projection import project_genome
+    >>> chromosomes = [(chrom, chrom_lengths[chrom], ril_files[chrom], founder_files[chrom])
+    ...                for chrom in range(1, 11)]
+    >>> dosages, positions = project_genome(chromosomes, map_file, 'B73', pop_index,
+    ...                                     'nam_projection.npy', dtype='uint8')
+    """
+    if not chromosomes:
+        raise ValueError("No chromosomes to project")
+    dtype = np.dtype(dtype)
+    if dtype not in (np.dtype(np.float32), np.dtype(np.uint8)):
+        raise ValueError("dtype must be 'float32' or 'uint8'")
+    # The samples are the columns of the RIL files, which must agree
+    samples = _read_samples(chromosomes[0][2])
+    for chrom, chrom_length, ril_file, founder_file in chromosomes[1:]:
+        if _read_samples(ril_file) != samples:
+            raise ValueError("The samples in %s don't match those in %s" %
+                             (ril_file, chromosomes[0][2]))
+    if index_file is None:
+        index_file = (out_file[:-4] if out_file.endswith('.npy') else out_file) + '.index.npz'
+    # The files may have changed since the projectors were built, and workers
+    # forked from this process start with the cleared cache
+    _projectors.clear()
+    settings = {'map_file': map_file, 'use_agp_v2': use_agp_v2,
+                'map_cache_file': map_cache_file, 'ref_samp': ref_samp,
+                'pop_index': pop_index, 'out_file': out_file, 'scale': scale,
+                'block_size': block_size, 'boolean': boolean,
+                'binary_prefixes': binary_prefixes}
+    # Lay out the rows of each chromosome
+    tasks = []
+    row_chroms = []
+    n_rows = 0
+    for chrom, chrom_length, ril_file, founder_file in chromosomes:
+        founder_data = SNPdata(chrom, founder_file, ref_samp)
+        if binary_prefixes:
+            founder_data.useBinaryCopy(binary_prefixes[chrom])
+        n_snps = founder_data.getNumberOfSnps()
+        founder_data.br.close()
+        for start in xrange(0, n_snps, chunk_size):
+            end = min(start+chunk_size, n_snps)
+            tasks.append((chrom, chrom_length, ril_file, founder_file, n_snps, start, end,
+                          n_rows+start, settings))
+        row_chroms.append(np.repeat(chrom, n_snps))
+        n_rows += n_snps
+    out = open_memmap(out_file, mode='w+', dtype=dtype, shape=(n_rows, len(samples)))
+    del out
+    if processes == 1:
+        positions = [_project_chunk(task) for task in tasks]
+    else:
+        pool = Pool(processes)
+        try:
+            positions = pool.map(_project_chunk, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    positions = np.concatenate(positions) if positions else np.array([], dtype=np.int64)
+    np.savez(index_file, chromosomes=np.concatenate(row_chroms), positions=positions,
+             samples=np.array(samples, dtype=str), scale=np.array(scale))
+    return np.load(out_file, mmap_mode='r'), positions
@@ -0,0 +1,427 @@
+import numpy as np
+
+def _expand_ranges(lo, hi):
+    """ Expands the position ranges lo[i]:hi[i] into (array of range numbers,
+    array of positions), with the positions of each range in order
+    """
+    counts = np.maximum(hi - lo, 0)
+    owners = np.repeat(np.arange(len(lo)), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + \
+      np.repeat(lo, counts)
+    return owners, positions
+
+class IntervalIndex(object):
+    """ Index of closed integer intervals backed by sorted NumPy arrays.
+
+    Intervals are kept sorted by their start points, with a second ordering
+    by end points, so that overlap counts and nearest-interval searches
+    reduce to binary searches that can be run over whole arrays of queries
+    at once. Overlap searches descend a tree of the maximum end point under
+    each range of the start ordering, so their cost depends on the number of
+    overlaps found rather than on the length of the longest interval.
+
+    All coordinates are inclusive
+
+    Examples
+    --------
+    >>> from genomfart.utils.interval_index import IntervalIndex
+    >>> index = IntervalIndex([10, 50, 200], [20, 80, 300], ['a', 'b', 'c'])
+    >>> index.ids[index.overlapping(15, 60)]
+    array(['a', 'b'], dtype=object)
+    >>> index.nearest_distances([25, 100, 250], [30, 120, 260])
+    array([ 5, 20,  0])
+    """
+    def __init__(self, starts, ends, ids=None):
+        """ Instantiates the IntervalIndex
+
+        Parameters
+        ----------
+        starts : array-like of ints
+            The start points of the intervals (inclusive)
+        ends : array-like of ints
+            The end points of the intervals (inclusive)
+        ids : iterable, optional
+            An identifier for each interval, in the same order as starts.
+            Identifiers need not be unique. If None, the position of each
+            interval in the input is used
+
+        Raises
+        ------
+        ValueError
+            If starts, ends and ids do not have the same length
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if starts.shape != ends.shape:
+            raise ValueError("starts and ends must have the same length")
+        ## Order of the input intervals when sorted by start point
+        self.source_index = np.argsort(starts, kind='mergesort')
+        ## Start points, sorted
+        self.starts = starts[self.source_index]
+        ## End points, in the same order as the start points
+        self.ends = ends[self.source_index]
+        ## Identifiers, in the same order as the start points
+        if ids is None:
+            self.ids = self.source_index.copy()
+        else:
+            id_arr = np.empty(len(starts), dtype=object)
+            id_arr[:] = list(ids)
+            self.ids = id_arr[self.source_index]
+        ## Indices (into the start ordering) of the intervals sorted by end point
+        self.end_order = np.argsort(self.ends, kind='mergesort')
+        ## End points, sorted
+        self.sorted_ends = self.ends[self.end_order]
+        ## Cached tree of the maximum end point under each node (see _max_end_tree)
+        self._max_ends = None
+        ## Cached (merged starts, merged ends, covered bases before each merged interval)
+        self._merged = None
+    def __len__(self):
+        """ Gets the number of intervals in the index
+        """
+        return len(self.starts)
+    def overlapping(self, start, end):
+        """ Gets the intervals overlapping a query range
+
+        Parameters
+        ----------
+        start : int
+            The start of the query range (inclusive)
+        end : int
+            The end of the query range (inclusive)
+
+        Returns
+        -------
+        Array of indices (into the start ordering) of the overlapping intervals,
+        in order of start point
+        """
+        return self.overlapping_pairs([start], [end])[1]
+    def _max_end_tree(self):
+        """ Gets the implicit binary tree over the start ordering holding the
+        maximum end point under each node. Node 1 is the root, the children of
+        node k are 2k and 2k+1, and the leaves start at half the array's length
+        """
+        if self._max_ends is None:
+            size = 1
+            while size < len(self.ends):
+                size *= 2
+            tree = np.full(2*size, np.iinfo(np.int64).min, dtype=np.int64)
+            tree[size:size+len(self.ends)] = self.ends
+            width = size
+            while width > 1:
+                width //= 2
+                tree[width:2*width] = np.maximum(tree[2*width:4*width:2],
+                                                 tree[2*width+1:4*width:2])
+            self._max_ends = tree
+        return self._max_ends
+    def overlapping_pairs(self, starts, ends):
+        """ Gets every (query, interval) pair that overlaps for a set of
+        query ranges
+
+        Parameters
+        ----------
+        starts : array-like of ints
+            The starts of the query ranges (inclusive)
+        ends : array-like of ints
+            The ends of the query ranges (inclusive)
+
+        Returns
+        -------
+        (array of query indices, array of interval indices into the start ordering),
+        ordered by query and then by interval start
+        """
+        starts = np.atleast_1d(np.asarray(starts, dtype=np.int64))
+        ends = np.atleast_1d(np.asarray(ends, dtype=np.int64))
+        tree = self._max_end_tree()
+        size = len(tree) // 2
+        # Only the intervals before hi start at or before the end of each query
+        his = np.searchsorted(self.starts, ends, 'right')
+        queries = np.flatnonzero(his > 0)
+        nodes = np.ones(len(queries), dtype=np.int64)
+        lows = np.zeros(len(queries), dtype=np.int64)
+        width = size
+        while True:
+            # Drop the nodes that start after hi or that end before the query
+            keep = (tree[nodes] >= starts[queries]) & (lows < his[queries])
+            queries, nodes, lows = queries[keep], nodes[keep], lows[keep]
+            if width == 1:
+                break
+            width //= 2
+            # Descend to both children, keeping the order by query and start
+            queries = np.repeat(queries, 2)
+            nodes = (2*nodes[:, None] + np.array([0, 1])).ravel()
+            lows = (lows[:, None] + np.array([0, width])).ravel()
+        return queries, nodes - size
+    def intersect(self, other):
+        """ Gets every pair of overlapping intervals between this index and another
+
+        Parameters
+        ----------
+        other : IntervalIndex
+            The index to join against
+
+        Returns
+        -------
+        (array of indices into this index's start ordering, array of indices
+        into other's start ordering), ordered by this index and then by other
+        """
+        return other.overlapping_pairs(self.starts, self.ends)
+    def subtract(self, other):
+        """ Removes the bases covered by another index from the intervals of this
+        index
+
+        Parameters
+        ----------
+        other : IntervalIndex
+            The index whose intervals are removed
+
+        Returns
+        -------
+        (array of starts, array of ends, array of indices into this index's
+        start ordering) of the remaining pieces, ordered by source interval and
+        then by start. An interval split by other gives more than one piece, and
+        an interval covered by other gives none
+        """
+        merged = IntervalIndex(*other.merged())
+        queries, inds = merged.overlapping_pairs(self.starts, self.ends)
+        first = np.ones(len(queries), dtype=bool)
+        first[1:] = queries[1:] != queries[:-1]
+        last = np.ones(len(queries), dtype=bool)
+        last[:-1] = first[1:]
+        # Each overlapping merged interval leaves a gap back to the previous one
+        prev_ends = np.empty(len(queries), dtype=np.int64)
+        prev_ends[1:] = merged.ends[inds[:-1]]
+        prev_ends[first] = self.starts[queries[first]] - 1
+        untouched = np.flatnonzero(np.bincount(queries, minlength=len(self.starts)) == 0)
+        piece_starts = np.concatenate((prev_ends + 1, merged.ends[inds[last]] + 1,
+                                       self.starts[untouched]))
+        piece_ends = np.concatenate((merged.starts[inds] - 1, self.ends[queries[last]],
+                                     self.ends[untouched]))
+        sources = np.concatenate((queries, queries[last], untouched))
+        keep = piece_starts <= piece_ends
+        piece_starts, piece_ends, sources = piece_starts[keep], piece_ends[keep], sources[keep]
+        order = np.lexsort((piece_starts, sources))
+        return piece_starts[order], piece_ends[order], sources[order]
+    def closest(self, other):
+        """ Finds the closest interval(s) in another index for every interval
+        of this index
+
+        Parameters
+        ----------
+        other : IntervalIndex
+            The index to search
+
+        Returns
+        -------
+        (array of indices into this index's start ordering, array of indices
+        into other's start ordering, array of distances), ordered by this index
+        and then by other. As with nearest, all overlapping intervals are given
+        if there are any, and otherwise all equidistant closest intervals. An
+        empty other gives empty arrays
+        """
+        return other.nearest_pairs(self.starts, self.ends)
+    def nearest_pairs(self, starts, ends, radius=None):
+        """ Finds the closest interval(s) for each of a set of query ranges
+
+        Parameters
+        ----------
+        starts : array-like of ints
+            The starts of the query ranges (inclusive)
+        ends : array-like of ints
+            The ends of the query ranges (inclusive)
+        radius : int, optional
+            The maximum distance allowed between a query and a returned
+            interval. If None, the search is unbounded
+
+        Returns
+        -------
+        (array of query indices, array of interval indices into the start
+        ordering, array of distances), ordered by query and then by interval.
+        As with nearest, all overlapping intervals are given for a query if
+        there are any, and otherwise all equidistant closest intervals. An empty
+        index gives empty arrays
+        """
+        starts = np.atleast_1d(np.asarray(starts, dtype=np.int64))
+        ends = np.atleast_1d(np.asarray(ends, dtype=np.int64))
+        n = len(starts)
+        if len(self.starts) == 0 or n == 0:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty.copy(), empty.copy()
+        over_queries, over_inds = self.overlapping_pairs(starts, ends)
+        no_overlap = np.bincount(over_queries, minlength=n) == 0
+        left, left_dist, right, right_dist = self._flanking(starts, ends)
+        best = np.minimum(left_dist, right_dist)
+        if radius is not None:
+            no_overlap &= best <= radius
+        # All intervals sharing the closest end point on the left
+        left_queries = np.flatnonzero(no_overlap & (left_dist == best))
+        left_lo = np.searchsorted(self.sorted_ends, self.sorted_ends[left[left_queries]], 'left')
+        owners, positions = _expand_ranges(left_lo, left[left_queries] + 1)
+        left_queries, left_inds = left_queries[owners], self.end_order[positions]
+        # All intervals sharing the closest start point on the right
+        right_queries = np.flatnonzero(no_overlap & (right_dist == best))
+        right_hi = np.searchsorted(self.starts, self.starts[right[right_queries]], 'right')
+        owners, right_inds = _expand_ranges(right[right_queries], right_hi)
+        right_queries = right_queries[owners]
+        queries = np.concatenate((over_queries, left_queries, right_queries))
+        inds = np.concatenate((over_inds, left_inds, right_inds))
+        dists = np.concatenate((np.zeros(len(over_queries), dtype=np.int64),
+                                left_dist[left_queries], right_dist[right_queries]))
+        order = np.lexsort((inds, queries))
+        return queries[order], inds[order], dists[order]
+    def union(self, other):
+        """ Gets the union of the intervals of this index and another as disjoint
+        intervals
+
+        Parameters
+        ----------
+        other : IntervalIndex
+            The index to merge with
+
+        Returns
+        -------
+        (array of starts, array of ends) of the merged intervals, sorted
+        """
+        return IntervalIndex(np.concatenate((self.starts, other.starts)),
+                             np.concatenate((self.ends, other.ends))).merged()
+    def merged(self):
+        """ Gets the union of the intervals as disjoint intervals
+
+        Returns
+        -------
+        (array of starts, array of ends) of the merged intervals, sorted. Intervals
+        that overlap are merged, while those that only abut are not
+        """
+        if self._merged is None:
+            # Running maximum of the ends, so each interval knows how far the
+            # intervals before it reach
+            reach = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+            new_run = np.ones(len(self.starts), dtype=bool)
+            new_run[1:] = self.starts[1:] > reach[:-1]
+            run_starts = np.flatnonzero(new_run)
+            merged_starts = self.starts[run_starts]
+            merged_ends = reach[np.append(run_starts[1:] - 1, len(reach) - 1)] if \
+              len(run_starts) else reach[:0]
+            lengths = merged_ends - merged_starts + 1
+            self._merged = (merged_starts, merged_ends, np.cumsum(lengths) - lengths)
+        return self._merged[0], self._merged[1]
+    def _covered_through(self, positions):
+        """ Counts the bases at or before each position covered by an interval
+        """
+        merged_starts, merged_ends, before = self._merged
+        k = np.searchsorted(merged_starts, positions, 'right') - 1
+        has_k = k >= 0
+        k = np.maximum(k, 0)
+        covered = before[k] + np.minimum(positions, merged_ends[k]) - merged_starts[k] + 1
+        return np.where(has_k, covered, 0)
+    def covered_bases(self, starts, ends):
+        """ Counts the bases covered by at least one interval in each of a set of
+        query ranges
+
+        Parameters
+        ----------
+        starts : array-like of ints
+            The starts of the query ranges (inclusive)
+        ends : array-like of ints
+            The ends of the query ranges (inclusive)
+
+        Returns
+        -------
+        Array with the number of covered bases in each query range
+        """
+        starts = np.atleast_1d(np.asarray(starts, dtype=np.int64))
+        ends = np.atleast_1d(np.asarray(ends, dtype=np.int64))
+        self.merged()
+        if len(self._merged[0]) == 0:
+            return np.zeros(len(starts), dtype=np.int64)
+        return self._covered_through(ends) - self._covered_through(starts - 1)
+    def count_overlapping(self, starts, ends):
+        """ Counts the intervals overlapping each of a set of query ranges
+
+        Parameters
+        ----------
+        starts : array-like of ints
+            The starts of the query ranges (inclusive)
+        ends : array-like of ints
+            The ends of the query ranges (inclusive)
+
+        Returns
+        -------
+        Array with the number of intervals overlapping each query range
+        """
+        # Every interval ending before the query start also starts before the
+        # query end, so the difference of the two counts is the overlap count
+        return np.searchsorted(self.starts, ends, 'right') - \
+          np.searchsorted(self.sorted_ends, starts, 'left')
+    def _flanking(self, starts, ends):
+        """ Finds the closest non-overlapping intervals on either side of
+        a set of query ranges
+
+        Parameters
+        ----------
+        starts : np.ndarray of ints
+            The starts of the query ranges (inclusive)
+        ends : np.ndarray of ints
+            The ends of the query ranges (inclusive)
+
+        Returns
+        -------
+        (left positions in sorted_ends, left distances, right positions in starts,
+        right distances). Positions are -1 and distances are the maximum int64
+        if there is no interval on that side
+        """
+        no_dist = np.iinfo(np.int64).max
+        n = len(self.starts)
+        left = np.searchsorted(self.sorted_ends, starts, 'left') - 1
+        right = np.searchsorted(self.starts, ends, 'right')
+        left_dist = np.full(len(starts), no_dist, dtype=np.int64)
+        has_left = left >= 0
+        left_dist[has_left] = starts[has_left] - self.sorted_ends[left[has_left]]
+        right_dist = np.full(len(starts), no_dist, dtype=np.int64)
+        has_right = right < n
+        right_dist[has_right] = self.starts[right[has_right]] - ends[has_right]
+        right[~has_right] = -1
+        return left, left_dist, right, right_dist
+    def nearest_distances(self, starts, ends):
+        """ Gets the distance from each of a set of query ranges to the
+        closest interval
+
+        Parameters
+        ----------
+        starts : array-like of ints
+            The starts of the query ranges (inclusive)
+        ends : array-like of ints
+            The ends of the query ranges (inclusive)
+
+        Returns
+        -------
+        Array of distances, which are 0 where a query overlaps an interval and
+        -1 if the index is empty
+        """
+        starts = np.atleast_1d(np.asarray(starts, dtype=np.int64))
+        ends = np.atleast_1d(np.asarray(ends, dtype=np.int64))
+        if len(self.starts) == 0:
+            return np.full(len(starts), -1, dtype=np.int64)
+        left, left_dist, right, right_dist = self._flanking(starts, ends)
+        dists = np.minimum(left_dist, right_dist)
+        dists[self.count_overlapping(starts, ends) > 0] = 0
+        return dists
+    def nearest(self, start, end, radius=None):
+        """ Gets the intervals closest to a query range
+
+        Parameters
+        ----------
+        start : int
+            The start of the query range (inclusive)
+        end : int
+            The end of the query range (inclusive)
+        radius : int, optional
+            The maximum distance allowed between the query and a returned
+            interval. If None, the search is unbounded
+
+        Returns
+        -------
+        Array of indices (into the start ordering) of all intervals overlapping
+        the query if there are any. Otherwise, the interval(s) with the shortest
+        distance to the query (more than 1 only if some are equidistant)
+        """
+        return self.nearest_pairs([start], [end], radius)[1]
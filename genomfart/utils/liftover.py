@@ -0,0 +1,299 @@
+import gzip
+import heapq
+import os
+import re
+import shutil
+import sys
+import tempfile
+import numpy as np
+
+if sys.version_info[0] > 2:
+    xrange = range
+
+## Dictionary of base -> complementary base
+_COMPLEMENT = dict(zip('ACGTNacgtn*', 'TGCANtgcan*'))
+## Header lines describing the source assembly, which are dropped from the output
+_ASSEMBLY_HEADER_re = re.compile(r'^##(contig=|sequence-region)')
+
+def _reverse_complement(seq):
+    """ Reverse-complements a sequence, leaving unknown characters as they are
+    """
+    return ''.join(_COMPLEMENT.get(base, base) for base in reversed(seq))
+
+def _open_text(filename, mode='r'):
+    """ Opens a possibly gzipped text file
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode+'t')
+    return open(filename, mode)
+
+def _chrom_ranks(chroms):
+    """ Gets the output sort rank of each chromosome code, ordering numeric
+    chromosome names numerically and placing them before the others
+    """
+    def sort_key(code):
+        label = str(chroms[code])
+        return (0, int(label), '') if label.isdigit() else (1, 0, label)
+    ranks = np.empty(len(chroms), dtype=np.int64)
+    ranks[sorted(xrange(len(chroms)), key=sort_key)] = np.arange(len(chroms))
+    return ranks
+
+def _lift_ranges(mapper, direction, chroms, starts, ends):
+    """ Lifts ranges that must fall within a single aligned segment
+
+    Parameters
+    ----------
+    mapper : genomfart.utils.version_mapper.version_mapper
+        The mapper between the assemblies
+    direction : str
+        'v1_to_v2' or 'v2_to_v1'
+    chroms : np.ndarray
+        The source chromosome of each range
+    starts : np.ndarray of ints
+        The source starts (inclusive)
+    ends : np.ndarray of ints
+        The source ends (inclusive)
+
+    Returns
+    -------
+    (target chrom codes, target starts, target ends, strands, valid mask). The
+    target start is the lesser of the two lifted ends
+    """
+    map_func = mapper.v1_to_v2_map_batch if direction == 'v1_to_v2' else \
+      mapper.v2_to_v1_map_batch
+    start_codes, mapped_starts, strands, start_valid = map_func(chroms, starts)
+    end_codes, mapped_ends, end_strands, end_valid = map_func(chroms, ends)
+    # Both ends must land in the same segment, so the length is kept
+    valid = start_valid & end_valid & (start_codes == end_codes) & \
+      (mapped_ends - mapped_starts == strands.astype(np.int64)*(ends - starts))
+    return (start_codes, np.minimum(mapped_starts, mapped_ends),
+            np.maximum(mapped_starts, mapped_ends), strands, valid)
+
+def _lift_vcf_chunk(lines, mapper, direction, ranks):
+    """ Lifts a chunk of VCF records
+
+    Returns
+    -------
+    (list of (rank, pos, line) for lifted records, list of (line, reason) for
+    rejected records)
+    """
+    fields = [line.rstrip('\n').split('\t', 5) for line in lines]
+    chroms = np.array([f[0] for f in fields])
+    starts = np.array([int(f[1]) for f in fields], dtype=np.int64)
+    ends = starts + np.array([len(f[3]) for f in fields], dtype=np.int64) - 1
+    codes, new_starts, new_ends, strands, valid = _lift_ranges(mapper, direction, chroms,
+                                                               starts, ends)
+    lifted, rejected = [], []
+    for i in xrange(len(fields)):
+        if not valid[i]:
+            rejected.append((lines[i], 'Unmapped or split across segments'))
+            continue
+        chrom, pos, record_id, ref, alts, rest = fields[i]
+        if strands[i] < 0:
+            alt_list = alts.split(',')
+            if any(len(alt) != len(ref) for alt in alt_list if alt != '.'):
+                # Left-anchored indels and symbolic alleles can't be flipped
+                rejected.append((lines[i], 'Indel or symbolic allele on a reversed segment'))
+                continue
+            ref = _reverse_complement(ref)
+            alts = ','.join(alt if alt == '.' else _reverse_complement(alt) for alt in alt_list)
+        code = codes[i]
+        lifted.append((int(ranks[code]), int(new_starts[i]),
+                       '\t'.join((str(mapper.chroms[code]), str(new_starts[i]), record_id,
+                                  ref, alts, rest)) + '\n'))
+    return lifted, rejected
+
+def _lift_gff_chunk(lines, mapper, direction, ranks):
+    """ Lifts a chunk of GFF records
+
+    Returns
+    -------
+    (list of (rank, pos, line) for lifted records, list of (line, reason) for
+    rejected records)
+    """
+    fields = [line.rstrip('\n').split('\t') for line in lines]
+    chroms = np.array([f[0] for f in fields])
+    starts = np.array([int(f[3]) for f in fields], dtype=np.int64)
+    ends = np.array([int(f[4]) for f in fields], dtype=np.int64)
+    codes, new_starts, new_ends, strands, valid = _lift_ranges(mapper, direction, chroms,
+                                                               starts, ends)
+    flipped_strands = {'+': '-', '-': '+'}
+    lifted, rejected = [], []
+    for i in xrange(len(fields)):
+        if not valid[i]:
+            rejected.append((lines[i], 'Unmapped or split across segments'))
+            continue
+        record = fields[i]
+        code = codes[i]
+        record[0] = str(mapper.chroms[code])
+        record[3], record[4] = str(new_starts[i]), str(new_ends[i])
+        if strands[i] < 0:
+            record[6] = flipped_strands.get(record[6], record[6])
+        lifted.append((int(ranks[code]), int(new_starts[i]), '\t'.join(record) + '\n'))
+    return lifted, rejected
+
+def _write_run(records, tmp_dir):
+    """ Sorts a chunk of lifted records and writes them to a temporary file
+
+    Returns
+    -------
+    The filename of the run
+    """
+    records.sort()
+    handle, run_file = tempfile.mkstemp(suffix='.run', dir=tmp_dir)
+    with os.fdopen(handle, 'w') as run_handle:
+        for rank, pos, line in records:
+            run_handle.write('%d\t%d\t%s' % (rank, pos, line))
+    return run_file
+
+def _iter_run(run_file):
+    """ Iterates through the (rank, pos, line) records of a run
+    """
+    with open(run_file) as run_handle:
+        for line in run_handle:
+            rank, pos, record = line.split('\t', 2)
+            yield int(rank), int(pos), record
+
+def _liftover_file(in_file, out_file, mapper, lift_chunk, is_gff, reject_file,
+                   direction, chunk_size, tmp_dir):
+    """ Streams a file through a chunk lifting function, writing each lifted
+    chunk as a sorted run and merging the runs into the output
+
+    Returns
+    -------
+    (number of records lifted, number of records rejected)
+    """
+    if direction not in ('v1_to_v2', 'v2_to_v1'):
+        raise ValueError("direction must be 'v1_to_v2' or 'v2_to_v1'")
+    ranks = _chrom_ranks(mapper.chroms)
+    run_dir = tempfile.mkdtemp(dir=tmp_dir)
+    reject_handle = open(reject_file, 'w') if reject_file else None
+    counts = [0, 0]
+    run_files = []
+    def flush(chunk):
+        lifted, rejected = lift_chunk(chunk, mapper, direction, ranks)
+        counts[0] += len(lifted)
+        counts[1] += len(rejected)
+        if reject_handle:
+            for line, reason in rejected:
+                reject_handle.write('#%s\n%s' % (reason, line))
+        run_files.append(_write_run(lifted, run_dir))
+    try:
+        header = []
+        chunk = []
+        with _open_text(in_file) as in_handle:
+            in_header = True
+            for line in in_handle:
+                if line.startswith('#'):
+                    # Sequences may follow the features of a GFF file
+                    if is_gff and line.startswith('##FASTA'): break
+                    # Comments after the header can't keep their place once sorted
+                    if in_header and not _ASSEMBLY_HEADER_re.match(line):
+                        header.append(line)
+                    continue
+                in_header = False
+                if not line.strip(): continue
+                chunk.append(line)
+                if len(chunk) >= chunk_size:
+                    flush(chunk)
+                    chunk = []
+        if chunk:
+            flush(chunk)
+        with _open_text(out_file, 'w') as out_handle:
+            for line in header:
+                out_handle.write(line)
+            for rank, pos, line in heapq.merge(*[_iter_run(f) for f in run_files]):
+                out_handle.write(line)
+    finally:
+        if reject_handle:
+            reject_handle.close()
+        shutil.rmtree(run_dir)
+    return counts[0], counts[1]
+
+def liftover_vcf(vcf_file, out_file, mapper, reject_file = None, direction = 'v1_to_v2',
+                 chunk_size = 100000, tmp_dir = None):
+    """ Lifts the records of a VCF file to the other version of an assembly
+
+    The file is read in chunks, each lifted with the mapper's batch maps and
+    written to disk as a sorted run, and the runs are merged into the output, so
+    memory is bounded by chunk_size regardless of the file size. Records on
+    reversed segments get reverse-complemented alleles. Records that are
+    unmapped, span more than one segment, or are indels or symbolic alleles on
+    reversed segments are rejected
+
+    Parameters
+    ----------
+    vcf_file : str
+        The VCF file to lift (may be gzipped)
+    out_file : str
+        The file to write the lifted, coordinate-sorted records to (gzipped if
+        it ends with .gz). The header is kept, apart from ##contig lines
+    mapper : genomfart.utils.version_mapper.version_mapper
+        The mapper between the assemblies
+    reject_file : str, optional
+        A file to write rejected records to, each preceded by a '#reason' line
+    direction : str, optional
+        'v1_to_v2' or 'v2_to_v1'
+    chunk_size : int, optional
+        The number of records lifted and sorted in memory at once
+    tmp_dir : str, optional
+        Where to write the sorted runs. Defaults to the system temporary directory
+
+    Raises
+    ------
+    ValueError
+        If the direction isn't recognized
+
+    Returns
+    -------
+    (number of records lifted, number of records rejected)
+
+    Examples
+    --------
+    >>> from genomfart.utils.version_mapper import version_mapper
+    >>> from genomfart.utils.liftover import liftover_vcf
+    >>> mapper = version_mapper('v2_v3_map.txt')
+    >>> n_lifted, n_rejected = liftover_vcf('calls_v2.vcf.gz', 'calls_v3.vcf.gz', mapper,
+    ...                                     reject_file='calls_unmapped.vcf')
+    """
+    return _liftover_file(vcf_file, out_file, mapper, _lift_vcf_chunk, False, reject_file,
+                          direction, chunk_size, tmp_dir)
+
+def liftover_gff(gff_file, out_file, mapper, reject_file = None, direction = 'v1_to_v2',
+                 chunk_size = 100000, tmp_dir = None):
+    """ Lifts the features of a GFF file to the other version of an assembly
+
+    Streams and sorts as liftover_vcf does. Features on reversed segments have
+    their strand flipped. Features that are unmapped or span more than one
+    segment are rejected
+
+    Parameters
+    ----------
+    gff_file : str
+        The GFF file to lift (may be gzipped)
+    out_file : str
+        The file to write the lifted, coordinate-sorted features to (gzipped if
+        it ends with .gz). Directives before the first feature are kept, apart
+        from ##sequence-region lines, and any ##FASTA section is dropped
+    mapper : genomfart.utils.version_mapper.version_mapper
+        The mapper between the assemblies
+    reject_file : str, optional
+        A file to write rejected features to, each preceded by a '#reason' line
+    direction : str, optional
+        'v1_to_v2' or 'v2_to_v1'
+    chunk_size : int, optional
+        The number of features lifted and sorted in memory at once
+    tmp_dir : str, optional
+        Where to write the sorted runs. Defaults to the system temporary directory
+
+    Raises
+    ------
+    ValueError
+        If the direction isn't recognized
+
+    Returns
+    -------
+    (number of features lifted, number of features rejected)
+    """
+    return _liftover_file(gff_file, out_file, mapper, _lift_gff_chunk, True, reject_file,
+                          direction, chunk_size, tmp_dir)
@@ -1,31 +1,74 @@
 from genomfart.parsers.AGPmap import AGPMap
-from genomfart.utils.bigDataFrame import BigDataFrame
-from numba import jit
-import numba as nb
+from genomfart.utils.caching import file_checksum
+from itertools import islice
 import numpy as np
+import os
 import re
+import tempfile
 
-@jit
-def _projectSnpBoolean(parents, popIndex, snpvalues, genotypes, nSamples,
-                       leftmarker, rightmarker, pd):
-    """ Projects SNPs if parents have boolean genotypes
+def _interpolateInterval(leftval, rightval, diff, pd, out):
+    """ Interpolates the sample genotypes at SNPs that share flanking markers.
+    Samples with the same genotype at both markers take it, and only the
+    samples that differ are interpolated
+
+    Parameters
+    ----------
+    leftval : np.ndarray
+        Genotype of each sample at the left flanking marker
+    rightval : np.ndarray
+        Genotype of each sample at the right flanking marker
+    diff : np.ndarray of ints
+        Indices of the samples whose genotypes differ at the two markers
+    pd : np.ndarray of floats
+        Proportion of the distance from the left to the right marker of each SNP
+    out : np.ndarray
+        (SNPs x samples) array to write the genotypes to
     """
-    for i in xrange(nSamples):
-        if parents[popIndex[i]] == 0:
-            snpvalues[i] = 0
-        else:
-            leftval = genotypes[i,leftmarker]
-            rightval = genotypes[i,rightmarker]
-            if (leftval == rightval):
-                snpvalues[i] = leftval
-            else:
-                snpvalues[i] = leftval*(1-pd) + rightval*pd
+    out[:] = leftval
+    if len(diff):
+        weight = pd[:,np.newaxis]
+        out[:,diff] = leftval[diff]*(1-weight) + rightval[diff]*weight
+
+def _projectIntervalBoolean(parents, popIndex, leftval, rightval, diff, pd, out):
+    """ Projects SNPs that share flanking markers if parents have boolean
+    genotypes
+
+    Parameters
+    ----------
+    parents : np.ndarray
+        (SNPs x founders) array of parent genotypes
+    popIndex : np.ndarray of ints
+        Index of the population of each sample
+    leftval, rightval, diff, pd, out
+        As for _interpolateInterval
+    """
+    _interpolateInterval(leftval, rightval, diff, pd, out)
+    out[parents[:,popIndex] == 0] = 0
+
+def _projectIntervalDosage(parents, popIndex, leftval, rightval, diff, pd, out):
+    """ Projects SNPs that share flanking markers if parents have real-valued
+    genotypes, such as dosages or allele probabilities. The interpolated
+    genotype of each sample is scaled by its parent's value, which for values
+    of 0 and 1 is what _projectIntervalBoolean gives
+
+    Parameters
+    ----------
+    parents : np.ndarray
+        (SNPs x founders) array of parent genotypes
+    popIndex : np.ndarray of ints
+        Index of the population of each sample
+    leftval, rightval, diff, pd, out
+        As for _interpolateInterval
+    """
+    _interpolateInterval(leftval, rightval, diff, pd, out)
+    out *= parents[:,popIndex]
 
 class snp_projector:
     """ Class used to project SNPs from a set of founders onto
     descendants
     """
-    def __init__(self, chromosome, chrom_length, mapFile, rilFile, useAgpV2=False):
+    def __init__(self, chromosome, chrom_length, mapFile, rilFile, useAgpV2=False,
+                 mapCacheFile=None, rilCacheFile=None):
         """ Instantiates the projector
 
         Parameters
@@ -40,52 +83,189 @@ class snp_projector:
             The filename for the RIL file
         useAgpV2 : boolean
             Whether this is version 2 of the AGPmap format        
+        mapCacheFile : str, optional
+            An .npz file caching the parsed map (see AGPMap)
+        rilCacheFile : str, optional
+            An .npz file caching the parsed RIL file (see importMarkersForMap)
         """
         self.chromosome = chromosome
         self.chrom_length = chrom_length
-        self.theAGPMap = AGPMap(mapFile, useAgpV2)
+        self.theAGPMap = AGPMap(mapFile, useAgpV2, cacheFile=mapCacheFile)
         self.firstMarker = None
         self.sampleNameMap = {}
         self.genotypes = []
         self.samp_names = []        
-        self.importMarkersForMap(rilFile)
+        ## The last (left marker, right marker) pair, with its sample genotypes
+        # and the samples that differ between them
+        self._intervalCache = None
+        self.importMarkersForMap(rilFile, cacheFile=rilCacheFile)
         self.maxMarker = self.genotypes.shape[1]-1
-    def importMarkersForMap(self, rilFile):
+    def importMarkersForMap(self, rilFile, cacheFile=None, chunkSize=10000):
         """ Reads the data file for a chromosome with the sample allele states
 
+        The file has a header line, then a line per marker whose first 5
+        columns describe the marker and whose remaining columns hold the
+        genotype of each sample. The genotypes are parsed a chunk of lines at a
+        time into a preallocated float32 array
+
         Parameters
         ----------
         rilFile : str
             The filename for the RIL file
+        cacheFile : str, optional
+            An .npz file holding the parsed genotypes. It is loaded instead of
+            parsing rilFile if it was made from a file with the same checksum,
+            and (re)written otherwise. If None, rilFile is always parsed
+        chunkSize : int, optional
+            The number of lines parsed at once
         """
-        rilFile = BigDataFrame(rilFile, header=True, assume_uniform_types=False)
-        nGenos = len(rilFile.colLabels)-5
-        self.genotypes = [[] for x in xrange(nGenos)]
-        self.sampleNameMap = dict((k,v-5) for k,v in rilFile.colLabels.items() if v >= 5)
-        self.samp_names = sorted(self.sampleNameMap.keys(),
-                                 key=lambda x: self.sampleNameMap[x])
-        count = 0
-        nMarkers = 0
         self.firstMarker = self.theAGPMap.getMarkerNumber(self.theAGPMap.getFirstMarkerName(self.chromosome))
-        for row in rilFile.iterrows(cache=False):
-            for samp in self.samp_names:
-                self.genotypes[self.sampleNameMap[samp]].append(row[samp])
-        self.genotypes = np.array(self.genotypes)
-        # header = rilFile.readline().strip().split('\t')
-        # self.firstMarker = int(re.search('\d+',header[2]).group())
-        # nMarkers = len(header)-1
-        # count = 0
-        # while 1:
-        #     data = rilFile.readline().strip()
-        #     if data == '': break
-        #     data = data.split('\t')
-        #     self.sampleNameMap[data[0]] = count
-        #     self.genotypes.append([])
-        #     self.samp_names.append(data[0])
-        #     for j in xrange(nMarkers):
-        #         self.genotypes[-1].append(float(data[j+1]))
-        # self.genotypes = np.array(self.genotypes)
-        # rilFile.close()
+        self._intervalCache = None
+        checksum = file_checksum(rilFile) if cacheFile else None
+        if not (cacheFile and self._loadRilCache(cacheFile, checksum)):
+            self._parseRilFile(rilFile, chunkSize)
+            if cacheFile:
+                try:
+                    self._writeRilCache(cacheFile, checksum)
+                except (IOError, OSError):
+                    pass
+        self.sampleNameMap = dict((name, i) for i, name in enumerate(self.samp_names))
+    def _parseRilFile(self, rilFile, chunkSize):
+        """ Parses the sample names, marker ids and genotypes of a RIL file
+
+        Parameters
+        ----------
+        rilFile : str
+            The filename for the RIL file
+        chunkSize : int
+            The number of lines parsed at once
+        """
+        # There are at most as many marker lines as line breaks, as the header
+        # ends with one
+        with open(rilFile, 'rb') as handle:
+            nBreaks = sum(block.count(b'\n') for block in iter(lambda: handle.read(1<<20), b''))
+        with open(rilFile) as handle:
+            self.samp_names = handle.readline().strip().split('\t')[5:]
+            # Rows are markers, so that the transposed samples x markers view
+            # has contiguous columns for the marker gathers during projection
+            rows = np.empty((nBreaks, len(self.samp_names)), dtype=np.float32)
+            markerIds = []
+            nRows = 0
+            while True:
+                chunk = [line.strip().split('\t') for line in islice(handle, chunkSize)]
+                if not chunk: break
+                chunk = [fields for fields in chunk if fields != ['']]
+                markerIds += [fields[0] for fields in chunk]
+                rows[nRows:nRows+len(chunk)] = [fields[5:] for fields in chunk]
+                nRows += len(chunk)
+        ## The first column of each marker line
+        self.markerIds = np.array(markerIds, dtype=str)
+        self.genotypes = rows[:nRows].T
+    def _writeRilCache(self, cacheFile, checksum):
+        """ Writes the parsed RIL file to an .npz file
+
+        Parameters
+        ----------
+        cacheFile : str
+            The file to write
+        checksum : str
+            The checksum of the RIL file
+        """
+        # Write to a temporary file first so that readers never see a partial cache
+        handle, tempFile = tempfile.mkstemp(suffix='.npz',
+                                            dir=os.path.dirname(os.path.abspath(cacheFile)))
+        try:
+            with os.fdopen(handle, 'wb') as cacheHandle:
+                np.savez(cacheHandle, checksum=np.array(checksum), rows=self.genotypes.T,
+                         samples=np.array(self.samp_names, dtype=str),
+                         markerIds=self.markerIds)
+            os.rename(tempFile, cacheFile)
+        except:
+            os.remove(tempFile)
+            raise
+    def _loadRilCache(self, cacheFile, checksum):
+        """ Loads the parsed RIL file from an .npz file
+
+        Parameters
+        ----------
+        cacheFile : str
+            The file to load
+        checksum : str
+            The checksum of the RIL file
+
+        Returns
+        -------
+        True if the cache was loaded, or False if it is missing, unreadable or
+        was made from a different RIL file
+        """
+        try:
+            with np.load(cacheFile) as cache:
+                if str(cache['checksum']) != checksum:
+                    return False
+                rows = cache['rows']
+                samples = cache['samples'].tolist()
+                markerIds = cache['markerIds']
+        except Exception:
+            # Any problem with the cache means falling back to the RIL file
+            return False
+        self.genotypes = rows.T
+        self.samp_names = samples
+        self.markerIds = markerIds
+        return True
+    def _getFlankingColumns(self, positions):
+        """ Gets the genotype columns of the markers flanking SNPs and how far
+        along the interval between them each SNP is
+
+        Parameters
+        ----------
+        positions : array-like of ints
+            Positions of the SNPs
+
+        Returns
+        -------
+        (left marker columns, right marker columns, proportions of the distance
+        from the left to the right marker). Positions before the first marker
+        use column 0 and position 0, and those past the last marker use the
+        last column and the chromosome length
+        """
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        left_ind, left_pos, right_ind, right_pos = self.theAGPMap.getIntervals(self.chromosome,
+                                                                               positions)
+        left = np.where(left_ind != -1, left_pos, 0)
+        right = np.where(right_ind != -1, right_pos, self.chrom_length)
+        # Proportion of distance of SNP between left and right markers
+        span = right - left
+        pd = np.zeros(len(positions))
+        nonzero = span != 0
+        pd[nonzero] = (positions[nonzero] - left[nonzero]) / span[nonzero].astype(np.float64)
+        markerNumber = self.theAGPMap.markerNumber
+        leftmarker = np.where(left_ind != -1, markerNumber[left_ind]-self.firstMarker+1, 0)
+        rightmarker = np.where(right_ind != -1, markerNumber[right_ind]-self.firstMarker+1,
+                               self.maxMarker)
+        return leftmarker, rightmarker, pd
+    def _getIntervalGenotypes(self, leftmarker, rightmarker):
+        """ Gets the sample genotypes at a pair of flanking markers. The last pair
+        is cached, since consecutive SNPs mostly share their flanking markers
+
+        Parameters
+        ----------
+        leftmarker : int
+            Genotype column of the left marker
+        rightmarker : int
+            Genotype column of the right marker
+
+        Returns
+        -------
+        (genotypes at the left marker, genotypes at the right marker, indices
+        of the samples whose genotypes differ at the two)
+        """
+        key = (leftmarker, rightmarker)
+        if self._intervalCache is None or self._intervalCache[0] != key:
+            leftval = np.ascontiguousarray(self.genotypes[:,leftmarker])
+            rightval = np.ascontiguousarray(self.genotypes[:,rightmarker])
+            self._intervalCache = (key, leftval, rightval,
+                                   np.flatnonzero(leftval != rightval))
+        return self._intervalCache[1:]
     def projectSnpBoolean(self, parents, pos, chrom_length, popIndex):
         """ Projects a SNP onto descendants if parent values are boolean
 
@@ -98,31 +278,105 @@ class snp_projector:
         popIndex : np.ndarray, int
             Indices of the population for each sample
         """
-        left_mark, left_mark_pos, right_mark, right_mark_pos = self.theAGPMap.getInterval(self.chromosome,
-                                                                                          pos)
-        left = left_mark_pos
-        if left is None:
-            left = 0
-        right = right_mark_pos
-        if right is None:
-            right = self.chrom_length
-        # Proportion of distance of SNP between left and right markers
-        pd = 0.
-        if right != left:
-            pd = (float(pos-left))/(float(right-left))
-        leftmarker = 0
-        if left_mark:
-            leftmarker = self.theAGPMap.getMarkerNumber(left_mark)
-            leftmarker = leftmarker-self.firstMarker+1
-        rightmarker = self.maxMarker
-        if right_mark:
-            rightmarker = self.theAGPMap.getMarkerNumber(right_mark)
-            rightmarker = rightmarker - self.firstMarker + 1
-        nSamples = len(popIndex)
-        snpvalues = np.zeros(nSamples)
-        _projectSnpBoolean(parents, popIndex, snpvalues, self.genotypes,
-                           nSamples, leftmarker, rightmarker, pd)
-        return snpvalues
+        return self.projectSnpBlockBoolean(parents, [pos], popIndex)[0]
+    def projectSnpDosage(self, parents, pos, chrom_length, popIndex):
+        """ Projects a SNP onto descendants if parent values are real-valued,
+        e.g. dosages or allele probabilities
+
+        Parameters
+        ----------
+        parents : np.ndarray, float
+            Array of parent genotypes
+        pos : int
+            Position of the SNP
+        popIndex : np.ndarray, int
+            Indices of the population for each sample
+        """
+        return self.projectSnpBlockDosage(parents, [pos], popIndex)[0]
+    def _projectSnpBlock(self, parents, positions, popIndex, out, projectInterval):
+        """ Projects a block of SNPs with a function that projects SNPs sharing
+        flanking markers
+        """
+        parents = np.asarray(parents)
+        if parents.ndim == 1:
+            parents = parents[np.newaxis,:]
+        popIndex = np.asarray(popIndex)
+        if out is None:
+            out = np.zeros((len(parents), len(popIndex)))
+        leftmarker, rightmarker, pd = self._getFlankingColumns(positions)
+        if len(pd) == 0:
+            return out
+        # Boundaries of the runs of SNPs sharing flanking markers
+        bounds = np.flatnonzero((leftmarker[1:] != leftmarker[:-1]) |
+                                (rightmarker[1:] != rightmarker[:-1])) + 1
+        bounds = np.concatenate(([0], bounds, [len(pd)]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            leftval, rightval, diff = self._getIntervalGenotypes(leftmarker[start],
+                                                                 rightmarker[start])
+            projectInterval(parents[start:end], popIndex, leftval, rightval, diff,
+                            pd[start:end], out[start:end])
+        return out
+    def projectSnpBlockBoolean(self, parents, positions, popIndex, out=None):
+        """ Projects a block of SNPs onto descendants at once if parent values
+        are boolean
+
+        The flanking markers and interpolation weights of all the SNPs are
+        found together. Runs of SNPs between the same pair of markers share one
+        gather of the sample genotypes, and only the samples that differ at the
+        two markers are interpolated. Sorting the SNPs by position keeps the
+        runs as long as possible
+
+        Parameters
+        ----------
+        parents : np.ndarray
+            (SNPs x founders) array of parent genotypes
+        positions : array-like of ints
+            Positions of the SNPs, in the same order as the rows of parents
+        popIndex : np.ndarray, int
+            Indices of the population for each sample
+        out : np.ndarray, optional
+            (SNPs x samples) array to write the projection to. If None, a
+            float64 array is allocated
+
+        Returns
+        -------
+        (SNPs x samples) np.ndarray of non-reference allele counts, whose rows
+        are what projectSnpBoolean gives for each SNP
+
+        Examples
+        --------
+        >>> projector = snp_projector(chrom, chrom_length, map_file, ril_file)
+        >>> dosages = projector.projectSnpBlockBoolean(founder_genos, snp_positions, popIndex)
+        """
+        return self._projectSnpBlock(parents, positions, popIndex, out,
+                                     _projectIntervalBoolean)
+    def projectSnpBlockDosage(self, parents, positions, popIndex, out=None):
+        """ Projects a block of SNPs onto descendants at once if parent values
+        are real-valued, e.g. dosages or allele probabilities, in the same way
+        as projectSnpBlockBoolean
+
+        Each sample's interpolated genotype is scaled by the value of its
+        population's parent, so parent values of 0 and 1 give the same result
+        as boolean projection
+
+        Parameters
+        ----------
+        parents : np.ndarray
+            (SNPs x founders) array of parent genotypes
+        positions : array-like of ints
+            Positions of the SNPs, in the same order as the rows of parents
+        popIndex : np.ndarray, int
+            Indices of the population for each sample
+        out : np.ndarray, optional
+            (SNPs x samples) array to write the projection to. If None, a
+            float64 array is allocated
+
+        Returns
+        -------
+        (SNPs x samples) np.ndarray of expected non-reference allele counts
+        """
+        return self._projectSnpBlock(parents, positions, popIndex, out,
+                                     _projectIntervalDosage)
     def projectAllSnps(self, chrom_length, popIndex, founder_data, boolean = True,
                        positions = None, enumerate_snps=False):
         """ Projects all SNPs on a chromsome onto descendants
@@ -136,7 +390,8 @@ class snp_projector:
         founder_data : genomfart.parsers.SNPdata
             Object containing the founder SNP data
         boolean : boolean
-            Whether the parents returned have boolean values for SNPs
+            Whether the parents returned have boolean values for SNPs. If
+            not, they are projected as real values (see projectSnpBlockDosage)
         positions : set of ints
             A set of specific positions to project. If None, all SNPs will
             be projected
@@ -172,8 +427,7 @@ class snp_projector:
         >>> founder_data = SNPdata(chrom, founder_file, 'B73')
         >>> projection = projector.projectAllSnps(chrom_length, popIndex, founder_data)
         """
-        if not boolean:
-            raise NotImplementedError("Non-boolean projection not yet implemented")
+        projectSnp = self.projectSnpBoolean if boolean else self.projectSnpDosage
         founder_data.reset()
         ind = 0
         while (founder_data.next()):
@@ -181,16 +435,59 @@ class snp_projector:
                 if founder_data.getPosition() not in positions:
                     ind += 1
                     continue
-            if boolean:
-                parents = np.array(founder_data.getGenotype(), dtype=np.int64)
-                if enumerate_snps:
-                    yield ind,self.projectSnpBoolean(parents, founder_data.getPosition(),
-                        chrom_length, popIndex)
-                else:
-                    yield self.projectSnpBoolean(parents, founder_data.getPosition(),
-                        chrom_length, popIndex)
+            parents = np.array(founder_data.getGenotype(),
+                               dtype=np.int64 if boolean else np.float64)
+            if enumerate_snps:
+                yield ind,projectSnp(parents, founder_data.getPosition(),
+                    chrom_length, popIndex)
             else:
-                pass
+                yield projectSnp(parents, founder_data.getPosition(),
+                    chrom_length, popIndex)
             ind += 1
+    def projectAllSnpBlocks(self, popIndex, founder_data, block_size = 10000,
+                            positions = None, boolean = True):
+        """ Projects all SNPs on a chromosome onto descendants a block at a time
+
+        Parameters
+        ----------
+        popIndex : np.ndarray, int
+            Indices of the population for each sample
+        founder_data : genomfart.parsers.SNPdata
+            Object containing the founder SNP data
+        block_size : int
+            The number of SNPs read and projected together. Blocks have fewer
+            SNPs if only some positions are projected
+        positions : set of ints
+            A set of specific positions to project. If None, all SNPs will
+            be projected
+        boolean : boolean
+            Whether the parents have boolean values for SNPs. If not, they
+            are projected as real values (see projectSnpBlockDosage)
+
+        Returns
+        -------
+        Generator of (SNP indices, SNP positions, (SNPs x samples) array of
+        non-reference allele counts)
+
+        Examples
+        --------
+        >>> for snp_inds, snp_positions, dosages in projector.projectAllSnpBlocks(popIndex,
+        ...                                                                   founder_data):
+        ...     np.save('chr10_%d.npy' % snp_inds[0], dosages)
+        """
+        projectBlock = self.projectSnpBlockBoolean if boolean else self.projectSnpBlockDosage
+        dtype = np.int64 if boolean else np.float64
+        ind = 0
+        for block_positions, alleles, block_parents in founder_data.iterBlocks(block_size):
+            inds = np.arange(ind, ind+len(block_positions))
+            ind += len(block_positions)
+            if positions is not None:
+                keep = np.array([pos in positions for pos in block_positions.tolist()],
+                                dtype=bool)
+                if not keep.any(): continue
+                inds, block_positions, block_parents = (inds[keep], block_positions[keep],
+                                                        block_parents[keep])
+            yield (inds, block_positions,
+                   projectBlock(block_parents.astype(dtype), block_positions, popIndex))
 
         
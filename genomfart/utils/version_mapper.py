@@ -1,28 +1,38 @@
-from bisect import bisect_right, bisect_left
-from Ranger import Range
 from genomfart.utils.bigDataFrame import BigDataFrame
-import networkx as nx
+from genomfart.utils.caching import file_checksum
+import numpy as np
+import os
 import sys
+import tempfile
 
 if sys.version_info[0] > 2:
     xrange = range
 
+## Data type of the segment tables, with one row per aligned segment. partner_chrom
+# is a chromosome code, strand is 1 or -1 and orientation indexes the raw labels
+# of the orientation column
+SEGMENT_DTYPE = np.dtype([('start', np.int64), ('end', np.int64),
+                          ('partner_chrom', np.int32), ('partner_start', np.int64),
+                          ('partner_end', np.int64), ('strand', np.int8),
+                          ('orientation', np.int32)])
+
 ## Instantiated class used to map between two versions of an assembly
 class version_mapper:
-    ## Graph, where nodes are named as (v1/v2, chrom, end_pt_of_region).
-    #regions are connected by edges
-    graph = None
-    ## Dictionary of chrom -> [end points of regions in v1 assembly]
-    # Same order as v2_end_dict for matching region
-    v1_end_dict = {}
-    ## Dictionary of chrom -> [end points of regions in v2 assembly]
-    # Same order as v1_end_dict for matching region
-    v2_end_dict = {}
+    ## List of chromosome code -> chromosome label, shared by both assemblies
+    chroms = []
+    ## List of orientation code -> orientation label as given in the map file
+    orientation_labels = []
+    ## Dictionary of chrom -> segment table of the v1 assembly (SEGMENT_DTYPE,
+    # sorted by end), whose partners are in v2
+    v1_segments = {}
+    ## Dictionary of chrom -> segment table of the v2 assembly (SEGMENT_DTYPE,
+    # sorted by end), whose partners are in v1
+    v2_segments = {}
     ## Instantiates the version mapper
     # @param map_file A file that maps between the two assemblies. It should have
     # columns v1_chrom, v1_start, v1_end, v2_chrom, v2_start, v2_end, orientation.
     # It is also assumed to be base-1
-    def __init__(self, map_file):
+    def __init__(self, map_file, cache_file = None):
         """
         Instantiates the version mapper
 
@@ -32,36 +42,433 @@ class version_mapper:
             A file that maps between the two assemblies. It should have columns
             v1_chrom, v1_start, v1_end, v2_chrom, v2_start, v2_end, orientation.
             It is also assumed to be base-1
+        cache_file : str, optional
+            An .npz file holding the parsed map. It is loaded instead of parsing
+            map_file if it was made from a file with the same checksum, and
+            (re)written otherwise. If None, map_file is always parsed
         """
+        ## Instantiate the tables
+        self.v1_segments = {}
+        self.v2_segments = {}
+        checksum = file_checksum(map_file) if cache_file else None
+        if cache_file and self._load_cache(cache_file, checksum):
+            return
         map_frame = BigDataFrame(map_file,header=True, assume_uniform_types=False)
-        ## Insantiate the dictionaries
-        self.graph = nx.Graph()
-        self.v1_end_dict = {}
-        self.v2_end_dict = {}
-        ## Fill the dictionaries
-        for i,row in enumerate(map_frame):
-            # Add chromosomes to endpoint dictionaries if necessary
-            if row['v1_chrom'] not in self.v1_end_dict:
-                self.v1_end_dict[row['v1_chrom']] = []
-            if row['v2_chrom'] not in self.v2_end_dict:
-                self.v2_end_dict[row['v2_chrom']] = []
-            # Put in start and end points
-            self.v1_end_dict[row['v1_chrom']].append(row['v1_end'])
-            self.v2_end_dict[row['v2_chrom']].append(row['v2_end'])
-            # Put in edges in graph
-            node1 = ('v1',row['v1_chrom'],row['v1_end'])
-            node2 = ('v2',row['v2_chrom'],row['v2_end'])
-            self.graph.add_edge(node1,node2, strand=row['orientation'])
-            self.graph.node[node1]['start'] = row['v1_start']
-            self.graph.node[node1]['end'] = row['v1_end']
-            self.graph.node[node1]['chrom'] = row['v1_chrom']
-            self.graph.node[node2]['start'] = row['v2_start']
-            self.graph.node[node2]['end'] = row['v2_end']
-            self.graph.node[node2]['chrom'] = row['v2_chrom']
-        ## Sort chromosome lists
-        for dic in (self.v1_end_dict,self.v2_end_dict):
-            for k in dic:
-                dic[k] = sorted(dic[k])
+        self._build_segment_tables([(row['v1_chrom'], row['v1_start'], row['v1_end'],
+                                     row['v2_chrom'], row['v2_start'], row['v2_end'],
+                                     row['orientation']) for row in map_frame])
+        if cache_file:
+            try:
+                self._write_cache(cache_file, checksum)
+            except (IOError, OSError):
+                pass
+    def _write_cache(self, cache_file, checksum):
+        """
+        Writes the chromosome codes and segment tables to an .npz file
+
+        Parameters
+        ----------
+        cache_file : str
+            The file to write
+        checksum : str
+            The checksum of the map file
+        """
+        arrays = {'checksum': np.array(checksum)}
+        for name, labels in (('chroms', self.chroms),
+                             ('orientations', self.orientation_labels)):
+            # Labels are stored as text along with their types, so that the
+            # cache can be loaded without pickling
+            arrays[name] = np.array([str(x) for x in labels], dtype=str)
+            arrays[name+'_types'] = np.array([type(x).__name__ for x in labels], dtype=str)
+        for version, segments in (('v1', self.v1_segments), ('v2', self.v2_segments)):
+            chroms = list(segments)
+            arrays[version+'_chroms'] = np.array([self._chrom_codes[x] for x in chroms],
+                                                 dtype=np.int32)
+            arrays[version+'_counts'] = np.array([len(segments[x]) for x in chroms],
+                                                 dtype=np.int64)
+            arrays[version+'_segments'] = np.concatenate([segments[x] for x in chroms]) if \
+              chroms else np.array([], dtype=SEGMENT_DTYPE)
+        # Write to a temporary file first so that readers never see a partial cache
+        handle, temp_file = tempfile.mkstemp(suffix='.npz',
+                                             dir=os.path.dirname(os.path.abspath(cache_file)))
+        try:
+            with os.fdopen(handle, 'wb') as cache_handle:
+                np.savez(cache_handle, **arrays)
+            os.rename(temp_file, cache_file)
+        except:
+            os.remove(temp_file)
+            raise
+    def _load_cache(self, cache_file, checksum):
+        """
+        Loads the chromosome codes and segment tables from an .npz file
+
+        Parameters
+        ----------
+        cache_file : str
+            The file to load
+        checksum : str
+            The checksum of the map file
+
+        Returns
+        -------
+        True if the cache was loaded, or False if it is missing, unreadable or
+        was made from a different map file
+        """
+        type_funcs = {'int': int, 'float': float, 'str': str}
+        try:
+            with np.load(cache_file) as cache:
+                if str(cache['checksum']) != checksum:
+                    return False
+                self.chroms = [type_funcs[t](x) for x, t in zip(cache['chroms'],
+                                                                 cache['chroms_types'])]
+                self.orientation_labels = [type_funcs[t](x) for x, t in \
+                                           zip(cache['orientations'], cache['orientations_types'])]
+                tables = {}
+                for version in ('v1', 'v2'):
+                    bounds = np.cumsum(np.append(0, cache[version+'_counts']))
+                    segments = cache[version+'_segments']
+                    tables[version] = dict((self.chroms[code], segments[bounds[i]:bounds[i+1]]) \
+                                           for i, code in enumerate(cache[version+'_chroms']))
+        except Exception:
+            # Any problem with the cache means falling back to the map file
+            return False
+        self.v1_segments, self.v2_segments = tables['v1'], tables['v2']
+        self._chrom_codes = dict((x, i) for i, x in enumerate(self.chroms))
+        return True
+    def _build_segment_tables(self, rows):
+        """
+        Builds the chromosome codes and the segment tables of both assemblies
+
+        Parameters
+        ----------
+        rows : list of tuples
+            (v1_chrom, v1_start, v1_end, v2_chrom, v2_start, v2_end, orientation)
+            for each aligned segment
+        """
+        self.chroms = []
+        chrom_codes = {}
+        self.orientation_labels = []
+        orientation_codes = {}
+        v1_rows, v2_rows = {}, {}
+        for v1_chrom, v1_start, v1_end, v2_chrom, v2_start, v2_end, orientation in rows:
+            for chrom in (v1_chrom, v2_chrom):
+                if chrom not in chrom_codes:
+                    chrom_codes[chrom] = len(self.chroms)
+                    self.chroms.append(chrom)
+            if orientation not in orientation_codes:
+                orientation_codes[orientation] = len(self.orientation_labels)
+                self.orientation_labels.append(orientation)
+            strand = 1 if orientation in (1, '+') else -1
+            v1_rows.setdefault(v1_chrom, []).append((v1_start, v1_end, chrom_codes[v2_chrom],
+                                                     v2_start, v2_end, strand,
+                                                     orientation_codes[orientation]))
+            v2_rows.setdefault(v2_chrom, []).append((v2_start, v2_end, chrom_codes[v1_chrom],
+                                                     v1_start, v1_end, strand,
+                                                     orientation_codes[orientation]))
+        self._chrom_codes = chrom_codes
+        for tables, chrom_rows in ((self.v1_segments, v1_rows), (self.v2_segments, v2_rows)):
+            tables.clear()
+            for chrom, segs in chrom_rows.items():
+                table = np.array(segs, dtype=SEGMENT_DTYPE)
+                tables[chrom] = table[np.argsort(table['end'], kind='mergesort')]
+    def _find_chrom(self, chrom):
+        """
+        Gets the label used in the map file for a chromosome, so that e.g. 1
+        and '1' are interchangeable
+
+        Parameters
+        ----------
+        chrom : hashable
+            The chromosome
+
+        Returns
+        -------
+        The chromosome label, or None if it isn't in the map
+        """
+        if chrom in self._chrom_codes:
+            return chrom
+        if str(chrom) in self._chrom_codes:
+            return str(chrom)
+        try:
+            chrom = int(chrom)
+        except (TypeError, ValueError):
+            return None
+        return chrom if chrom in self._chrom_codes else None
+    def _group_by_chrom(self, chroms, n):
+        """
+        Groups queries by chromosome
+
+        Parameters
+        ----------
+        chroms : hashable or array-like
+            The chromosome of all n queries, or of each query
+        n : int
+            The number of queries
+
+        Returns
+        -------
+        List of (chrom, array of query indices)
+        """
+        if np.ndim(chroms) == 0:
+            return [(chroms, np.arange(n))]
+        unique_chroms, inverse = np.unique(np.asarray(chroms), return_inverse=True)
+        order = np.argsort(inverse, kind='mergesort')
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique_chroms)+1))
+        return [(chrom, order[bounds[i]:bounds[i+1]]) for i, chrom in \
+                enumerate(unique_chroms)]
+    def _map_positions(self, segments, chroms, positions):
+        """
+        Maps positions through a set of segment tables
+
+        Parameters
+        ----------
+        segments : dict
+            Dictionary of chrom -> segment table of the source assembly
+        chroms : hashable or array-like
+            The source chromosome of all positions, or of each position
+        positions : array-like of ints
+            The source positions
+
+        Returns
+        -------
+        (target chrom codes, target positions, strands, valid mask)
+        """
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        n = len(positions)
+        target_chroms = np.full(n, -1, dtype=np.int32)
+        target_positions = np.zeros(n, dtype=np.int64)
+        strands = np.zeros(n, dtype=np.int8)
+        valid = np.zeros(n, dtype=bool)
+        for chrom, inds in self._group_by_chrom(chroms, n):
+            table = segments.get(self._find_chrom(chrom))
+            if table is None or len(table) == 0: continue
+            pos = positions[inds]
+            # The only segment that can hold a position is the first ending at or after it
+            seg_inds = np.searchsorted(table['end'], pos, 'left')
+            segs = table[np.minimum(seg_inds, len(table)-1)]
+            ok = (seg_inds < len(table)) & (segs['start'] <= pos)
+            spacing = pos - segs['start']
+            mapped = np.where(segs['strand'] > 0, segs['partner_start'] + spacing,
+                              segs['partner_end'] - spacing)
+            target_chroms[inds] = np.where(ok, segs['partner_chrom'], -1)
+            target_positions[inds] = np.where(ok, mapped, 0)
+            strands[inds] = np.where(ok, segs['strand'], 0)
+            valid[inds] = ok
+        return target_chroms, target_positions, strands, valid
+    def v1_to_v2_map_batch(self, v1_chroms, v1_positions):
+        """
+        Gets the positions in the version 2 genome of many version 1 positions
+        at once (base 1 assumed)
+
+        Parameters
+        ----------
+        v1_chroms : hashable or array-like
+            The version 1 chromosome of all the positions, or an array with the
+            chromosome of each position
+        v1_positions : array-like of ints
+            The version 1 positions
+
+        Returns
+        -------
+        (v2 chrom codes, v2 positions, strands relative to v1, valid mask) as
+        np.ndarrays, one entry per position. Chrom codes index the chroms list and
+        strands are 1 or -1. Positions that don't exist in version 2, including
+        those on chromosomes absent from the map, have a code of -1, a position
+        and strand of 0 and are False in the mask
+
+        Examples
+        --------
+        >>> codes, positions, strands, valid = mapper.v1_to_v2_map_batch(10, snp_positions)
+        >>> v2_chroms = np.array(mapper.chroms, dtype=object)[codes[valid]]
+        """
+        return self._map_positions(self.v1_segments, v1_chroms, v1_positions)
+    def v2_to_v1_map_batch(self, v2_chroms, v2_positions):
+        """
+        Gets the positions in the version 1 genome of many version 2 positions
+        at once (base 1 assumed)
+
+        Parameters
+        ----------
+        v2_chroms : hashable or array-like
+            The version 2 chromosome of all the positions, or an array with the
+            chromosome of each position
+        v2_positions : array-like of ints
+            The version 2 positions
+
+        Returns
+        -------
+        (v1 chrom codes, v1 positions, strands relative to v2, valid mask), as
+        returned by v1_to_v2_map_batch
+        """
+        return self._map_positions(self.v2_segments, v2_chroms, v2_positions)
+    def _map_segments(self, version, chroms, starts, ends):
+        """
+        Maps ranges through the segment tables of one assembly
+
+        Parameters
+        ----------
+        version : str
+            'v1' or 'v2', the assembly of the ranges
+        chroms : hashable or array-like
+            The source chromosome of all ranges, or of each range
+        starts : array-like of ints
+            The source starts (inclusive)
+        ends : array-like of ints
+            The source ends (inclusive)
+
+        Returns
+        -------
+        (query indices, source starts, source ends, target chrom codes, target
+        starts, target ends, strands, orientation codes), the first seven as
+        returned by v1_to_v2_seg_map_batch
+        """
+        segments = self.v1_segments if version == 'v1' else self.v2_segments
+        starts = np.atleast_1d(np.asarray(starts, dtype=np.int64))
+        ends = np.atleast_1d(np.asarray(ends, dtype=np.int64))
+        pieces = []
+        for chrom, inds in self._group_by_chrom(chroms, len(starts)):
+            label = self._find_chrom(chrom)
+            if label not in segments: continue
+            table = segments[label]
+            # The segments are disjoint, so sorting by end also sorts the starts and
+            # a range overlaps the run from the first segment ending at or after its
+            # start to the last starting at or before its end
+            lo = np.searchsorted(table['end'], starts[inds], 'left')
+            counts = np.maximum(np.searchsorted(table['start'], ends[inds], 'right') - lo, 0)
+            queries = np.repeat(inds, counts)
+            segs = table[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - lo,
+                                                             counts)]
+            # Clip each query to the segments it overlaps
+            source_starts = np.maximum(starts[queries], segs['start'])
+            source_ends = np.minimum(ends[queries], segs['end'])
+            spacing = source_starts - segs['start']
+            forward = segs['strand'] > 0
+            target_starts = np.where(forward, segs['partner_start'] + spacing,
+                                     segs['partner_end'] - spacing)
+            target_ends = target_starts + np.where(forward, 1, -1)*(source_ends - source_starts)
+            pieces.append((queries, source_starts, source_ends, segs['partner_chrom'],
+                           target_starts, target_ends, segs['strand'], segs['orientation']))
+        if not pieces:
+            empty = np.array([], dtype=np.int64)
+            return (empty, empty, empty, np.array([], dtype=np.int32), empty, empty,
+                    np.array([], dtype=np.int8), np.array([], dtype=np.int32))
+        columns = [np.concatenate(column) for column in zip(*pieces)]
+        order = np.lexsort((columns[1], columns[0]))
+        return tuple(column[order] for column in columns)
+    def v1_to_v2_seg_map_batch(self, v1_chroms, v1_starts, v1_ends):
+        """
+        Gets the ranges in the version 2 genome of many version 1 ranges at once
+        (base 1 assumed)
+
+        Each range is split at the boundaries of the aligned segments it overlaps
+        and every piece is lifted, so a range yields as many rows as segments it
+        touches, and none if it falls between segments
+
+        Parameters
+        ----------
+        v1_chroms : hashable or array-like
+            The version 1 chromosome of all the ranges, or an array with the
+            chromosome of each range
+        v1_starts : array-like of ints
+            The version 1 start positions (inclusive)
+        v1_ends : array-like of ints
+            The version 1 end positions (inclusive)
+
+        Returns
+        -------
+        (query indices, v1 starts, v1 ends, v2 chrom codes, v2 starts, v2 ends,
+        strands relative to v1) as flat np.ndarrays with one entry per piece,
+        ordered by query and then by v1 start. Chrom codes index the chroms list.
+        As in v1_to_v2_seg_map, the v2 start is the lifted v1 start, so it is
+        greater than the v2 end when the strand is -1
+
+        Examples
+        --------
+        >>> queries, starts, ends, codes, v2_starts, v2_ends, strands = \\
+        ...     mapper.v1_to_v2_seg_map_batch(10, gene_starts, gene_ends)
+        """
+        return self._map_segments('v1', v1_chroms, v1_starts, v1_ends)[:7]
+    def v2_to_v1_seg_map_batch(self, v2_chroms, v2_starts, v2_ends):
+        """
+        Gets the ranges in the version 1 genome of many version 2 ranges at once
+        (base 1 assumed)
+
+        Parameters
+        ----------
+        v2_chroms : hashable or array-like
+            The version 2 chromosome of all the ranges, or an array with the
+            chromosome of each range
+        v2_starts : array-like of ints
+            The version 2 start positions (inclusive)
+        v2_ends : array-like of ints
+            The version 2 end positions (inclusive)
+
+        Returns
+        -------
+        (query indices, v2 starts, v2 ends, v1 chrom codes, v1 starts, v1 ends,
+        strands relative to v2), as returned by v1_to_v2_seg_map_batch
+        """
+        return self._map_segments('v2', v2_chroms, v2_starts, v2_ends)[:7]
+    def _get_segments(self, segments, chrom):
+        """
+        Gets the segment table of a chromosome
+
+        Parameters
+        ----------
+        segments : dict
+            Dictionary of chrom -> segment table of the source assembly
+        chrom : hashable
+            The chromosome
+
+        Raises
+        ------
+        KeyError
+            If the chromosome has no segments
+
+        Returns
+        -------
+        The segment table
+        """
+        label = self._find_chrom(chrom)
+        if label not in segments:
+            raise KeyError(chrom)
+        return segments[label]
+    def _map_position(self, segments, chrom, pos):
+        """
+        Maps a position through a set of segment tables
+
+        Returns
+        -------
+        (target chrom, target position, orientation) or None
+        """
+        table = self._get_segments(segments, chrom)
+        seg_ind = np.searchsorted(table['end'], pos, 'left')
+        if seg_ind >= len(table): return None
+        seg = table[seg_ind]
+        # Check if the position is actually within the interval
+        if not seg['start'] <= pos <= seg['end']: return None
+        spacing = pos - seg['start']
+        if seg['strand'] == 1:
+            target_pos = seg['partner_start'] + spacing
+        else:
+            target_pos = seg['partner_end'] - spacing
+        return (self.chroms[seg['partner_chrom']], int(target_pos),
+                self.orientation_labels[seg['orientation']])
+    def _map_segment(self, version, chrom, start, end):
+        """
+        Maps a range of positions through the segment tables of one assembly
+
+        Returns
+        -------
+        Dictionary of (chrom,start,end)->(target chrom,target start,target end,orientation)
+        """
+        # Raise a KeyError for chromosomes that aren't in the map
+        self._get_segments(self.v1_segments if version == 'v1' else self.v2_segments, chrom)
+        queries, source_starts, source_ends, codes, target_starts, target_ends, strands, \
+          orientations = self._map_segments(version, chrom, [start], [end])
+        return dict(((chrom, int(source_starts[i]), int(source_ends[i])),
+                     (self.chroms[codes[i]], int(target_starts[i]), int(target_ends[i]),
+                      self.orientation_labels[orientations[i]])) for i in xrange(len(queries)))
     ## Gets the position in the version 2 genome if it exists (base 1 assumed)
     # @param v1_chr The version 1 chromosome
     # @param v1_pos The version 1 position
@@ -77,28 +484,17 @@ class version_mapper:
         v1_pos : int
             The version 1 position
 
+        Raises
+        ------
+        KeyError
+            If the chromosome isn't in the map
+
         Returns
         -------
         (v2_chrom,v2_pos,orientation relative to v1) if the position exists in version 2
         or None if it doesn't exist in version 2
         """
-        # Get the index of the end position within v1 in the end dict
-        v1_end_ind = bisect_left(self.v1_end_dict[v1_chr],v1_pos)
-        if v1_end_ind >= len(self.v1_end_dict[v1_chr]): return None
-        # Define the region node for v1
-        v1_node = ('v1',v1_chr,self.v1_end_dict[v1_chr][v1_end_ind])
-        v2_node = self.graph.neighbors(v1_node)[0]
-        # Check if the position is actually within the v1 interval
-        # If not, return None
-        if not self.graph.node[v1_node]['start'] <= v1_pos <= self.graph.node[v1_node]['end']:
-            return None
-        else:
-            orientation = self.graph.edge[v1_node][v2_node]['strand']
-            spacing = v1_pos - self.graph.node[v1_node]['start']
-            if orientation == 1:
-                return (v2_node[1], self.graph.node[v2_node]['start'] + spacing,orientation)
-            else:
-                return (v2_node[1], self.graph.node[v2_node]['end'] - spacing,orientation)
+        return self._map_position(self.v1_segments, v1_chr, v1_pos)
     ## Gets the position in the version 1 genome if it exists (base 1 assumed)
     # @param v2_chr The version 2 chromosome
     # @param v2_pos The version 2 position
@@ -114,28 +510,17 @@ class version_mapper:
         v2_pos : int
             The version 2 position
 
+        Raises
+        ------
+        KeyError
+            If the chromosome isn't in the map
+
         Returns
         -------
         (v1_chrom,v1_pos,orientation relative to v2) if the position exists in version 1
         or None if it doesn't exist in version 1
         """
-        # Get the index of the end position within v2 in the end dict
-        v2_end_ind = bisect_left(self.v2_end_dict[v2_chr],v2_pos)
-        if v2_end_ind >= len(self.v2_end_dict[v2_chr]): return None
-        # Define the region node for v2
-        v2_node = ('v2',v2_chr,self.v2_end_dict[v2_chr][v2_end_ind])
-        v1_node = self.graph.neighbors(v2_node)[0]
-        # Check if the position is actually within the v2 interval
-        # If not, return None
-        if not self.graph.node[v2_node]['start'] <= v2_pos <= self.graph.node[v2_node]['end']:
-            return None
-        else:
-            orientation = self.graph.edge[v2_node][v1_node]['strand']
-            spacing = v2_pos - self.graph.node[v2_node]['start']
-            if orientation == 1:
-                return (v1_node[1], self.graph.node[v1_node]['start'] + spacing,orientation)
-            else:
-                return (v1_node[1], self.graph.node[v1_node]['end'] - spacing,orientation)
+        return self._map_position(self.v2_segments, v2_chr, v2_pos)
     def v1_to_v2_seg_map(self, v1_chr, v1_start, v1_end):
         """
         Gets the ranges of positions in the version 2 genome if they exist (base 1 assumed)
@@ -149,44 +534,17 @@ class version_mapper:
         v1_end : int
             The version 1 end position (inclusive)
 
+        Raises
+        ------
+        KeyError
+            If the chromosome isn't in the map
+
         Returns
         -------
         Dictionary of (v1_chrom,v1_start,v1_end)->(v2_chrom,v2_start,v2_end,orientatoin relative to v1) for
         ranges of positions existing in version 2 
         """
-        # Get index of version 1 segment corresponding to end position in the end dict
-        v1_end_ind = min(bisect_left(self.v1_end_dict[v1_chr],v1_end),len(self.v1_end_dict[v1_chr])-1)
-        # Get index of version 1 segment corresponding to start position in the end dict
-        v1_start_ind = min(bisect_left(self.v1_end_dict[v1_chr],v1_start),len(self.v1_end_dict[v1_chr])-1)
-        return_dict = {}
-        # Go through the range of v1 nodes
-        for i in xrange(min(v1_start_ind,v1_end_ind),max(v1_start_ind,v1_end_ind)+1):
-            # Define the nodes
-            v1_node = ('v1',v1_chr,self.v1_end_dict[v1_chr][i])
-            v2_node = self.graph.neighbors(v1_node)[0]
-            # Check if there is actual overlap between v1 interval and the start+end points
-            ovlap = Range.closed(v1_start,v1_end).isConnected(Range.closed(self.graph.node[v1_node]['start'], \
-                                                        self.graph.node[v1_node]['end']))
-            
-            if ovlap:
-                orientation = self.graph.edge[v1_node][v2_node]['strand']
-                spacing = max(v1_start,self.graph.node[v1_node]['start']) - \
-                  self.graph.node[v1_node]['start']
-                if orientation == 1:
-                    key = (v1_chr,self.graph.node[v1_node]['start']+spacing,min(v1_end,\
-                                                self.graph.node[v1_node]['end']))
-                    seg_length = key[2]-key[1]
-                    val = (v2_node[1],self.graph.node[v2_node]['start']+spacing,\
-                           self.graph.node[v2_node]['start']+spacing+seg_length,orientation)
-                    return_dict[key] = val
-                else:
-                    key = (v1_chr,self.graph.node[v1_node]['start']+spacing,min(v1_end,\
-                                                self.graph.node[v1_node]['end']))
-                    seg_length = key[2]-key[1]
-                    val = (v2_node[1],self.graph.node[v2_node]['end']-spacing, \
-                           self.graph.node[v2_node]['end']-spacing-seg_length,orientation)
-                    return_dict[key] = val
-        return return_dict
+        return self._map_segment('v1', v1_chr, v1_start, v1_end)
     def v2_to_v1_seg_map(self, v2_chr, v2_start, v2_end):
         """
         Gets the ranges of positions in the version 1 genome if they exist (base 1 assumed)
@@ -200,41 +558,14 @@ class version_mapper:
         v2_end : int
             The version 2 end position (inclusive)
 
+        Raises
+        ------
+        KeyError
+            If the chromosome isn't in the map
+
         Returns
         -------
         Dictionary of (v2_chrom,v2_start,v2_end)->(v1_chrom,v1_start,v1_end,orientation relative to v2) for
         ranges of positions existing in version 1 
         """
-        # Get index of version 2 segment corresponding to end position in the end dict
-        v2_end_ind = min(bisect_left(self.v2_end_dict[v2_chr],v2_end),len(self.v2_end_dict[v2_chr])-1)
-        # Get index of version 2 segment corresponding to start position in the end dict
-        v2_start_ind = min(bisect_left(self.v2_end_dict[v2_chr],v2_start),len(self.v2_end_dict[v2_chr])-1)
-        return_dict = {}
-        # Go through the range of v2 nodes
-        for i in xrange(min(v2_start_ind,v2_end_ind),max(v2_start_ind,v2_end_ind)+1):
-            # Define the nodes
-            v2_node = ('v2',v2_chr,self.v2_end_dict[v2_chr][i])
-            v1_node = self.graph.neighbors(v2_node)[0]
-            # Check if there is actual overlap between v2 interval and the start+end points
-            ovlap = Range.closed(v2_start,v2_end).isConnected(Range.closed(self.graph.node[v2_node]['start'], \
-                                                        self.graph.node[v2_node]['end']))
-            if ovlap:
-                orientation = self.graph.edge[v2_node][v1_node]['strand']
-                spacing = max(v2_start,self.graph.node[v2_node]['start']) - \
-                  self.graph.node[v2_node]['start']
-                if orientation == 1:
-                    key = (v2_chr,self.graph.node[v2_node]['start']+spacing,min(v2_end,\
-                                                self.graph.node[v2_node]['end']))
-                    seg_length = key[2]-key[1]
-                    val = (v1_node[1],self.graph.node[v1_node]['start']+spacing,\
-                           self.graph.node[v1_node]['start']+spacing+seg_length,orientation)
-                    return_dict[key] = val
-                else:
-                    key = (v2_chr,self.graph.node[v2_node]['start']+spacing,min(v2_end,\
-                                                self.graph.node[v2_node]['end']))
-                    seg_length = key[2]-key[1]
-                    val = (v1_node[1],self.graph.node[v1_node]['end']-spacing, \
-                           self.graph.node[v1_node]['end']-spacing-seg_length,orientation)
-                    return_dict[key] = val
-        return return_dict
-        
+        return self._map_segment('v2', v2_chr, v2_start, v2_end)